@@ -1,26 +1,110 @@
-import json
 import os
+import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox, Toplevel, filedialog
-import base64
-from io import BytesIO
 try:
-    from PIL import Image, ImageTk
+    from PIL import ImageTk
 except ImportError:
     pass  # User needs to install Pillow
+from batch import copy_paths, delete_paths, move_paths, outermost
+from blobstore import BlobStore, blob_dir
+from compression import DEFAULT_LEVEL
+from history import History
+from journal import Journal, journal_file
+from lazytree import LazyTreeview, view_state_file
+from livesearch import LiveSearch
+from perflog import OPERATIONS, PerfLog, format_record
+from previewcache import PreviewCache, screen_fit, show_full_image
+from saver import SaveScheduler
+from searchindex import SearchIndex
+from snapshot import open_snapshot, save_snapshot, save_snapshot_async
+from shardstore import MANIFEST, ShardStorage, is_manifest
+from sqlitestore import SqliteStorage, copy_blob
+from streamload import LoadCancelled, LoadJob
+from treehash import DIFFERENT, LEFT_ONLY, RIGHT_ONLY, FileHashJob, TreeHash, diff
+from treemodel import Folder, TreeModel, is_entry
+from watcher import FileWatcher, LocalEdits, apply_merge, merge
 
 class DualDataTreeApp:
-    def __init__(self, root):
+    def __init__(self, root, journal=False, compress_level=DEFAULT_LEVEL):
         self.root = root
         self.root.title("Dual DataTree")
         self.good_file = 'good_datatree.json'
         self.bad_file = 'bad_datatree.json'
-        self.good_tree_data = self.load_tree(self.good_file)
-        self.bad_tree_data = self.load_tree(self.bad_file)
+        self.use_journal = journal
+        self.good_journal = Journal(journal_file(self.good_file))
+        self.bad_journal = Journal(journal_file(self.bad_file))
+        self.good_loader = None
+        self.bad_loader = None
+        self.good_load_failed = False
+        self.bad_load_failed = False
+        self.good_store = None
+        self.bad_store = None
+        # Write a sharded store's changes, which its own save collects.
+        self.good_store_saver = None
+        self.bad_store_saver = None
+        # (tree_type, 'cut' or 'copy', paths) while something is on the
+        # clipboard; pasting into the other pane copies across.
+        self.clipboard = None
+        # One log for both panes; operation names say which pane ran them.
+        self.perf = PerfLog()
+        self.good_perf = self.perf.scope("good")
+        self.bad_perf = self.perf.scope("bad")
+        # Both files are read once the window is up; see start_load.
+        self.good_model = TreeModel(Folder())
+        self.bad_model = TreeModel(Folder())
+        self.good_search_index = SearchIndex(self.good_model)
+        self.bad_search_index = SearchIndex(self.bad_model)
+        self.good_history = History(self.good_model)
+        self.bad_history = History(self.bad_model)
+        self.good_hashes = TreeHash(self.good_model)
+        self.bad_hashes = TreeHash(self.bad_model)
+        self.good_edits = LocalEdits(self.good_model)
+        self.bad_edits = LocalEdits(self.bad_model)
+        self.good_reload_job = None
+        self.bad_reload_job = None
+        # None, "panes", or the tree_type being compared with its file.
+        self.compare_mode = None
+        self.compare_job = None
+        self.rediff_id = None
+        self.good_differences = None
+        self.bad_differences = None
+        self.good_blobs = BlobStore(blob_dir(self.good_file))
+        self.bad_blobs = BlobStore(blob_dir(self.bad_file))
+        self.good_previews = PreviewCache(self.root)
+        self.bad_previews = PreviewCache(self.root)
         
         # Maximize window
         self.root.state('zoomed')
         
+        # Menu
+        menubar = tk.Menu(self.root)
+        edit_menu = tk.Menu(menubar, tearoff=0)
+        edit_menu.add_command(label="Undo Good", command=lambda: self.undo("good"))
+        edit_menu.add_command(label="Redo Good", command=lambda: self.redo("good"))
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Undo Bad", command=lambda: self.undo("bad"))
+        edit_menu.add_command(label="Redo Bad", command=lambda: self.redo("bad"))
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Copy Selected Good Items to Bad Tree", command=lambda: self.copy_across("good"))
+        edit_menu.add_command(label="Copy Selected Bad Items to Good Tree", command=lambda: self.copy_across("bad"))
+        menubar.add_cascade(label="Edit", menu=edit_menu)
+        perf_menu = tk.Menu(menubar, tearoff=0)
+        perf_menu.add_command(label="Save Timings as JSON...", command=self.save_timings)
+        profile_menu = tk.Menu(perf_menu, tearoff=0)
+        for operation in OPERATIONS + ('compare',):
+            profile_menu.add_command(label=operation, command=lambda operation=operation: self.profile_next(operation))
+        perf_menu.add_cascade(label="Profile Next", menu=profile_menu)
+        menubar.add_cascade(label="Performance", menu=perf_menu)
+        compare_menu = tk.Menu(menubar, tearoff=0)
+        compare_menu.add_command(label="Good and Bad Trees", command=self.compare_panes)
+        compare_menu.add_command(label="Good Tree and Its File", command=lambda: self.compare_file("good"))
+        compare_menu.add_command(label="Bad Tree and Its File", command=lambda: self.compare_file("bad"))
+        compare_menu.add_separator()
+        compare_menu.add_command(label="Stop Comparing", command=self.stop_compare)
+        menubar.add_cascade(label="Compare", menu=compare_menu)
+        self.root.config(menu=menubar)
+        
         # Main Frame
         self.main_frame = ttk.Frame(self.root, padding="10")
         self.main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -38,17 +122,35 @@ class DualDataTreeApp:
         self.main_frame.columnconfigure(1, weight=1)
         self.main_frame.rowconfigure(0, weight=1)
         
+        # Status bar with the latency of the last operation
+        self.perf_var = tk.StringVar()
+        ttk.Label(self.root, textvariable=self.perf_var, relief=tk.SUNKEN, padding=(5, 2)).grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.perf.on_record = lambda record: self.perf_var.set(format_record(record))
+        
         # Good Tree Setup
-        self.good_treeview = ttk.Treeview(self.good_frame, columns=("Content",), show="tree")
+        self.good_treeview = ttk.Treeview(self.good_frame, columns=("Content",), show="tree", selectmode="extended")
         self.good_treeview.column("Content", width=200, stretch=True)
         self.good_treeview.heading("Content", text="Content")
         self.good_treeview.grid(row=0, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S))
         good_scrollbar = ttk.Scrollbar(self.good_frame, orient=tk.VERTICAL, command=self.good_treeview.yview)
         self.good_treeview.configure(yscroll=good_scrollbar.set)
         good_scrollbar.grid(row=0, column=3, sticky=(tk.N, tk.S))
+        self.good_view = LazyTreeview(self.good_treeview, self.good_model)
+        self.good_view.row_tags = lambda path: self.compare_tags("good", path)
+        self.good_treeview.tag_configure('only', background='#d9f2d9')
+        self.good_treeview.tag_configure('different', background='#fff0b3')
+        self.good_treeview.tag_configure('same', foreground='gray50')
+        self.good_model.subscribe(lambda changes: self.compare_changed("good"))
         self.good_treeview.bind("<Double-Button-1>", lambda e: self.view_entry(e, "good"))
         self.good_treeview.bind("<Button-3>", lambda e: self.on_right_click(e, "good"))
         self.good_treeview.bind("<space>", lambda e: self.toggle_tree("good"))
+        self.good_treeview.bind("<Control-z>", lambda e: self.undo("good"))
+        self.good_treeview.bind("<Control-y>", lambda e: self.redo("good"))
+        self.good_treeview.bind("<Control-Z>", lambda e: self.redo("good"))
+        self.good_treeview.bind("<Control-x>", lambda e: self.cut_selected("good"))
+        self.good_treeview.bind("<Control-c>", lambda e: self.copy_selected("good"))
+        self.good_treeview.bind("<Control-v>", lambda e: self.paste("good"))
+        self.good_treeview.bind("<Delete>", lambda e: self.delete_selected("good"))
         
         ttk.Button(self.good_frame, text="Add Good Folder", command=lambda: self.add_folder("good")).grid(row=1, column=0, pady=5, sticky=tk.W)
         ttk.Button(self.good_frame, text="Add Good Entry", command=lambda: self.add_entry("good")).grid(row=1, column=1, pady=5, sticky=tk.W)
@@ -56,21 +158,52 @@ class DualDataTreeApp:
         self.good_search_var = tk.StringVar()
         ttk.Entry(self.good_frame, textvariable=self.good_search_var).grid(row=2, column=0, columnspan=2, pady=5, sticky=(tk.W, tk.E))
         ttk.Button(self.good_frame, text="Search Good", command=lambda: self.search("good")).grid(row=2, column=2, pady=5, sticky=tk.W)
+        self.good_live_search = LiveSearch(self.root, self.good_frame, self.good_search_var, self.good_search_index, self.good_view.reveal, perf=self.good_perf)
+        self.good_live_search.frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.good_live_search.frame.grid_remove()
+        self.good_save_status_var = tk.StringVar(value="saved")
+        ttk.Label(self.good_frame, textvariable=self.good_save_status_var).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        self.good_saver = SaveScheduler(self.root, self.good_file, self.good_model.snapshot, on_status=self.good_save_status_var.set, journal=self.good_journal, on_written=save_snapshot, perf=self.good_perf,
+                                        on_snapshot=self.good_edits.mark, on_saved=lambda mark: self.file_saved("good", mark), level=compress_level)
+        if self.use_journal:
+            self.good_model.subscribe(lambda changes: self.journal_changes("good", changes))
+        self.good_load_frame = ttk.Frame(self.good_frame)
+        self.good_load_frame.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.good_load_progress = ttk.Progressbar(self.good_load_frame, mode='determinate')
+        self.good_load_progress.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        self.good_load_status_var = tk.StringVar()
+        ttk.Label(self.good_load_frame, textvariable=self.good_load_status_var).grid(row=0, column=1, padx=5)
+        ttk.Button(self.good_load_frame, text="Cancel", command=lambda: self.cancel_load("good")).grid(row=0, column=2)
+        self.good_load_frame.columnconfigure(0, weight=1)
+        self.good_load_frame.grid_remove()
         
         self.good_frame.columnconfigure(0, weight=1)
         self.good_frame.rowconfigure(0, weight=1)
         
         # Bad Tree Setup
-        self.bad_treeview = ttk.Treeview(self.bad_frame, columns=("Content",), show="tree")
+        self.bad_treeview = ttk.Treeview(self.bad_frame, columns=("Content",), show="tree", selectmode="extended")
         self.bad_treeview.column("Content", width=200, stretch=True)
         self.bad_treeview.heading("Content", text="Content")
         self.bad_treeview.grid(row=0, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S))
         bad_scrollbar = ttk.Scrollbar(self.bad_frame, orient=tk.VERTICAL, command=self.bad_treeview.yview)
         self.bad_treeview.configure(yscroll=bad_scrollbar.set)
         bad_scrollbar.grid(row=0, column=3, sticky=(tk.N, tk.S))
+        self.bad_view = LazyTreeview(self.bad_treeview, self.bad_model)
+        self.bad_view.row_tags = lambda path: self.compare_tags("bad", path)
+        self.bad_treeview.tag_configure('only', background='#d9f2d9')
+        self.bad_treeview.tag_configure('different', background='#fff0b3')
+        self.bad_treeview.tag_configure('same', foreground='gray50')
+        self.bad_model.subscribe(lambda changes: self.compare_changed("bad"))
         self.bad_treeview.bind("<Double-Button-1>", lambda e: self.view_entry(e, "bad"))
         self.bad_treeview.bind("<Button-3>", lambda e: self.on_right_click(e, "bad"))
         self.bad_treeview.bind("<space>", lambda e: self.toggle_tree("bad"))
+        self.bad_treeview.bind("<Control-z>", lambda e: self.undo("bad"))
+        self.bad_treeview.bind("<Control-y>", lambda e: self.redo("bad"))
+        self.bad_treeview.bind("<Control-Z>", lambda e: self.redo("bad"))
+        self.bad_treeview.bind("<Control-x>", lambda e: self.cut_selected("bad"))
+        self.bad_treeview.bind("<Control-c>", lambda e: self.copy_selected("bad"))
+        self.bad_treeview.bind("<Control-v>", lambda e: self.paste("bad"))
+        self.bad_treeview.bind("<Delete>", lambda e: self.delete_selected("bad"))
         
         ttk.Button(self.bad_frame, text="Add Bad Folder", command=lambda: self.add_folder("bad")).grid(row=1, column=0, pady=5, sticky=tk.W)
         ttk.Button(self.bad_frame, text="Add Bad Entry", command=lambda: self.add_entry("bad")).grid(row=1, column=1, pady=5, sticky=tk.W)
@@ -78,6 +211,24 @@ class DualDataTreeApp:
         self.bad_search_var = tk.StringVar()
         ttk.Entry(self.bad_frame, textvariable=self.bad_search_var).grid(row=2, column=0, columnspan=2, pady=5, sticky=(tk.W, tk.E))
         ttk.Button(self.bad_frame, text="Search Bad", command=lambda: self.search("bad")).grid(row=2, column=2, pady=5, sticky=tk.W)
+        self.bad_live_search = LiveSearch(self.root, self.bad_frame, self.bad_search_var, self.bad_search_index, self.bad_view.reveal, perf=self.bad_perf)
+        self.bad_live_search.frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.bad_live_search.frame.grid_remove()
+        self.bad_save_status_var = tk.StringVar(value="saved")
+        ttk.Label(self.bad_frame, textvariable=self.bad_save_status_var).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        self.bad_saver = SaveScheduler(self.root, self.bad_file, self.bad_model.snapshot, on_status=self.bad_save_status_var.set, journal=self.bad_journal, on_written=save_snapshot, perf=self.bad_perf,
+                                        on_snapshot=self.bad_edits.mark, on_saved=lambda mark: self.file_saved("bad", mark), level=compress_level)
+        if self.use_journal:
+            self.bad_model.subscribe(lambda changes: self.journal_changes("bad", changes))
+        self.bad_load_frame = ttk.Frame(self.bad_frame)
+        self.bad_load_frame.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.bad_load_progress = ttk.Progressbar(self.bad_load_frame, mode='determinate')
+        self.bad_load_progress.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        self.bad_load_status_var = tk.StringVar()
+        ttk.Label(self.bad_load_frame, textvariable=self.bad_load_status_var).grid(row=0, column=1, padx=5)
+        ttk.Button(self.bad_load_frame, text="Cancel", command=lambda: self.cancel_load("bad")).grid(row=0, column=2)
+        self.bad_load_frame.columnconfigure(0, weight=1)
+        self.bad_load_frame.grid_remove()
         
         self.bad_frame.columnconfigure(0, weight=1)
         self.bad_frame.rowconfigure(0, weight=1)
@@ -85,144 +236,162 @@ class DualDataTreeApp:
         # Track tree states
         self.good_tree_open = True
         self.bad_tree_open = True
-        self.update_treeview("good")
-        self.update_treeview("bad")
-    
-    def load_tree(self, file_path):
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            self.convert_entries(data)
-            return data
-        return {}
-    
-    def convert_entries(self, node):
-        for key, val in list(node.items()):
-            if isinstance(val, str):
-                node[key] = {"content": val, "image": None}
-            elif isinstance(val, dict) and 'content' not in val:
-                self.convert_entries(val)
+        # Each file is watched once it is loaded; changes other programs
+        # make to it are merged in.
+        self.good_watcher = FileWatcher(self.root, None, lambda signature: self.file_changed("good"),
+                                        paused=lambda: self.good_saver.worker is not None or self.good_loader is not None).start()
+        self.bad_watcher = FileWatcher(self.root, None, lambda signature: self.file_changed("bad"),
+                                       paused=lambda: self.bad_saver.worker is not None or self.bad_loader is not None).start()
+        self.start_load("good", self.good_file, None)
+        self.start_load("bad", self.bad_file, None)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    def refresh_snapshot(self, tree_type):
+        # Parsed from JSON, so write the snapshot the next start opens from.
+        model = self.good_model if tree_type == "good" else self.bad_model
+        file_path = self.good_file if tree_type == "good" else self.bad_file
+        if model.source is None and os.path.exists(file_path):
+            save_snapshot_async(file_path, model.snapshot())
     
     def save_tree(self, tree_type):
+        saver = self.good_saver if tree_type == "good" else self.bad_saver
+        journal = self.good_journal if tree_type == "good" else self.bad_journal
+        store = self.good_store if tree_type == "good" else self.bad_store
+        # A database commits each change itself and a sharded tree rewrites
+        # the shards that changed. In journal mode each change is already on
+        # disk too; only compact.
+        if store is not None:
+            store_saver = self.good_store_saver if tree_type == "good" else self.bad_store_saver
+            if store_saver is not None:
+                store_saver.schedule()
+            return
+        if self.use_journal and not journal.needs_compaction():
+            return
+        saver.schedule()
+    
+    def file_saved(self, tree_type, mark):
+        (self.good_edits if tree_type == "good" else self.bad_edits).saved(mark)
+        (self.good_watcher if tree_type == "good" else self.bad_watcher).expect()
+    
+    def file_changed(self, tree_type):
+        # The file is read without the journal: records there are edits made
+        # here, which the merge keeps.
+        if (self.good_store if tree_type == "good" else self.bad_store) is not None:
+            return
+        if (self.good_reload_job if tree_type == "good" else self.bad_reload_job) is not None:
+            return
         file_path = self.good_file if tree_type == "good" else self.bad_file
-        tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-        with open(file_path, 'w') as f:
-            json.dump(tree_data, f, indent=4)
-    
-    def get_open_state(self, treeview, parent=''):
-        open_state = {}
-        for item in treeview.get_children(parent):
-            text = treeview.item(item)['text']
-            if text.endswith('/'):
-                open_state[text[:-1]] = treeview.item(item)['open']
-                open_state.update(self.get_open_state(treeview, item))
-        return open_state
-    
-    def restore_open_state(self, treeview, open_state, parent='', data=None):
-        if data is None:
-            data = self.good_tree_data if treeview == self.good_treeview else self.bad_tree_data
-        for name in data:
-            item_id = None
-            for item in treeview.get_children(parent):
-                if treeview.item(item)['text'] == f"{name}/":
-                    item_id = item
-                    break
-            if item_id and name in open_state:
-                treeview.item(item_id, open=open_state[name])
-                if isinstance(data[name], dict) and 'content' not in data[name]:
-                    self.restore_open_state(treeview, open_state, item_id, data[name])
-    
-    def update_treeview(self, tree_type, parent='', data=None):
-        treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
-        if data is None:
-            data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-        open_state = self.get_open_state(treeview)
-        treeview.delete(*treeview.get_children(parent))
-        for name, value in sorted(data.items()):
-            if isinstance(value, dict):
-                if 'content' in value:
-                    content = value['content']
-                    treeview.insert(parent, 'end', text=name, values=(content,))
-                else:
-                    node_id = treeview.insert(parent, 'end', text=f"{name}/", values=("",))
-                    self.update_treeview(tree_type, node_id, value)
-        self.restore_open_state(treeview, open_state)
+        job = FileHashJob(self.root, file_path, lambda hashes, error: self.merge_file(tree_type, file_path, job, hashes, error), replay=False)
+        if tree_type == "good":
+            self.good_reload_job = job.start()
+        else:
+            self.bad_reload_job = job.start()
+    
+    def merge_file(self, tree_type, file_path, job, hashes, error):
+        if job is not (self.good_reload_job if tree_type == "good" else self.bad_reload_job):
+            return
+        if tree_type == "good":
+            self.good_reload_job = None
+        else:
+            self.bad_reload_job = None
+        loader = self.good_loader if tree_type == "good" else self.bad_loader
+        if file_path != (self.good_file if tree_type == "good" else self.bad_file) or loader is not None:
+            return
+        if error is not None:
+            # Probably caught half written; the next change is read again.
+            self.perf_var.set(f"Could not reload {os.path.basename(file_path)}: {error}")
+            return
+        model = self.good_model if tree_type == "good" else self.bad_model
+        edits = self.good_edits if tree_type == "good" else self.bad_edits
+        moves, conflicts = merge(self.good_hashes if tree_type == "good" else self.bad_hashes, hashes, edits)
+        use_disk = False
+        if conflicts:
+            paths = '\n'.join('/'.join(path) for path, _ in conflicts[:10]) + ('\n...' if len(conflicts) > 10 else '')
+            use_disk = messagebox.askyesno("File Changed", f"{os.path.basename(file_path)} was changed by another program, "
+                                           f"which also changed what was edited in the {tree_type} tree:\n\n{paths}\n\n"
+                                           "Use the version on disk for these? No keeps the edits made here.")
+        apply_merge(model, edits, moves, conflicts, use_disk)
+        if conflicts and not use_disk:
+            self.save_tree(tree_type)
+        self.perf_var.set(f"Merged {len(moves) + (len(conflicts) if use_disk else 0)} changes from {os.path.basename(file_path)}.")
+    
+    def journal_changes(self, tree_type, changes):
+        # Merged changes are already in the file.
+        if (self.good_store if tree_type == "good" else self.bad_store) is not None:
+            return
+        if (self.good_model if tree_type == "good" else self.bad_model).external:
+            return
+        journal = self.good_journal if tree_type == "good" else self.bad_journal
+        try:
+            journal.append(changes)
+        except OSError:
+            saver = self.good_saver if tree_type == "good" else self.bad_saver
+            saver.schedule()
+    
+    def update_treeview(self, tree_type):
+        view = self.good_view if tree_type == "good" else self.bad_view
+        perf = self.good_perf if tree_type == "good" else self.bad_perf
+        timer = perf.start('update_treeview')
+        rows = view.rows_touched
+        view.refresh()
+        perf.record(timer.stop(rows=view.rows_touched - rows))
     
     def toggle_tree(self, tree_type):
-        treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
+        view = self.good_view if tree_type == "good" else self.bad_view
         is_open = self.good_tree_open if tree_type == "good" else self.bad_tree_open
         is_open = not is_open
         if tree_type == "good":
             self.good_tree_open = is_open
         else:
             self.bad_tree_open = is_open
-        def set_tree_state(parent='', state=is_open):
-            for item in treeview.get_children(parent):
-                if treeview.item(item)['text'].endswith('/'):
-                    treeview.item(item, open=state)
-                    set_tree_state(item, state)
-        set_tree_state()
-    
-    def get_folder_paths(self, tree_type, node=None, path='', paths=None):
-        if paths is None:
-            paths = []
-        if node is None:
-            node = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-        for name, value in node.items():
-            full_path = f"{path}/{name}" if path else name
-            if isinstance(value, dict) and 'content' not in value:
-                paths.append(full_path)
-                self.get_folder_paths(tree_type, value, full_path, paths)
-        return sorted(paths)
-    
-    def get_item_path(self, treeview, item):
-        path = []
-        while item:
-            text = treeview.item(item)['text']
-            if text.endswith('/'):
-                text = text[:-1]
-            path.append(text)
-            item = treeview.parent(item)
-        return '/'.join(reversed(path))
-    
-    def add_folder(self, tree_type, parent_path=''):
+        view.set_all_open(is_open)
+    
+    def get_folder_paths(self, tree_type):
+        model = self.good_model if tree_type == "good" else self.bad_model
+        return sorted(model.folder_paths())
+    
+    def get_item_path(self, tree_type, item):
+        # Path tuples come from the view, so names containing '/' survive.
+        return (self.good_view if tree_type == "good" else self.bad_view).item_paths[item]
+    
+    def add_folder(self, tree_type, parent_path=()):
+        if self.busy(tree_type):
+            return
         def submit_folder(event=None):
             path = folder_var.get().strip()
             if not path:
                 messagebox.showerror("Error", "Folder path cannot be empty.")
                 return
-            full_path = f"{parent_path}/{path}" if parent_path else path
-            parts = full_path.strip('/').split('/')
-            tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-            current = tree_data
-            for part in parts:
-                if part not in current:
-                    current[part] = {}
-                elif not isinstance(current[part], dict) or 'content' in current[part]:
-                    messagebox.showerror("Error", f"'{part}' is an entry, cannot add folder inside it.")
-                    return
-                current = current[part]
+            parts = list(parent_path) + path.strip('/').split('/')
+            model = self.good_model if tree_type == "good" else self.bad_model
+            try:
+                model.add_folder(parts)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.save_tree(tree_type)
-            self.update_treeview(tree_type)
             folder_window.destroy()
         
         folder_window = Toplevel(self.root)
-        folder_window.title(f"Add {'Good' if tree_type == 'good' else 'Bad'} Folder")
+        title = f"Add {'Good' if tree_type == 'good' else 'Bad'} Folder"
+        folder_window.title(f"{title} in {'/'.join(parent_path)}" if parent_path else title)
         ttk.Label(folder_window, text="Folder Path (e.g., subfolder):").grid(row=0, column=0, padx=5, pady=5)
-        folder_var = tk.StringVar(value=parent_path)
+        folder_var = tk.StringVar()
         ttk.Entry(folder_window, textvariable=folder_var).grid(row=0, column=1, padx=5, pady=5)
         folder_window.bind('<Return>', submit_folder)
         ttk.Button(folder_window, text="Submit", command=submit_folder).grid(row=1, column=0, columnspan=2, pady=5)
     
-    def add_entry(self, tree_type, parent_path=''):
-        image_b64 = [None]
+    def add_entry(self, tree_type, parent_path=()):
+        if self.busy(tree_type):
+            return
+        blobs = self.good_blobs if tree_type == "good" else self.bad_blobs
+        image_ref = [None]
         image_status_var = tk.StringVar(value="No image selected")
         
         def select_image():
             file = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg;*.jpeg;*.png")])
             if file:
-                with open(file, 'rb') as f:
-                    image_b64[0] = base64.b64encode(f.read()).decode('utf-8')
+                image_ref[0] = blobs.put_file(file)
                 image_status_var.set(f"Image selected: {os.path.basename(file)}")
         
         def submit_entry(event=None):
@@ -232,36 +401,23 @@ class DualDataTreeApp:
             if not name or not content:
                 messagebox.showerror("Error", "Entry name and content cannot be empty.")
                 return
-            path = f"{folder}/{name}" if folder else name
-            parts = path.strip('/').split('/')
+            parts = list(folders.get(folder, ())) + name.strip('/').split('/')
             name = parts.pop()
-            tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-            current = tree_data
-            for part in parts:
-                if part not in current:
-                    current[part] = {}
-                elif not isinstance(current[part], dict) or 'content' in current[part]:
-                    messagebox.showerror("Error", f"'{part}' is an entry, cannot traverse into it.")
-                    return
-                current = current[part]
-            if name in current:
-                if isinstance(current[name], dict) and 'content' not in current[name]:
-                    messagebox.showerror("Error", f"'{name}' is a folder, cannot overwrite with entry.")
-                    return
-            entry_data = {"content": content}
-            if image_b64[0]:
-                entry_data["image"] = image_b64[0]
-            current[name] = entry_data
+            model = self.good_model if tree_type == "good" else self.bad_model
+            try:
+                model.add_entry(parts, name, content, image_ref[0] or None)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.save_tree(tree_type)
-            self.update_treeview(tree_type)
             entry_window.destroy()
         
         entry_window = Toplevel(self.root)
         entry_window.title(f"Add {'Good' if tree_type == 'good' else 'Bad'} Entry")
         ttk.Label(entry_window, text="Parent Folder:").grid(row=0, column=0, padx=5, pady=5)
-        folder_var = tk.StringVar(value=parent_path)
-        folders = [''] + self.get_folder_paths(tree_type)
-        ttk.Combobox(entry_window, textvariable=folder_var, values=folders, state='readonly').grid(row=0, column=1, padx=5, pady=5)
+        folder_var = tk.StringVar(value='/'.join(parent_path))
+        folders = {'/'.join(path): path for path in self.get_folder_paths(tree_type)}
+        ttk.Combobox(entry_window, textvariable=folder_var, values=[''] + list(folders), state='readonly').grid(row=0, column=1, padx=5, pady=5)
         ttk.Label(entry_window, text="Entry Name:").grid(row=1, column=0, padx=5, pady=5)
         entry_name_var = tk.StringVar()
         ttk.Entry(entry_window, textvariable=entry_name_var).grid(row=1, column=1, padx=5, pady=5)
@@ -275,29 +431,25 @@ class DualDataTreeApp:
         ttk.Button(entry_window, text="Submit", command=submit_entry).grid(row=5, column=0, columnspan=2, pady=5)
     
     def edit_entry(self, tree_type, item):
-        treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
-        tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-        path = self.get_item_path(treeview, item)
-        parts = path.split('/')
-        name = parts.pop()
-        current = tree_data
-        for part in parts:
-            current = current[part]
-        value = current[name]
-        content = value['content']
-        image_b64 = [value.get('image')]
-        has_image = image_b64[0] is not None
+        if self.busy(tree_type):
+            return
+        model = self.good_model if tree_type == "good" else self.bad_model
+        blobs = self.good_blobs if tree_type == "good" else self.bad_blobs
+        path = self.get_item_path(tree_type, item)
+        value = model.node(path)
+        content = value.content
+        image_ref = [value.image]
+        has_image = image_ref[0] is not None
         image_status_var = tk.StringVar(value="Image attached" if has_image else "No image")
         
         def select_image():
             file = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg;*.jpeg;*.png")])
             if file:
-                with open(file, 'rb') as f:
-                    image_b64[0] = base64.b64encode(f.read()).decode('utf-8')
+                image_ref[0] = blobs.put_file(file)
                 image_status_var.set(f"New image selected: {os.path.basename(file)}")
         
         def remove_image():
-            image_b64[0] = None
+            image_ref[0] = None
             image_status_var.set("No image")
         
         def submit_edit(event=None):
@@ -305,17 +457,13 @@ class DualDataTreeApp:
             if not new_content:
                 messagebox.showerror("Error", "Content cannot be empty.")
                 return
-            value['content'] = new_content
-            if image_b64[0] is None:
-                value.pop('image', None)
-            else:
-                value['image'] = image_b64[0]
+            (self.good_previews if tree_type == "good" else self.bad_previews).invalidate(path)
+            model.edit_entry(path, new_content, image_ref[0])
             self.save_tree(tree_type)
-            self.update_treeview(tree_type)
             edit_window.destroy()
         
         edit_window = Toplevel(self.root)
-        edit_window.title(f"Edit {'Good' if tree_type == 'good' else 'Bad'} Entry: {path}")
+        edit_window.title(f"Edit {'Good' if tree_type == 'good' else 'Bad'} Entry: {'/'.join(path)}")
         ttk.Label(edit_window, text="Content:").grid(row=0, column=0, padx=5, pady=5)
         content_var = tk.StringVar(value=content)
         ttk.Entry(edit_window, textvariable=content_var).grid(row=0, column=1, padx=5, pady=5)
@@ -328,31 +476,178 @@ class DualDataTreeApp:
         ttk.Button(edit_window, text="Submit", command=submit_edit).grid(row=3, column=0, columnspan=2, pady=5)
     
     def delete_item(self, tree_type, item):
+        if self.busy(tree_type):
+            return
         treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
-        tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
-        path = self.get_item_path(treeview, item)
+        model = self.good_model if tree_type == "good" else self.bad_model
+        path = self.get_item_path(tree_type, item)
         item_type = "folder" if treeview.item(item)['values'][0] == '' else "entry"
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete this {item_type} (and all contents if a folder)?"):
-            parts = path.split('/')
-            name = parts.pop()
-            current = tree_data
-            for part in parts:
-                current = current[part]
-            del current[name]
+            model.delete(path)
+            self.save_tree(tree_type)
+    
+    def selected_paths(self, tree_type):
+        # Outermost first; what is selected inside a selected folder goes
+        # with it.
+        treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
+        view = self.good_view if tree_type == "good" else self.bad_view
+        return outermost(view.item_paths[item] for item in treeview.selection() if item in view.item_paths)
+    
+    def delete_selected(self, tree_type):
+        # Any number of items, in one transaction with one save.
+        if self.busy(tree_type):
+            return
+        paths = self.selected_paths(tree_type)
+        if len(paths) == 1:
+            self.delete_item(tree_type, (self.good_view if tree_type == "good" else self.bad_view).items[paths[0]])
+        elif paths and messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete these {len(paths)} {tree_type} items (and all contents of folders)?"):
+            delete_paths(self.good_model if tree_type == "good" else self.bad_model, paths)
+            self.save_tree(tree_type)
+    
+    def move_selected(self, tree_type):
+        if self.busy(tree_type):
+            return
+        paths = self.selected_paths(tree_type)
+        if not paths:
+            return
+        model = self.good_model if tree_type == "good" else self.bad_model
+        def submit_move(event=None):
+            try:
+                moved = move_paths(model, paths, folders.get(folder_var.get(), ()))
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            if moved:
+                self.save_tree(tree_type)
+            move_window.destroy()
+        
+        move_window = Toplevel(self.root)
+        move_window.title(f"Move {len(paths)} {'Good' if tree_type == 'good' else 'Bad'} Items" if len(paths) > 1 else f"Move {'/'.join(paths[0])}")
+        ttk.Label(move_window, text="Target Folder:").grid(row=0, column=0, padx=5, pady=5)
+        folder_var = tk.StringVar()
+        folders = {'/'.join(path): path for path in self.get_folder_paths(tree_type)}
+        ttk.Combobox(move_window, textvariable=folder_var, values=[''] + list(folders), state='readonly').grid(row=0, column=1, padx=5, pady=5)
+        move_window.bind('<Return>', submit_move)
+        ttk.Button(move_window, text="Submit", command=submit_move).grid(row=1, column=0, columnspan=2, pady=5)
+    
+    def cut_selected(self, tree_type):
+        paths = self.selected_paths(tree_type)
+        if paths:
+            self.clipboard = (tree_type, 'cut', paths)
+            self.perf_var.set(f"Cut {len(paths)} {tree_type} items; paste them into a folder of either tree with Ctrl+V.")
+    
+    def copy_selected(self, tree_type):
+        paths = self.selected_paths(tree_type)
+        if paths:
+            self.clipboard = (tree_type, 'copy', paths)
+            self.perf_var.set(f"Copied {len(paths)} {tree_type} items; paste them into a folder of either tree with Ctrl+V.")
+    
+    def image_copier(self, source_type, tree_type):
+        # Images live in each pane's own blob store.
+        if source_type == tree_type:
+            return None
+        source = self.good_blobs if source_type == "good" else self.bad_blobs
+        target = self.good_blobs if tree_type == "good" else self.bad_blobs
+        return lambda image: copy_blob(image, source, target)
+    
+    def paste(self, tree_type, folder=None):
+        # Into folder, or else the focused folder (an entry's own folder). A
+        # cut pasted into the other pane is copied there, then deleted here:
+        # one transaction and one save in each pane.
+        if self.clipboard is None:
+            return
+        source_type, mode, paths = self.clipboard
+        if self.busy(tree_type) or (mode == 'cut' and source_type != tree_type and self.busy(source_type)):
+            return
+        model = self.good_model if tree_type == "good" else self.bad_model
+        source = self.good_model if source_type == "good" else self.bad_model
+        if folder is None:
+            treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
+            view = self.good_view if tree_type == "good" else self.bad_view
+            item = treeview.focus()
+            folder = ()
+            if item in view.item_paths:
+                folder = view.item_paths[item]
+                if not view.is_folder_item(item):
+                    folder = folder[:-1]
+        try:
+            if mode == 'cut' and source_type == tree_type:
+                count = move_paths(model, paths, folder)
+            else:
+                count = copy_paths(source, paths, model, folder, self.image_copier(source_type, tree_type))
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if mode == 'cut':
+            self.clipboard = None
+        if not count:
+            return
+        self.save_tree(tree_type)
+        if mode == 'cut' and source_type != tree_type:
+            delete_paths(source, paths)
+            self.save_tree(source_type)
+    
+    def copy_across(self, tree_type):
+        # Copies the selection to the same paths in the other pane, replacing
+        # what is there.
+        other = "bad" if tree_type == "good" else "good"
+        if self.busy(other):
+            return
+        paths = self.selected_paths(tree_type)
+        if not paths:
+            messagebox.showinfo("Copy", f"Select the {tree_type} items to copy first.")
+            return
+        try:
+            count = copy_paths(self.good_model if tree_type == "good" else self.bad_model, paths,
+                               self.good_model if other == "good" else self.bad_model, None, self.image_copier(tree_type, other))
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if count:
+            self.save_tree(other)
+    
+    def undo(self, tree_type):
+        if self.busy(tree_type):
+            return
+        if (self.good_history if tree_type == "good" else self.bad_history).undo() is not None:
+            self.save_tree(tree_type)
+    
+    def redo(self, tree_type):
+        if self.busy(tree_type):
+            return
+        if (self.good_history if tree_type == "good" else self.bad_history).redo() is not None:
             self.save_tree(tree_type)
-            self.update_treeview(tree_type)
     
     def on_right_click(self, event, tree_type):
         treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
         item = treeview.identify_row(event.y)
-        parent_path = ''
+        if item not in (self.good_view if tree_type == "good" else self.bad_view).item_paths:
+            item = ''  # Placeholder rows stand for nothing in the model
+        parent_path = ()
+        other = "Bad" if tree_type == "good" else "Good"
+        if item and item in treeview.selection() and len(self.selected_paths(tree_type)) > 1:
+            # Batch menu for the whole selection
+            count = len(self.selected_paths(tree_type))
+            menu = tk.Menu(self.root, tearoff=0)
+            menu.add_command(label=f"Delete {count} Items", command=lambda: self.delete_selected(tree_type))
+            menu.add_command(label=f"Move {count} Items to Folder...", command=lambda: self.move_selected(tree_type))
+            menu.add_command(label=f"Copy {count} Items to {other} Tree", command=lambda: self.copy_across(tree_type))
+            menu.add_command(label="Cut", command=lambda: self.cut_selected(tree_type))
+            menu.add_command(label="Copy", command=lambda: self.copy_selected(tree_type))
+            menu.post(event.x_root, event.y_root)
+            return
         if item:
             treeview.selection_set(item)
-            parent_path = self.get_item_path(treeview, item)
+            treeview.focus(item)
+            parent_path = self.get_item_path(tree_type, item)
             if treeview.item(item)['values'][0] != '':  # Is entry
                 menu = tk.Menu(self.root, tearoff=0)
                 menu.add_command(label="Edit", command=lambda: self.edit_entry(tree_type, item))
                 menu.add_command(label="Delete", command=lambda: self.delete_item(tree_type, item))
+                menu.add_command(label="Move to Folder...", command=lambda: self.move_selected(tree_type))
+                menu.add_command(label=f"Copy to {other} Tree", command=lambda: self.copy_across(tree_type))
+                menu.add_command(label="Cut", command=lambda: self.cut_selected(tree_type))
+                menu.add_command(label="Copy", command=lambda: self.copy_selected(tree_type))
                 menu.post(event.x_root, event.y_root)
                 return
         else:
@@ -361,88 +656,423 @@ class DualDataTreeApp:
         menu = tk.Menu(self.root, tearoff=0)
         menu.add_command(label=f"Add New {'Good' if tree_type == 'good' else 'Bad'} Folder", command=lambda: self.add_folder(tree_type, parent_path))
         menu.add_command(label=f"Add New {'Good' if tree_type == 'good' else 'Bad'} Entry", command=lambda: self.add_entry(tree_type, parent_path))
+        if self.clipboard is not None:
+            menu.add_command(label=f"Paste {len(self.clipboard[2])} Items", command=lambda: self.paste(tree_type, parent_path))
         if item:  # Add Delete only if clicking on a folder
             menu.add_command(label="Delete", command=lambda: self.delete_item(tree_type, item))
+            menu.add_command(label="Move to Folder...", command=lambda: self.move_selected(tree_type))
+            menu.add_command(label=f"Copy to {other} Tree", command=lambda: self.copy_across(tree_type))
+            menu.add_command(label="Cut", command=lambda: self.cut_selected(tree_type))
+            menu.add_command(label="Copy", command=lambda: self.copy_selected(tree_type))
         menu.post(event.x_root, event.y_root)
     
     def view_entry(self, event, tree_type):
         treeview = self.good_treeview if tree_type == "good" else self.bad_treeview
-        tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
+        model = self.good_model if tree_type == "good" else self.bad_model
+        blobs = self.good_blobs if tree_type == "good" else self.bad_blobs
         item = treeview.focus()
-        if item and treeview.item(item)['values'][0] != '':
-            path = self.get_item_path(treeview, item)
-            parts = path.split('/')
-            name = parts.pop()
-            current = tree_data
-            for part in parts:
-                current = current[part]
-            value = current[name]
-            content = value['content']
-            image_b64 = value.get('image')
+        loader = self.good_loader if tree_type == "good" else self.bad_loader
+        if item and loader is None and treeview.item(item)['values'][0] != '':
+            perf = self.good_perf if tree_type == "good" else self.bad_perf
+            timer = perf.start('view_entry')
+            path = self.get_item_path(tree_type, item)
+            value = model.node(path)
+            content = value.content
+            image_ref = value.image
             
             viewer = Toplevel(self.root)
-            viewer.title(f"{'Good' if tree_type == 'good' else 'Bad'} Entry: {path}")
+            viewer.title(f"{'Good' if tree_type == 'good' else 'Bad'} Entry: {'/'.join(path)}")
             ttk.Label(viewer, text="Content:").pack(padx=5, pady=5)
             ttk.Label(viewer, text=content).pack(padx=5, pady=5)
-            if image_b64:
-                try:
-                    img_data = base64.b64decode(image_b64)
-                    img = Image.open(BytesIO(img_data))
-                    photo = ImageTk.PhotoImage(img)
-                    img_label = ttk.Label(viewer, image=photo)
+            if image_ref:
+                previews = self.good_previews if tree_type == "good" else self.bad_previews
+                img_label = ttk.Label(viewer, text="Loading image...")
+                img_label.pack(padx=5, pady=5)
+                
+                def show_preview(preview, full_size, error):
+                    if not img_label.winfo_exists():
+                        timer.stop()
+                        return
+                    if error is not None:
+                        img_label.config(text=f"Error loading image: {str(error)}")
+                        perf.record(timer)
+                        return
+                    photo = ImageTk.PhotoImage(preview)
+                    img_label.config(image=photo, text='')
                     img_label.image = photo
-                    img_label.pack(padx=5, pady=5)
-                except Exception as e:
-                    ttk.Label(viewer, text=f"Error loading image: {str(e)}").pack(padx=5, pady=5)
+                    if preview.size != full_size:
+                        ttk.Button(viewer, text=f"Full Size ({full_size[0]}x{full_size[1]})",
+                                   command=lambda: self.view_full_image(tree_type, path, image_ref)).pack(pady=5)
+                    # Timed until the preview is on screen.
+                    perf.record(timer)
+                
+                # The window opens at once; the image is decoded off the Tk
+                # thread and dropped if the window closes first.
+                handle = previews.request(path, image_ref, lambda: blobs.get(image_ref), screen_fit(self.root), show_preview)
+                viewer.bind("<Destroy>", lambda e: e.widget is viewer and previews.cancel(handle))
+            else:
+                perf.record(timer)
+    
+    def view_full_image(self, tree_type, path, image_ref):
+        blobs = self.good_blobs if tree_type == "good" else self.bad_blobs
+        try:
+            show_full_image(self.root, f"{'Good' if tree_type == 'good' else 'Bad'} Image: {'/'.join(path)}", blobs.get(image_ref))
+        except Exception as e:
+            messagebox.showerror("Error", f"Error loading image: {str(e)}")
+    
+    def loading(self, tree_type):
+        loader = self.good_loader if tree_type == "good" else self.bad_loader
+        if loader is not None:
+            messagebox.showinfo("Loading", f"Please wait until the {tree_type} file has finished loading.")
+            return True
+        return False
+    
+    def busy(self, tree_type):
+        # A pane whose file could not be read at startup takes no edits, so
+        # an autosave cannot overwrite that file with an empty tree.
+        if self.loading(tree_type):
+            return True
+        if self.good_load_failed if tree_type == "good" else self.bad_load_failed:
+            messagebox.showinfo("Not Loaded", f"The {tree_type} file could not be loaded. Load a file into this pane first.")
+            return True
+        return False
     
     def load_file(self, tree_type):
-        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if self.loading(tree_type):
+            return
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json *.json.gz *.json.xz *.json.bz2"), ("SQLite databases", "*.db"), ("Sharded trees", MANIFEST)])
         if file_path:
-            if tree_type == "good":
-                self.good_file = file_path
-                self.good_tree_data = self.load_tree(file_path)
-                self.update_treeview("good")
-                self.good_frame.config(text=f"Good Tree - {os.path.basename(file_path)}")
-            else:
-                self.bad_file = file_path
-                self.bad_tree_data = self.load_tree(file_path)
-                self.update_treeview("bad")
-                self.bad_frame.config(text=f"Bad Tree - {os.path.basename(file_path)}")
+            saver = self.good_saver if tree_type == "good" else self.bad_saver
+            view = self.good_view if tree_type == "good" else self.bad_view
+            model = self.good_model if tree_type == "good" else self.bad_model
+            old_file = self.good_file if tree_type == "good" else self.bad_file
+            saver.flush()
+            view.save_state(view_state_file(old_file))
+            if file_path.endswith('.db') or is_manifest(file_path):
+                self.open_database(tree_type, file_path)
+                return
+            self.start_load(tree_type, file_path, model.root)
+    
+    def start_load(self, tree_type, file_path, previous_data):
+        # A snapshot, or a missing file, is read at once. Anything else is
+        # parsed on a worker thread with top-level items showing up as they
+        # arrive; edits to this pane wait until the whole file is in, while
+        # the other pane keeps working. previous_data is None at startup.
+        view = self.good_view if tree_type == "good" else self.bad_view
+        model = self.good_model if tree_type == "good" else self.bad_model
+        perf = self.good_perf if tree_type == "good" else self.bad_perf
+        blobs = BlobStore(blob_dir(file_path))
+        journal = Journal(journal_file(file_path))
+        view.load_state(view_state_file(file_path))
+        snapshot = open_snapshot(file_path)
+        if snapshot is not None or not os.path.exists(file_path):
+            timer = perf.start('load_tree')
+            root = snapshot.load() if snapshot is not None else Folder()
+            journal.replay(root)
+            self.finish_load(tree_type, file_path, previous_data, root, None)
+            perf.record(timer.stop(nodes=len(model.index)))
+            return
+        model.reset(Folder())
+        loader = LoadJob(self.root, file_path, model.add_loaded,
+                         lambda bytes_read, total_bytes, nodes: self.show_load_progress(tree_type, bytes_read, total_bytes, nodes),
+                         lambda data, error: self.finish_load(tree_type, file_path, previous_data, data, error),
+                         on_entry=blobs.migrate, journal=journal, perf=perf)
+        title = f"{'Good' if tree_type == 'good' else 'Bad'} Tree - {os.path.basename(file_path)} (loading...)"
+        if tree_type == "good":
+            self.good_loader = loader
+            self.good_load_progress.config(value=0)
+            self.good_load_status_var.set('')
+            self.good_load_frame.grid()
+            self.good_frame.config(text=title)
+        else:
+            self.bad_loader = loader
+            self.bad_load_progress.config(value=0)
+            self.bad_load_status_var.set('')
+            self.bad_load_frame.grid()
+            self.bad_frame.config(text=title)
+        loader.start()
+    
+    def open_database(self, tree_type, file_path):
+        # Only the top level is read here; folders, or the shards holding
+        # them, are fetched as they open.
+        view = self.good_view if tree_type == "good" else self.bad_view
+        model = self.good_model if tree_type == "good" else self.bad_model
+        perf = self.good_perf if tree_type == "good" else self.bad_perf
+        timer = perf.start('load_tree')
+        try:
+            store = ShardStorage(file_path) if is_manifest(file_path) else SqliteStorage(file_path)
+            root = store.load()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            timer.stop()
+            messagebox.showerror("Error", f"Could not load {file_path}: {e}")
+            return
+        self.close_store(tree_type)
+        if self.clipboard is not None and self.clipboard[0] == tree_type:
+            self.clipboard = None
+        model.subscribe(store.apply)
+        (self.good_watcher if tree_type == "good" else self.bad_watcher).watch(None)
+        if is_manifest(file_path):
+            status_var = self.good_save_status_var if tree_type == "good" else self.bad_save_status_var
+            store_saver = SaveScheduler(self.root, file_path, store.snapshot, on_status=status_var.set, perf=perf,
+                                        on_saved=lambda mark: store.saved(), write=store.write)
+        else:
+            store_saver = None
+        if tree_type == "good":
+            self.good_load_failed = False
+            self.good_store = store
+            self.good_store_saver = store_saver
+            self.good_file = file_path
+            self.good_blobs = BlobStore(blob_dir(file_path))
+            self.good_previews.clear()
+            self.good_frame.config(text=f"Good Tree - {os.path.basename(file_path)}")
+        else:
+            self.bad_load_failed = False
+            self.bad_store = store
+            self.bad_store_saver = store_saver
+            self.bad_file = file_path
+            self.bad_blobs = BlobStore(blob_dir(file_path))
+            self.bad_previews.clear()
+            self.bad_frame.config(text=f"Bad Tree - {os.path.basename(file_path)}")
+        view.load_state(view_state_file(file_path))
+        model.reset(root)
+        perf.record(timer.stop(nodes=len(model.index)))
+    
+    def close_store(self, tree_type):
+        store = self.good_store if tree_type == "good" else self.bad_store
+        model = self.good_model if tree_type == "good" else self.bad_model
+        if store is None:
+            if model.source is not None:
+                # The tree was served from its snapshot.
+                model.source.close()
+            return
+        store_saver = self.good_store_saver if tree_type == "good" else self.bad_store_saver
+        if store_saver is not None:
+            store_saver.flush()
+        model.unsubscribe(store.apply)
+        store.close()
+        if tree_type == "good":
+            self.good_store = None
+            self.good_store_saver = None
+        else:
+            self.bad_store = None
+            self.bad_store_saver = None
+    
+    def show_load_progress(self, tree_type, bytes_read, total_bytes, nodes):
+        progress = self.good_load_progress if tree_type == "good" else self.bad_load_progress
+        status_var = self.good_load_status_var if tree_type == "good" else self.bad_load_status_var
+        progress.config(maximum=max(total_bytes, 1), value=bytes_read)
+        status_var.set(f"{bytes_read // 1024} / {total_bytes // 1024} KB, {nodes} nodes")
+    
+    def cancel_load(self, tree_type):
+        loader = self.good_loader if tree_type == "good" else self.bad_loader
+        if loader is not None:
+            loader.cancel()
+    
+    def finish_load(self, tree_type, file_path, previous_data, data, error):
+        view = self.good_view if tree_type == "good" else self.bad_view
+        model = self.good_model if tree_type == "good" else self.bad_model
+        loader = self.good_loader if tree_type == "good" else self.bad_loader
+        index = loader.index if loader is not None else None
+        timer = loader.timer if loader is not None else None
+        if tree_type == "good":
+            self.good_loader = None
+            self.good_load_frame.grid_remove()
+        else:
+            self.bad_loader = None
+            self.bad_load_frame.grid_remove()
+        if error is not None:
+            old_file = self.good_file if tree_type == "good" else self.bad_file
+            (self.good_frame if tree_type == "good" else self.bad_frame).config(
+                text=f"{'Good' if tree_type == 'good' else 'Bad'} Tree - {os.path.basename(old_file)}")
+            view.load_state(view_state_file(old_file))
+            if previous_data is None:
+                # Startup: there is nothing to go back to.
+                if tree_type == "good":
+                    self.good_load_failed = True
+                else:
+                    self.bad_load_failed = True
+                previous_data = Folder()
+            model.reset(previous_data)
+            if not isinstance(error, LoadCancelled):
+                messagebox.showerror("Error", f"Could not load {file_path}: {error}")
+            return
+        self.close_store(tree_type)
+        if self.clipboard is not None and self.clipboard[0] == tree_type:
+            self.clipboard = None
+        if tree_type == "good":
+            self.good_load_failed = False
+            self.good_file = file_path
+            self.good_saver.file_path = file_path
+            self.good_journal = Journal(journal_file(file_path))
+            self.good_saver.journal = self.good_journal
+            self.good_blobs = BlobStore(blob_dir(file_path))
+            self.good_previews.clear()
+            self.good_frame.config(text=f"Good Tree - {os.path.basename(file_path)}")
+        else:
+            self.bad_load_failed = False
+            self.bad_file = file_path
+            self.bad_saver.file_path = file_path
+            self.bad_journal = Journal(journal_file(file_path))
+            self.bad_saver.journal = self.bad_journal
+            self.bad_blobs = BlobStore(blob_dir(file_path))
+            self.bad_previews.clear()
+            self.bad_frame.config(text=f"Bad Tree - {os.path.basename(file_path)}")
+        model.reset(data, index)
+        (self.good_edits if tree_type == "good" else self.bad_edits).reset(
+            (self.good_journal if tree_type == "good" else self.bad_journal).paths())
+        (self.good_watcher if tree_type == "good" else self.bad_watcher).watch(file_path)
+        if timer is not None:
+            self.perf.record(timer)
+        self.refresh_snapshot(tree_type)
+    
+    def on_close(self):
+        if self.good_loader is not None:
+            self.good_loader.cancel()
+            self.good_view.load_state(view_state_file(self.good_file))
+        if self.bad_loader is not None:
+            self.bad_loader.cancel()
+            self.bad_view.load_state(view_state_file(self.bad_file))
+        for saver in (self.good_saver, self.bad_saver, self.good_store_saver, self.bad_store_saver):
+            if saver is not None and not saver.flush():
+                if not messagebox.askyesno("Save Failed", f"Could not save {saver.file_path}: {saver.error}\nClose anyway?"):
+                    return
+        try:
+            self.good_view.save_state(view_state_file(self.good_file))
+            self.bad_view.save_state(view_state_file(self.bad_file))
+        except OSError:
+            pass
+        self.good_previews.shutdown()
+        self.bad_previews.shutdown()
+        self.close_store("good")
+        self.close_store("bad")
+        self.root.destroy()
+    
+    def save_timings(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        if file_path:
+            try:
+                self.perf.dump(file_path)
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not save {file_path}: {e}")
+    
+    def profile_next(self, operation):
+        file_path = filedialog.asksaveasfilename(defaultextension=".prof", initialfile=f"{operation}.prof",
+                                                 filetypes=[("Profile data", "*.prof")])
+        if file_path:
+            self.perf.profile(operation, file_path)
+            self.perf_var.set(f"The next {operation} will be profiled.")
+    
+    def compare_panes(self):
+        if self.loading("good") or self.loading("bad"):
+            return
+        self.compare_job = None
+        self.compare_mode = "panes"
+        self.rediff()
+    
+    def compare_file(self, tree_type):
+        # What is on disk is read on a worker; unsaved edits show up as
+        # differences.
+        if self.loading(tree_type):
+            return
+        if (self.good_store if tree_type == "good" else self.bad_store) is not None:
+            messagebox.showinfo("Compare", "A database or sharded tree writes every change as it is made, so it always matches its files.")
+            return
+        file_path = self.good_file if tree_type == "good" else self.bad_file
+        self.stop_compare()
+        self.compare_mode = tree_type
+        self.perf_var.set(f"Reading {os.path.basename(file_path)}...")
+        job = FileHashJob(self.root, file_path, lambda hashes, error: self.finish_compare_file(tree_type, file_path, job, hashes, error))
+        self.compare_job = job.start()
+    
+    def finish_compare_file(self, tree_type, file_path, job, hashes, error):
+        if job is not self.compare_job:
+            return
+        self.compare_job = None
+        if error is not None:
+            self.compare_mode = None
+            self.perf_var.set('')
+            messagebox.showerror("Error", f"Could not read {file_path}: {error}")
+            return
+        timer = self.perf.start('compare')
+        model = self.good_model if tree_type == "good" else self.bad_model
+        differences = diff(self.good_hashes if tree_type == "good" else self.bad_hashes, hashes)
+        record = self.perf.record(timer.stop(nodes=len(differences)))
+        self.show_differences(tree_type, differences, LEFT_ONLY)
+        counts = self.count_differences(differences, model, hashes.model)
+        self.perf_var.set(f"{counts[LEFT_ONLY]} only in the {tree_type} tree, {counts[RIGHT_ONLY]} only in "
+                          f"{os.path.basename(file_path)}, {counts[DIFFERENT]} different ({record.seconds * 1000:.1f} ms)")
+    
+    def compare_changed(self, tree_type):
+        if self.compare_mode == "panes":
+            # Coalesces the changes of one event into one diff.
+            if self.rediff_id is None:
+                self.rediff_id = self.root.after_idle(self.rediff)
+        elif self.compare_mode == tree_type:
+            # The file may be rewritten by the next save; read it again to
+            # compare anew.
+            self.stop_compare()
+            self.perf_var.set(f"Stopped comparing: the {tree_type} tree changed.")
+    
+    def rediff(self):
+        self.rediff_id = None
+        if self.compare_mode != "panes" or self.good_loader is not None or self.bad_loader is not None:
+            return
+        timer = self.perf.start('compare')
+        differences = diff(self.good_hashes, self.bad_hashes)
+        record = self.perf.record(timer.stop(nodes=len(differences)))
+        self.show_differences("good", differences, LEFT_ONLY)
+        self.show_differences("bad", differences, RIGHT_ONLY)
+        counts = self.count_differences(differences, self.good_model, self.bad_model)
+        self.perf_var.set(f"{counts[LEFT_ONLY]} only in good, {counts[RIGHT_ONLY]} only in bad, "
+                          f"{counts[DIFFERENT]} different ({record.seconds * 1000:.1f} ms)")
+    
+    def count_differences(self, differences, left, right):
+        counts = {LEFT_ONLY: 0, RIGHT_ONLY: 0, DIFFERENT: 0}
+        for path, status in differences.items():
+            # Folders are different because something inside them is.
+            if status != DIFFERENT or is_entry(left.lookup(path)) or is_entry(right.lookup(path)):
+                counts[status] += 1
+        return counts
+    
+    def show_differences(self, tree_type, differences, here):
+        # Keeps the statuses of paths this pane has rows for: here-only paths
+        # and different ones.
+        tags = {path: 'only' if status == here else 'different'
+                for path, status in differences.items() if status in (here, DIFFERENT)}
+        if tree_type == "good":
+            self.good_differences = tags
+        else:
+            self.bad_differences = tags
+        (self.good_view if tree_type == "good" else self.bad_view).retag()
+    
+    def stop_compare(self):
+        self.compare_mode = None
+        self.compare_job = None
+        self.good_differences = None
+        self.bad_differences = None
+        self.good_view.retag()
+        self.bad_view.retag()
+    
+    def compare_tags(self, tree_type, path):
+        differences = self.good_differences if tree_type == "good" else self.bad_differences
+        if differences is None:
+            return ()
+        tag = differences.get(path)
+        if tag is not None:
+            return (tag,)
+        for i in range(len(path) - 1, 0, -1):
+            if differences.get(path[:i]) == 'only':
+                return ('only',)
+        return ('same',)
     
     def search(self, tree_type):
         search_var = self.good_search_var if tree_type == "good" else self.bad_search_var
-        tree_data = self.good_tree_data if tree_type == "good" else self.bad_tree_data
+        live_search = self.good_live_search if tree_type == "good" else self.bad_live_search
         term = search_var.get().strip()
         if not term:
             messagebox.showerror("Error", "Search term cannot be empty.")
             return
-        results = []
-        def search_recursive(node, term, path=''):
-            for name, value in sorted(node.items()):
-                full_path = f"{path}/{name}" if path else name
-                if term.lower() in name.lower():
-                    if isinstance(value, dict):
-                        if 'content' in value:
-                            results.append(f"Entry: {full_path} (content: {value['content']})")
-                        else:
-                            results.append(f"Folder: {full_path}/")
-                if isinstance(value, dict) and 'content' not in value:
-                    search_recursive(value, term, full_path)
-        
-        search_recursive(tree_data, term)
-        result_window = Toplevel(self.root)
-        result_window.title(f"{'Good' if tree_type == 'good' else 'Bad'} Search Results")
-        result_text = tk.Text(result_window, height=10, width=50)
-        result_text.grid(row=0, column=0, padx=5, pady=5)
-        scrollbar = ttk.Scrollbar(result_window, orient=tk.VERTICAL, command=result_text.yview)
-        result_text.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        if results:
-            for res in results:
-                result_text.insert(tk.END, res + '\n')
-        else:
-            result_text.insert(tk.END, "No matches found.")
-        result_text.config(state='disabled')
+        live_search.run()
 
 if __name__ == "__main__":
     root = tk.Tk()
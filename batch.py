@@ -0,0 +1,105 @@
+from treemodel import Entry, Folder, is_entry
+
+
+def outermost(paths):
+    # The paths not below another of paths, in order; acting on a folder
+    # already covers what is selected inside it.
+    chosen = set(paths)
+    return sorted(path for path in chosen if not any(path[:i] in chosen for i in range(1, len(path))))
+
+
+def copy_node(node, copy_image=None):
+    # A copy with folders of its own, so that edits to either copy stay out
+    # of the other. Entries are shared unless copy_image maps their images,
+    # e.g. into another tree's blob store.
+    def entry(child):
+        if copy_image is None or not child.image:
+            return child
+        return Entry(child.name, child.content, copy_image(child.image))
+
+    if is_entry(node):
+        return entry(node)
+    root = Folder(node.name)
+    stack = [(node, root)]
+    while stack:
+        source, target = stack.pop()
+        for name in source.names:
+            child = source.children[name]
+            if is_entry(child):
+                target.children[name] = entry(child)
+            else:
+                target.children[name] = Folder(name)
+                stack.append((child, target.children[name]))
+        target.names = list(source.names)
+    return root
+
+
+def describe(folder):
+    return f"'{'/'.join(folder)}'" if folder else "the top level"
+
+
+def target_folder(model, folder):
+    node = model.lookup(folder)
+    if node is None or is_entry(node):
+        raise ValueError(f"{describe(folder)} is not a folder.")
+    return node
+
+
+def delete_paths(model, paths):
+    # Returns the number of items deleted.
+    paths = [path for path in outermost(paths) if model.lookup(path) is not None]
+    with model.transaction():
+        for path in paths:
+            model.delete(path)
+    return len(paths)
+
+
+def move_paths(model, paths, folder):
+    # Moves paths into folder, as one transaction. Nothing is moved if a
+    # name is taken there or a folder would go inside itself. Returns the
+    # number of items moved.
+    folder = tuple(folder)
+    target = target_folder(model, folder)
+    paths = [path for path in outermost(paths) if path[:-1] != folder and model.lookup(path) is not None]
+    for path in paths:
+        if folder[:len(path)] == path:
+            raise ValueError(f"Cannot move '{'/'.join(path)}' into itself.")
+        if path[-1] in target:
+            raise ValueError(f"'{path[-1]}' already exists in {describe(folder)}.")
+    if len({path[-1] for path in paths}) < len(paths):
+        raise ValueError("Items with the same name cannot be moved into one folder.")
+    with model.transaction():
+        for path in paths:
+            node = model.node(path)
+            model.delete(path)
+            model.put(folder + (path[-1],), node)
+    return len(paths)
+
+
+def copy_paths(source, paths, model, folder=None, copy_image=None):
+    # Copies paths of the source model into folder of model, which may be
+    # the same, as one transaction. With folder None each item goes to its
+    # own path, replacing what is there and creating missing folders, as
+    # when copying between the good and bad trees; otherwise nothing is
+    # copied if a name is taken in folder. Returns the number of items
+    # copied.
+    paths = [path for path in outermost(paths) if source.lookup(path) is not None]
+    if folder is None:
+        for path in paths:
+            model.find_parent(path[:-1], "'{}' is an entry in the tree copied to.")
+    else:
+        folder = tuple(folder)
+        target = target_folder(model, folder)
+        for path in paths:
+            if path[-1] in target:
+                raise ValueError(f"'{path[-1]}' already exists in {describe(folder)}.")
+        if len({path[-1] for path in paths}) < len(paths):
+            raise ValueError("Items with the same name cannot be copied into one folder.")
+    nodes = [copy_node(source.node(path), copy_image) for path in paths]
+    with model.transaction():
+        for path, node in zip(paths, nodes):
+            parent = path[:-1] if folder is None else folder
+            if folder is None:
+                model.add_folder(parent)
+            model.put(parent + (node.name,), node)
+    return len(paths)
@@ -0,0 +1,328 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import string
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from blobstore import BlobStore, blob_dir
+from saver import SaveScheduler, write_json_atomic
+from searchindex import SearchIndex
+from snapshot import save_snapshot, snapshot_file
+from treecore import read_tree
+from treemodel import TreeModel
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+REPEAT = 3
+# A regression is reported when a median grows by more than this fraction.
+THRESHOLD = 0.25
+VOCABULARY = 2000
+
+
+def tiny_png(rng, size=16):
+    # A valid RGB PNG of random pixels, so previews have something to decode.
+    rows = b''.join(b'\0' + rng.randbytes(size * 3) for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def generate_tree(nodes, depth=3, fanout=None, content_length=40, image_share=0.0, blobs=None, seed=0):
+    # Returns a tree in the JSON file format with up to nodes nodes, and the
+    # count. Folders go down depth levels with fanout children each (by
+    # default just enough to hold nodes) and entries fill the last level,
+    # breadth first. image_share of the entries get one of a few images,
+    # stored in blobs.
+    rng = random.Random(seed)
+    if fanout is None:
+        fanout = max(2, math.ceil(nodes ** (1 / depth)))
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(VOCABULARY)]
+    images = [blobs.put(tiny_png(rng)) for _ in range(8)] if image_share and blobs is not None else []
+    root = {}
+    level = [root]
+    count = 0
+    for d in range(1, depth + 1):
+        next_level = []
+        for folder in level:
+            for i in range(fanout):
+                if count >= nodes:
+                    break
+                count += 1
+                if d < depth:
+                    folder[f"f{i}"] = child = {}
+                    next_level.append(child)
+                    continue
+                content = ' '.join(rng.choices(words, k=content_length // 5 + 1))[:content_length]
+                entry = {"content": content}
+                if images and rng.random() < image_share:
+                    entry["image"] = rng.choice(images)
+                folder[f"e{i}"] = entry
+        level = next_level
+    return root, count
+
+
+def search_terms(tree):
+    # A name prefix, a word that occurs in content, and a term with no match.
+    node = tree
+    while "content" not in node:
+        node = next(iter(node.values()))
+    return ["f1", node["content"].split()[0], "zzzzzz"]
+
+
+def timed(fn, repeat, setup=None):
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def result(nodes, app, operation, runs):
+    return {"nodes": nodes, "app": app, "operation": operation,
+            "runs": runs, "median": statistics.median(runs)}
+
+
+def bench_core(file_path, nodes, tree, repeat):
+    # The GUI-free parts both apps are built on.
+    results = []
+    snapshot_path = snapshot_file(file_path)
+
+    def drop_snapshot():
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+    results.append(result(nodes, 'core', 'load_tree', timed(lambda: read_tree(file_path), repeat, drop_snapshot)))
+    model = TreeModel(read_tree(file_path))
+    saver = SaveScheduler(None, file_path, model.snapshot, on_written=save_snapshot)
+
+    def save():
+        saver.pending = True
+        saver.flush()
+
+    results.append(result(nodes, 'core', 'save_tree', timed(save, repeat)))
+    results.append(result(nodes, 'core', 'load_tree_snapshot', timed(lambda: read_tree(file_path), repeat)))
+    model = TreeModel(read_tree(file_path))
+    results.append(result(nodes, 'core', 'get_folder_paths', timed(lambda: sorted(model.folder_paths()), repeat)))
+    drop_snapshot()
+    model = TreeModel(read_tree(file_path))
+    index = [None]
+
+    def build():
+        index[0] = SearchIndex(model)
+
+    results.append(result(nodes, 'core', 'search_index_build', timed(build, repeat)))
+    for term in search_terms(tree):
+        results.append(result(nodes, 'core', f'search:{term}', timed(lambda: index[0].search(term), repeat)))
+    return results
+
+
+def make_root():
+    import tkinter as tk
+    root = tk.Tk()
+    # The apps ask for the 'zoomed' state, which X11 does not have.
+    root.state = lambda newstate=None: None
+    return root
+
+
+def bench_app(name, nodes, tree, repeat):
+    # Runs the app's own methods, so Treeview work is included. The data
+    # files must already be in the current directory.
+    import tkinter as tk
+    if name == 'datatree':
+        from datatree import DataTreeApp as App
+        args = ()
+    else:
+        from Goodbad import DualDataTreeApp as App
+        args = ("good",)
+    results = []
+    apps = []
+    files = [file_path for file_path in os.listdir() if file_path.endswith('.json')]
+
+    def start():
+        root = make_root()
+        app = App(root)
+        apps.append((root, app))
+        # Goodbad parses its files on workers; startup ends when both are in.
+        while getattr(app, 'good_loader', None) is not None or getattr(app, 'bad_loader', None) is not None:
+            root.update()
+            time.sleep(0.005)
+        root.update()
+
+    def stop():
+        while apps:
+            root, app = apps.pop()
+            for previews in [getattr(app, attr) for attr in ('previews', 'good_previews', 'bad_previews') if hasattr(app, attr)]:
+                previews.shutdown()
+            root.destroy()
+        # Let snapshots the app started writing finish before files change.
+        for thread in threading.enumerate():
+            if thread.name == 'snapshot':
+                thread.join()
+
+    def cold():
+        stop()
+        for file_path in files:
+            if os.path.exists(snapshot_file(file_path)):
+                os.remove(snapshot_file(file_path))
+
+    def warm():
+        stop()
+        for file_path in files:
+            if not os.path.exists(snapshot_file(file_path)):
+                save_snapshot(file_path, read_tree(file_path))
+
+    try:
+        results.append(result(nodes, name, 'startup', timed(start, repeat, cold)))
+        results.append(result(nodes, name, 'startup_snapshot', timed(start, repeat, warm)))
+    except tk.TclError as e:
+        stop()
+        print(f"Skipping {name} Treeview benchmarks: {e}", file=sys.stderr)
+        return results
+    root, app = apps[-1]
+    saver = app.saver if name == 'datatree' else app.good_saver
+    search_var = app.search_var if name == 'datatree' else app.good_search_var
+
+    def run(fn):
+        def step():
+            fn(*args)
+            root.update()
+        return step
+
+    def save(*args):
+        saver.pending = True
+        saver.flush()
+
+    def search(term):
+        def step(*args):
+            search_var.set(term)
+            app.search(*args)
+        return step
+
+    try:
+        results.append(result(nodes, name, 'update_treeview', timed(run(app.update_treeview), repeat)))
+        results.append(result(nodes, name, 'toggle_tree', timed(run(app.toggle_tree), repeat)))
+        results.append(result(nodes, name, 'get_folder_paths', timed(run(app.get_folder_paths), repeat)))
+        results.append(result(nodes, name, 'save_tree', timed(run(save), repeat)))
+        for term in search_terms(tree):
+            results.append(result(nodes, name, f'search:{term}', timed(run(search(term)), repeat)))
+    finally:
+        stop()
+    return results
+
+
+def start_xvfb():
+    # Gives Tk a virtual display when there is no real one. Returns the
+    # Xvfb process, or None if it is not needed or not installed.
+    if os.environ.get('DISPLAY') or not shutil.which('Xvfb'):
+        return None
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(['Xvfb', '-displayfd', str(write_fd), '-screen', '0', '1920x1080x24', '-nolisten', 'tcp'],
+                               pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        display = f.readline().strip()
+    if not display:
+        process.kill()
+        return None
+    os.environ['DISPLAY'] = f":{display}"
+    return process
+
+
+def compare(results, baseline, threshold):
+    # Prints the change of each median against baseline; returns the
+    # operations that got slower by more than threshold.
+    old = {(r["nodes"], r["app"], r["operation"]): r["median"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        key = (r["nodes"], r["app"], r["operation"])
+        if key not in old or not old[key]:
+            continue
+        ratio = r["median"] / old[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f"{r['nodes']:>8} {r['app']:<9} {r['operation']:<22} {old[key]:9.4f}s -> {r['median']:9.4f}s  x{ratio:.2f}{flag}", file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time DataTree operations on generated trees and report JSON.")
+    parser.add_argument('--sizes', default='1k,100k,1m', help=f"comma-separated node counts or names from {', '.join(SIZES)}")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, help="children per folder; default: just enough for the size")
+    parser.add_argument('--content-length', type=int, default=40)
+    parser.add_argument('--image-share', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--apps', default='datatree,goodbad', help="apps whose Treeview parts to time, or 'none'")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+    sizes = [SIZES[s] if s in SIZES else int(s) for s in args.sizes.split(',')]
+    apps = [] if args.apps == 'none' else args.apps.split(',')
+
+    xvfb = start_xvfb() if apps else None
+    workdir = tempfile.mkdtemp(prefix='datatree-bench-')
+    cwd = os.getcwd()
+    results = []
+    try:
+        os.chdir(workdir)
+        for nodes in sizes:
+            counts = {}
+            trees = {}
+            for seed, file_path in enumerate(('datatree.json', 'good_datatree.json', 'bad_datatree.json')):
+                trees[file_path], counts[file_path] = generate_tree(
+                    nodes, args.depth, args.fanout, args.content_length, args.image_share, BlobStore(blob_dir(file_path)), seed)
+                write_json_atomic(file_path, trees[file_path])
+            count = counts['datatree.json']
+            print(f"{count} nodes: core", file=sys.stderr)
+            results += bench_core('datatree.json', count, trees['datatree.json'], args.repeat)
+            for name in apps:
+                print(f"{count} nodes: {name}", file=sys.stderr)
+                tree = trees['datatree.json' if name == 'datatree' else 'good_datatree.json']
+                results += bench_app(name, count, tree, args.repeat)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if xvfb is not None:
+            xvfb.terminate()
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"depth": args.depth, "fanout": args.fanout, "content_length": args.content_length,
+                   "image_share": args.image_share, "repeat": args.repeat},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            if compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
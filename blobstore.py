@@ -0,0 +1,63 @@
+import base64
+import hashlib
+import os
+import tempfile
+
+from saver import copy_mode
+
+REF_PREFIX = 'sha256:'
+
+
+def blob_dir(data_file):
+    return f"{data_file}.blobs"
+
+
+def is_ref(image):
+    return isinstance(image, str) and image.startswith(REF_PREFIX)
+
+
+class BlobStore:
+    # Raw image bytes stored once under <data file>.blobs/, keyed by SHA-256;
+    # entries hold only the "sha256:<hex>" reference.
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A temp file of its own, as workers and both panes may be
+            # writing the same blob at once.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{digest[2:]}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                copy_mode(tmp_path, path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+        return REF_PREFIX + digest
+
+    def put_file(self, file_path):
+        with open(file_path, 'rb') as f:
+            return self.put(f.read())
+
+    def get(self, image):
+        if not is_ref(image):
+            return base64.b64decode(image)
+        with open(self.path(image[len(REF_PREFIX):]), 'rb') as f:
+            return f.read()
+
+    def migrate(self, entry):
+        # Moves a legacy inline base64 image out of the entry dict.
+        image = entry.get('image')
+        if image and not is_ref(image):
+            entry['image'] = self.put(base64.b64decode(image))
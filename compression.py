@@ -0,0 +1,51 @@
+import bz2
+import gzip
+import lzma
+import os
+
+# Tree files with one of these extensions are compressed with the stdlib
+# codec it names.
+EXTENSIONS = ('.json.gz', '.json.xz', '.json.bz2')
+CODECS = {'.gz': gzip, '.xz': lzma, '.bz2': bz2}
+# 1 (fastest) to 9 (smallest), a scale all three codecs share.
+DEFAULT_LEVEL = 6
+
+
+def codec_for(file_path):
+    return CODECS.get(os.path.splitext(file_path)[1].lower())
+
+
+def open_text(file_path):
+    # Opens file_path for reading as text, decompressing as it is read.
+    codec = codec_for(file_path)
+    if codec is None:
+        return open(file_path, 'r')
+    return codec.open(file_path, 'rt', encoding='utf-8')
+
+
+def decompressor(raw, file_path):
+    # A binary stream of what raw, opened on file_path, decompresses to.
+    # Closing it leaves raw open.
+    codec = codec_for(file_path)
+    if codec is gzip:
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if codec is lzma:
+        return lzma.LZMAFile(raw, 'rb')
+    if codec is bz2:
+        return bz2.BZ2File(raw, 'rb')
+    return raw
+
+
+def compressor(raw, file_path, level=DEFAULT_LEVEL):
+    # A binary stream that compresses what is written to it into raw, for
+    # file_path; closing it writes the codec's trailer and leaves raw open.
+    if not 1 <= level <= 9:
+        raise ValueError(f"Compression level must be from 1 to 9, not {level}.")
+    codec = codec_for(file_path)
+    if codec is gzip:
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+    if codec is lzma:
+        return lzma.LZMAFile(raw, 'wb', preset=level)
+    if codec is bz2:
+        return bz2.BZ2File(raw, 'wb', compresslevel=level)
+    return raw
@@ -1,24 +1,80 @@
-import json
 import os
+import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox, Toplevel, filedialog
-import base64
-from io import BytesIO
 try:
-    from PIL import Image, ImageTk
+    from PIL import ImageTk
 except ImportError:
     pass  # User needs to install Pillow
+from batch import copy_paths, delete_paths, move_paths, outermost
+from blobstore import BlobStore, blob_dir
+from compression import DEFAULT_LEVEL
+from history import History
+from journal import Journal, journal_file
+from lazytree import LazyTreeview, view_state_file
+from livesearch import LiveSearch
+from perflog import OPERATIONS, PerfLog, format_record
+from previewcache import PreviewCache, screen_fit, show_full_image
+from saver import SaveScheduler
+from searchindex import SearchIndex
+from shardstore import MANIFEST, ShardStorage, is_manifest
+from snapshot import open_snapshot, save_snapshot, save_snapshot_async
+from sqlitestore import SqliteStorage
+from streamload import LoadCancelled, LoadJob
+from treecore import read_tree
+from treehash import FileHashJob, TreeHash
+from treemodel import Folder, TreeModel
+from watcher import FileWatcher, LocalEdits, apply_merge, merge
 
 class DataTreeApp:
-    def __init__(self, root):
+    def __init__(self, root, journal=False, compress_level=DEFAULT_LEVEL):
         self.root = root
         self.root.title("DataTree")
         self.data_file = 'datatree.json'
-        self.tree_data = self.load_tree(self.data_file)
+        self.use_journal = journal
+        self.journal = Journal(journal_file(self.data_file))
+        self.loader = None
+        self.store = None
+        # Writes a sharded store's changes, which its own save collects.
+        self.store_saver = None
+        # ('cut' or 'copy', paths) while something is on the clipboard.
+        self.clipboard = None
+        self.perf = PerfLog()
+        load_timer = self.perf.start('load_tree')
+        self.model = TreeModel(self.load_tree(self.data_file))
+        load_timer.stop(nodes=len(self.model.index))
+        self.search_index = SearchIndex(self.model)
+        self.history = History(self.model)
+        self.hashes = TreeHash(self.model)
+        self.edits = LocalEdits(self.model)
+        self.edits.reset(self.journal.paths())
+        self.blobs = BlobStore(blob_dir(self.data_file))
+        self.previews = PreviewCache(self.root)
         
         # Maximize window
         self.root.state('zoomed')
         
+        # Menu
+        menubar = tk.Menu(self.root)
+        edit_menu = tk.Menu(menubar, tearoff=0)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=self.undo)
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=self.redo)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Cut", accelerator="Ctrl+X", command=self.cut_selected)
+        edit_menu.add_command(label="Copy", accelerator="Ctrl+C", command=self.copy_selected)
+        edit_menu.add_command(label="Paste", accelerator="Ctrl+V", command=self.paste)
+        edit_menu.add_command(label="Delete", accelerator="Del", command=self.delete_selected)
+        edit_menu.add_command(label="Move to Folder...", command=self.move_selected)
+        menubar.add_cascade(label="Edit", menu=edit_menu)
+        perf_menu = tk.Menu(menubar, tearoff=0)
+        perf_menu.add_command(label="Save Timings as JSON...", command=self.save_timings)
+        profile_menu = tk.Menu(perf_menu, tearoff=0)
+        for operation in OPERATIONS:
+            profile_menu.add_command(label=operation, command=lambda operation=operation: self.profile_next(operation))
+        perf_menu.add_cascade(label="Profile Next", menu=profile_menu)
+        menubar.add_cascade(label="Performance", menu=perf_menu)
+        self.root.config(menu=menubar)
+        
         # GUI Layout
         self.main_frame = ttk.Frame(self.root, padding="10")
         self.main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -28,7 +84,7 @@ class DataTreeApp:
         self.root.rowconfigure(0, weight=1)
         
         # Tree Display
-        self.treeview = ttk.Treeview(self.main_frame, columns=("Content",), show="tree")
+        self.treeview = ttk.Treeview(self.main_frame, columns=("Content",), show="tree", selectmode="extended")
         self.treeview.column("Content", width=200, stretch=True)
         self.treeview.heading("Content", text="Content")
         self.treeview.grid(row=0, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -37,11 +93,19 @@ class DataTreeApp:
         scrollbar = ttk.Scrollbar(self.main_frame, orient=tk.VERTICAL, command=self.treeview.yview)
         self.treeview.configure(yscroll=scrollbar.set)
         scrollbar.grid(row=0, column=3, sticky=(tk.N, tk.S))
+        self.tree_view = LazyTreeview(self.treeview, self.model)
         
         # Bindings
         self.treeview.bind("<Double-Button-1>", self.view_entry)
         self.treeview.bind("<Button-3>", self.on_right_click)
         self.treeview.bind("<space>", self.toggle_tree)
+        self.treeview.bind("<Control-z>", self.undo)
+        self.treeview.bind("<Control-y>", self.redo)
+        self.treeview.bind("<Control-Z>", self.redo)
+        self.treeview.bind("<Control-x>", self.cut_selected)
+        self.treeview.bind("<Control-c>", self.copy_selected)
+        self.treeview.bind("<Control-v>", self.paste)
+        self.treeview.bind("<Delete>", self.delete_selected)
         
         # Buttons
         ttk.Button(self.main_frame, text="New Folder", command=self.add_folder).grid(row=1, column=0, pady=5, sticky=tk.W)
@@ -52,142 +116,167 @@ class DataTreeApp:
         self.search_var = tk.StringVar()
         ttk.Entry(self.main_frame, textvariable=self.search_var).grid(row=2, column=0, columnspan=2, pady=5, sticky=(tk.W, tk.E))
         ttk.Button(self.main_frame, text="Search", command=self.search).grid(row=2, column=2, pady=5, sticky=tk.W)
+        self.live_search = LiveSearch(self.root, self.main_frame, self.search_var, self.search_index, self.tree_view.reveal, perf=self.perf)
+        self.live_search.frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.live_search.frame.grid_remove()
+        
+        # Save status
+        self.save_status_var = tk.StringVar(value="saved")
+        ttk.Label(self.main_frame, textvariable=self.save_status_var).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        self.saver = SaveScheduler(self.root, self.data_file, self.model.snapshot, on_status=self.save_status_var.set, journal=self.journal, on_written=save_snapshot, perf=self.perf,
+                                   on_snapshot=self.edits.mark, on_saved=self.file_saved, level=compress_level)
+        if self.use_journal:
+            self.model.subscribe(self.journal_changes)
+        
+        # Load progress, shown only while a file is loading
+        self.load_frame = ttk.Frame(self.main_frame)
+        self.load_frame.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.load_progress = ttk.Progressbar(self.load_frame, mode='determinate')
+        self.load_progress.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        self.load_status_var = tk.StringVar()
+        ttk.Label(self.load_frame, textvariable=self.load_status_var).grid(row=0, column=1, padx=5)
+        ttk.Button(self.load_frame, text="Cancel", command=self.cancel_load).grid(row=0, column=2)
+        self.load_frame.columnconfigure(0, weight=1)
+        self.load_frame.grid_remove()
         
         # Configure main_frame to expand treeview
         self.main_frame.columnconfigure(0, weight=1)
         self.main_frame.rowconfigure(0, weight=1)
         
+        # Status bar with the latency of the last operation
+        self.perf_var = tk.StringVar()
+        ttk.Label(self.root, textvariable=self.perf_var, relief=tk.SUNKEN, padding=(5, 2)).grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.perf.on_record = lambda record: self.perf_var.set(format_record(record))
+        self.perf.record(load_timer)
+        
         # Track tree state
         self.is_tree_open = True
+        self.tree_view.load_state(view_state_file(self.data_file))
         self.update_treeview()
+        self.refresh_snapshot()
+        
+        # Changes other programs make to the data file are merged in
+        self.reload_job = None
+        self.watcher = FileWatcher(self.root, self.data_file, self.file_changed,
+                                   paused=lambda: self.saver.worker is not None or self.loader is not None).start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def load_tree(self, file_path):
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            self.convert_entries(data)
-            return data
-        return {}
-    
-    def convert_entries(self, node):
-        for key, val in list(node.items()):
-            if isinstance(val, str):
-                node[key] = {"content": val, "image": None}
-            elif isinstance(val, dict) and 'content' not in val:
-                self.convert_entries(val)
+        return read_tree(file_path)
+    
+    def refresh_snapshot(self):
+        # Parsed from JSON, so write the snapshot the next start opens from.
+        if self.model.source is None and os.path.exists(self.data_file):
+            save_snapshot_async(self.data_file, self.model.snapshot())
     
     def save_tree(self):
-        with open(self.data_file, 'w') as f:
-            json.dump(self.tree_data, f, indent=4)
-    
-    def get_open_state(self, parent=''):
-        open_state = {}
-        for item in self.treeview.get_children(parent):
-            text = self.treeview.item(item)['text']
-            if text.endswith('/'):
-                open_state[text[:-1]] = self.treeview.item(item)['open']
-                open_state.update(self.get_open_state(item))
-        return open_state
-    
-    def restore_open_state(self, open_state, parent='', data=None):
-        if data is None:
-            data = self.tree_data
-        for name in data:
-            item_id = None
-            for item in self.treeview.get_children(parent):
-                if self.treeview.item(item)['text'] == f"{name}/":
-                    item_id = item
-                    break
-            if item_id and name in open_state:
-                self.treeview.item(item_id, open=open_state[name])
-                if isinstance(data[name], dict) and 'content' not in data[name]:
-                    self.restore_open_state(open_state, item_id, data[name])
-    
-    def update_treeview(self, parent='', data=None):
-        if data is None:
-            data = self.tree_data
-        # Save open state
-        open_state = self.get_open_state()
-        self.treeview.delete(*self.treeview.get_children(parent))
-        for name, value in sorted(data.items()):
-            if isinstance(value, dict):
-                if 'content' in value:
-                    content = value['content']
-                    self.treeview.insert(parent, 'end', text=name, values=(content,))
-                else:
-                    node_id = self.treeview.insert(parent, 'end', text=f"{name}/", values=("",))
-                    self.update_treeview(node_id, value)
-        # Restore open state
-        self.restore_open_state(open_state)
+        # A database commits each change itself and a sharded tree rewrites
+        # the shards that changed. In journal mode each change is already on
+        # disk too; only compact.
+        if self.store is not None:
+            if self.store_saver is not None:
+                self.store_saver.schedule()
+            return
+        if self.use_journal and not self.journal.needs_compaction():
+            return
+        self.saver.schedule()
+    
+    def file_saved(self, mark):
+        self.edits.saved(mark)
+        self.watcher.expect()
+    
+    def file_changed(self, signature):
+        # The file is read without the journal: records there are edits made
+        # here, which the merge keeps.
+        if self.store is not None or self.reload_job is not None:
+            return
+        file_path = self.data_file
+        job = FileHashJob(self.root, file_path, lambda hashes, error: self.merge_file(file_path, job, hashes, error), replay=False)
+        self.reload_job = job.start()
+    
+    def merge_file(self, file_path, job, hashes, error):
+        if job is not self.reload_job:
+            return
+        self.reload_job = None
+        if file_path != self.data_file or self.loader is not None:
+            return
+        if error is not None:
+            # Probably caught half written; the next change is read again.
+            self.perf_var.set(f"Could not reload {os.path.basename(file_path)}: {error}")
+            return
+        moves, conflicts = merge(self.hashes, hashes, self.edits)
+        use_disk = False
+        if conflicts:
+            paths = '\n'.join('/'.join(path) for path, _ in conflicts[:10]) + ('\n...' if len(conflicts) > 10 else '')
+            use_disk = messagebox.askyesno("File Changed", f"{os.path.basename(file_path)} was changed by another program, "
+                                           f"which also changed what was edited here:\n\n{paths}\n\n"
+                                           "Use the version on disk for these? No keeps the edits made here.")
+        apply_merge(self.model, self.edits, moves, conflicts, use_disk)
+        if conflicts and not use_disk:
+            self.save_tree()
+        self.perf_var.set(f"Merged {len(moves) + (len(conflicts) if use_disk else 0)} changes from {os.path.basename(file_path)}.")
+    
+    def journal_changes(self, changes):
+        # Merged changes are already in the file.
+        if self.store is not None or self.model.external:
+            return
+        try:
+            self.journal.append(changes)
+        except OSError:
+            self.saver.schedule()
+    
+    def update_treeview(self):
+        timer = self.perf.start('update_treeview')
+        rows = self.tree_view.rows_touched
+        self.tree_view.refresh()
+        self.perf.record(timer.stop(rows=self.tree_view.rows_touched - rows))
     
     def toggle_tree(self, event=None):
         self.is_tree_open = not self.is_tree_open
-        def set_tree_state(parent='', state=None):
-            for item in self.treeview.get_children(parent):
-                if self.treeview.item(item)['text'].endswith('/'):
-                    self.treeview.item(item, open=state)
-                    set_tree_state(item, state)
-        set_tree_state(state=self.is_tree_open)
-    
-    def get_folder_paths(self, node=None, path='', paths=None):
-        if paths is None:
-            paths = []
-        if node is None:
-            node = self.tree_data
-        for name, value in node.items():
-            full_path = f"{path}/{name}" if path else name
-            if isinstance(value, dict) and 'content' not in value:
-                paths.append(full_path)
-                self.get_folder_paths(value, full_path, paths)
-        return sorted(paths)
+        self.tree_view.set_all_open(self.is_tree_open)
+    
+    def get_folder_paths(self):
+        return sorted(self.model.folder_paths())
     
     def get_item_path(self, item):
-        path = []
-        while item:
-            text = self.treeview.item(item)['text']
-            if text.endswith('/'):
-                text = text[:-1]
-            path.append(text)
-            item = self.treeview.parent(item)
-        return '/'.join(reversed(path))
-    
-    def add_folder(self, parent_path=''):
+        # Path tuples come from the view, so names containing '/' survive.
+        return self.tree_view.item_paths[item]
+    
+    def add_folder(self, parent_path=()):
+        if self.busy():
+            return
         def submit_folder(event=None):
             path = folder_var.get().strip()
             if not path:
                 messagebox.showerror("Error", "Folder path cannot be empty.")
                 return
-            full_path = f"{parent_path}/{path}" if parent_path else path
-            parts = full_path.strip('/').split('/')
-            current = self.tree_data
-            for part in parts:
-                if part not in current:
-                    current[part] = {}
-                elif not isinstance(current[part], dict) or 'content' in current[part]:
-                    messagebox.showerror("Error", f"'{part}' is an entry, cannot add folder inside it.")
-                    return
-                current = current[part]
+            parts = list(parent_path) + path.strip('/').split('/')
+            try:
+                self.model.add_folder(parts)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.save_tree()
-            self.update_treeview()
             folder_window.destroy()
         
         folder_window = Toplevel(self.root)
-        folder_window.title("Add Folder")
+        folder_window.title(f"Add Folder in {'/'.join(parent_path)}" if parent_path else "Add Folder")
         ttk.Label(folder_window, text="Folder Path (e.g., subfolder):").grid(row=0, column=0, padx=5, pady=5)
-        folder_var = tk.StringVar(value=parent_path)
+        folder_var = tk.StringVar()
         ttk.Entry(folder_window, textvariable=folder_var).grid(row=0, column=1, padx=5, pady=5)
         folder_window.bind('<Return>', submit_folder)
         ttk.Button(folder_window, text="Submit", command=submit_folder).grid(row=1, column=0, columnspan=2, pady=5)
     
-    def add_entry(self, parent_path=''):
-        image_b64 = [None]
+    def add_entry(self, parent_path=()):
+        if self.busy():
+            return
+        image_ref = [None]
         image_status_var = tk.StringVar(value="No image selected")
         
         def select_image():
             file = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg;*.jpeg;*.png")])
             if file:
-                with open(file, 'rb') as f:
-                    image_b64[0] = base64.b64encode(f.read()).decode('utf-8')
+                image_ref[0] = self.blobs.put_file(file)
                 image_status_var.set(f"Image selected: {os.path.basename(file)}")
         
         def submit_entry(event=None):
@@ -197,35 +286,22 @@ class DataTreeApp:
             if not name or not content:
                 messagebox.showerror("Error", "Entry name and content cannot be empty.")
                 return
-            path = f"{folder}/{name}" if folder else name
-            parts = path.strip('/').split('/')
+            parts = list(folders.get(folder, ())) + name.strip('/').split('/')
             name = parts.pop()
-            current = self.tree_data
-            for part in parts:
-                if part not in current:
-                    current[part] = {}
-                elif not isinstance(current[part], dict) or 'content' in current[part]:
-                    messagebox.showerror("Error", f"'{part}' is an entry, cannot traverse into it.")
-                    return
-                current = current[part]
-            if name in current:
-                if isinstance(current[name], dict) and 'content' not in current[name]:
-                    messagebox.showerror("Error", f"'{name}' is a folder, cannot overwrite with entry.")
-                    return
-            entry_data = {"content": content}
-            if image_b64[0]:
-                entry_data["image"] = image_b64[0]
-            current[name] = entry_data
+            try:
+                self.model.add_entry(parts, name, content, image_ref[0] or None)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.save_tree()
-            self.update_treeview()
             entry_window.destroy()
         
         entry_window = Toplevel(self.root)
         entry_window.title("Add Entry")
         ttk.Label(entry_window, text="Parent Folder:").grid(row=0, column=0, padx=5, pady=5)
-        folder_var = tk.StringVar(value=parent_path)
-        folders = [''] + self.get_folder_paths()
-        ttk.Combobox(entry_window, textvariable=folder_var, values=folders, state='readonly').grid(row=0, column=1, padx=5, pady=5)
+        folder_var = tk.StringVar(value='/'.join(parent_path))
+        folders = {'/'.join(path): path for path in self.get_folder_paths()}
+        ttk.Combobox(entry_window, textvariable=folder_var, values=[''] + list(folders), state='readonly').grid(row=0, column=1, padx=5, pady=5)
         ttk.Label(entry_window, text="Entry Name:").grid(row=1, column=0, padx=5, pady=5)
         entry_name_var = tk.StringVar()
         ttk.Entry(entry_window, textvariable=entry_name_var).grid(row=1, column=1, padx=5, pady=5)
@@ -239,27 +315,23 @@ class DataTreeApp:
         ttk.Button(entry_window, text="Submit", command=submit_entry).grid(row=5, column=0, columnspan=2, pady=5)
     
     def edit_entry(self, item):
+        if self.busy():
+            return
         path = self.get_item_path(item)
-        parts = path.split('/')
-        name = parts.pop()
-        current = self.tree_data
-        for part in parts:
-            current = current[part]
-        value = current[name]
-        content = value['content']
-        image_b64 = [value.get('image')]
-        has_image = image_b64[0] is not None
+        value = self.model.node(path)
+        content = value.content
+        image_ref = [value.image]
+        has_image = image_ref[0] is not None
         image_status_var = tk.StringVar(value="Image attached" if has_image else "No image")
         
         def select_image():
             file = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg;*.jpeg;*.png")])
             if file:
-                with open(file, 'rb') as f:
-                    image_b64[0] = base64.b64encode(f.read()).decode('utf-8')
+                image_ref[0] = self.blobs.put_file(file)
                 image_status_var.set(f"New image selected: {os.path.basename(file)}")
         
         def remove_image():
-            image_b64[0] = None
+            image_ref[0] = None
             image_status_var.set("No image")
         
         def submit_edit(event=None):
@@ -267,17 +339,13 @@ class DataTreeApp:
             if not new_content:
                 messagebox.showerror("Error", "Content cannot be empty.")
                 return
-            value['content'] = new_content
-            if image_b64[0] is None:
-                value.pop('image', None)
-            else:
-                value['image'] = image_b64[0]
+            self.previews.invalidate(path)
+            self.model.edit_entry(path, new_content, image_ref[0])
             self.save_tree()
-            self.update_treeview()
             edit_window.destroy()
         
         edit_window = Toplevel(self.root)
-        edit_window.title(f"Edit Entry: {path}")
+        edit_window.title(f"Edit Entry: {'/'.join(path)}")
         ttk.Label(edit_window, text="Content:").grid(row=0, column=0, padx=5, pady=5)
         content_var = tk.StringVar(value=content)
         ttk.Entry(edit_window, textvariable=content_var).grid(row=0, column=1, padx=5, pady=5)
@@ -290,28 +358,129 @@ class DataTreeApp:
         ttk.Button(edit_window, text="Submit", command=submit_edit).grid(row=3, column=0, columnspan=2, pady=5)
     
     def delete_item(self, item):
+        if self.busy():
+            return
         path = self.get_item_path(item)
         item_type = "folder" if self.treeview.item(item)['values'][0] == '' else "entry"
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete this {item_type} (and all contents if a folder)?"):
-            parts = path.split('/')
-            name = parts.pop()
-            current = self.tree_data
-            for part in parts:
-                current = current[part]
-            del current[name]
+            self.model.delete(path)
+            self.save_tree()
+    
+    def selected_paths(self):
+        # Outermost first; what is selected inside a selected folder goes
+        # with it.
+        return outermost(self.get_item_path(item) for item in self.treeview.selection() if item in self.tree_view.item_paths)
+    
+    def delete_selected(self, event=None):
+        # Any number of items, in one transaction with one save.
+        if self.busy():
+            return
+        paths = self.selected_paths()
+        if len(paths) == 1:
+            self.delete_item(self.tree_view.items[paths[0]])
+        elif paths and messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete these {len(paths)} items (and all contents of folders)?"):
+            delete_paths(self.model, paths)
+            self.save_tree()
+    
+    def move_selected(self):
+        if self.busy():
+            return
+        paths = self.selected_paths()
+        if not paths:
+            return
+        def submit_move(event=None):
+            try:
+                moved = move_paths(self.model, paths, folders.get(folder_var.get(), ()))
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            if moved:
+                self.save_tree()
+            move_window.destroy()
+        
+        move_window = Toplevel(self.root)
+        move_window.title(f"Move {len(paths)} Items" if len(paths) > 1 else f"Move {'/'.join(paths[0])}")
+        ttk.Label(move_window, text="Target Folder:").grid(row=0, column=0, padx=5, pady=5)
+        folder_var = tk.StringVar()
+        folders = {'/'.join(path): path for path in self.get_folder_paths()}
+        ttk.Combobox(move_window, textvariable=folder_var, values=[''] + list(folders), state='readonly').grid(row=0, column=1, padx=5, pady=5)
+        move_window.bind('<Return>', submit_move)
+        ttk.Button(move_window, text="Submit", command=submit_move).grid(row=1, column=0, columnspan=2, pady=5)
+    
+    def cut_selected(self, event=None):
+        paths = self.selected_paths()
+        if paths:
+            self.clipboard = ('cut', paths)
+            self.perf_var.set(f"Cut {len(paths)} items; paste them into a folder with Ctrl+V.")
+    
+    def copy_selected(self, event=None):
+        paths = self.selected_paths()
+        if paths:
+            self.clipboard = ('copy', paths)
+            self.perf_var.set(f"Copied {len(paths)} items; paste them into a folder with Ctrl+V.")
+    
+    def paste(self, event=None, folder=None):
+        # Into folder, or else the focused folder (an entry's own folder).
+        if self.clipboard is None or self.busy():
+            return
+        if folder is None:
+            item = self.treeview.focus()
+            folder = ()
+            if item in self.tree_view.item_paths:
+                folder = self.get_item_path(item)
+                if not self.tree_view.is_folder_item(item):
+                    folder = folder[:-1]
+        mode, paths = self.clipboard
+        try:
+            if mode == 'cut':
+                count = move_paths(self.model, paths, folder)
+                self.clipboard = None
+            else:
+                count = copy_paths(self.model, paths, self.model, folder)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if count:
+            self.save_tree()
+    
+    def undo(self, event=None):
+        if self.busy():
+            return
+        if self.history.undo() is not None:
+            self.save_tree()
+    
+    def redo(self, event=None):
+        if self.busy():
+            return
+        if self.history.redo() is not None:
             self.save_tree()
-            self.update_treeview()
     
     def on_right_click(self, event):
         item = self.treeview.identify_row(event.y)
-        parent_path = ''
+        if item not in self.tree_view.item_paths:
+            item = ''  # Placeholder rows stand for nothing in the model
+        parent_path = ()
+        if item and item in self.treeview.selection() and len(self.selected_paths()) > 1:
+            # Batch menu for the whole selection
+            count = len(self.selected_paths())
+            menu = tk.Menu(self.root, tearoff=0)
+            menu.add_command(label=f"Delete {count} Items", command=self.delete_selected)
+            menu.add_command(label=f"Move {count} Items to Folder...", command=self.move_selected)
+            menu.add_command(label="Cut", command=self.cut_selected)
+            menu.add_command(label="Copy", command=self.copy_selected)
+            menu.post(event.x_root, event.y_root)
+            return
         if item:
             self.treeview.selection_set(item)
+            self.treeview.focus(item)
             parent_path = self.get_item_path(item)
             if self.treeview.item(item)['values'][0] != '':  # Is entry
                 menu = tk.Menu(self.root, tearoff=0)
                 menu.add_command(label="Edit", command=lambda: self.edit_entry(item))
                 menu.add_command(label="Delete", command=lambda: self.delete_item(item))
+                menu.add_command(label="Move to Folder...", command=self.move_selected)
+                menu.add_command(label="Cut", command=self.cut_selected)
+                menu.add_command(label="Copy", command=self.copy_selected)
                 menu.post(event.x_root, event.y_root)
                 return
         else:
@@ -320,78 +489,214 @@ class DataTreeApp:
         menu = tk.Menu(self.root, tearoff=0)
         menu.add_command(label="Add New Folder", command=lambda: self.add_folder(parent_path))
         menu.add_command(label="Add New Entry", command=lambda: self.add_entry(parent_path))
+        if self.clipboard is not None:
+            menu.add_command(label=f"Paste {len(self.clipboard[1])} Items", command=lambda: self.paste(folder=parent_path))
         if item:  # Add Delete only if clicking on a folder
             menu.add_command(label="Delete", command=lambda: self.delete_item(item))
+            menu.add_command(label="Move to Folder...", command=self.move_selected)
+            menu.add_command(label="Cut", command=self.cut_selected)
+            menu.add_command(label="Copy", command=self.copy_selected)
         menu.post(event.x_root, event.y_root)
     
     def view_entry(self, event):
         item = self.treeview.focus()
-        if item and self.treeview.item(item)['values'][0] != '':  # Is entry
+        if item and self.loader is None and self.treeview.item(item)['values'][0] != '':  # Is entry
+            timer = self.perf.start('view_entry')
             path = self.get_item_path(item)
-            parts = path.split('/')
-            name = parts.pop()
-            current = self.tree_data
-            for part in parts:
-                current = current[part]
-            value = current[name]
-            content = value['content']
-            image_b64 = value.get('image')
+            value = self.model.node(path)
+            content = value.content
+            image_ref = value.image
             
             viewer = Toplevel(self.root)
-            viewer.title(f"Entry: {path}")
+            viewer.title(f"Entry: {'/'.join(path)}")
             ttk.Label(viewer, text="Content:").pack(padx=5, pady=5)
             ttk.Label(viewer, text=content).pack(padx=5, pady=5)
-            if image_b64:
-                try:
-                    img_data = base64.b64decode(image_b64)
-                    img = Image.open(BytesIO(img_data))
-                    photo = ImageTk.PhotoImage(img)
-                    img_label = ttk.Label(viewer, image=photo)
+            if image_ref:
+                blobs = self.blobs
+                img_label = ttk.Label(viewer, text="Loading image...")
+                img_label.pack(padx=5, pady=5)
+                
+                def show_preview(preview, full_size, error):
+                    if not img_label.winfo_exists():
+                        timer.stop()
+                        return
+                    if error is not None:
+                        img_label.config(text=f"Error loading image: {str(error)}")
+                        self.perf.record(timer)
+                        return
+                    photo = ImageTk.PhotoImage(preview)
+                    img_label.config(image=photo, text='')
                     img_label.image = photo
-                    img_label.pack(padx=5, pady=5)
-                except Exception as e:
-                    ttk.Label(viewer, text=f"Error loading image: {str(e)}").pack(padx=5, pady=5)
+                    if preview.size != full_size:
+                        ttk.Button(viewer, text=f"Full Size ({full_size[0]}x{full_size[1]})",
+                                   command=lambda: self.view_full_image(path, image_ref)).pack(pady=5)
+                    # Timed until the preview is on screen.
+                    self.perf.record(timer)
+                
+                # The window opens at once; the image is decoded off the Tk
+                # thread and dropped if the window closes first.
+                handle = self.previews.request(path, image_ref, lambda: blobs.get(image_ref), screen_fit(self.root), show_preview)
+                viewer.bind("<Destroy>", lambda e: e.widget is viewer and self.previews.cancel(handle))
+            else:
+                self.perf.record(timer)
+    
+    def view_full_image(self, path, image_ref):
+        try:
+            show_full_image(self.root, f"Image: {'/'.join(path)}", self.blobs.get(image_ref))
+        except Exception as e:
+            messagebox.showerror("Error", f"Error loading image: {str(e)}")
+    
+    def busy(self):
+        if self.loader is not None:
+            messagebox.showinfo("Loading", "Please wait until the file has finished loading.")
+            return True
+        return False
     
     def load_file(self):
-        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if self.busy():
+            return
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json *.json.gz *.json.xz *.json.bz2"), ("SQLite databases", "*.db"), ("Sharded trees", MANIFEST)])
         if file_path:
-            self.data_file = file_path
-            self.tree_data = self.load_tree(file_path)
-            self.update_treeview()
-            self.root.title(f"DataTree - {os.path.basename(file_path)}")
+            self.saver.flush()
+            self.tree_view.save_state(view_state_file(self.data_file))
+            if file_path.endswith('.db') or is_manifest(file_path):
+                self.open_database(file_path)
+                return
+            previous_data = self.model.root
+            blobs = BlobStore(blob_dir(file_path))
+            journal = Journal(journal_file(file_path))
+            snapshot = open_snapshot(file_path)
+            if snapshot is not None:
+                timer = self.perf.start('load_tree')
+                root = snapshot.load()
+                journal.replay(root)
+                self.tree_view.load_state(view_state_file(file_path))
+                self.finish_load(file_path, previous_data, root, None)
+                self.perf.record(timer.stop(nodes=len(self.model.index)))
+                return
+            # Top-level items show up as they are parsed; edits wait until the
+            # whole file is in.
+            self.tree_view.load_state(view_state_file(file_path))
+            self.model.reset(Folder())
+            self.load_progress.config(value=0)
+            self.load_frame.grid()
+            self.loader = LoadJob(self.root, file_path, self.model.add_loaded, self.show_load_progress,
+                                  lambda data, error: self.finish_load(file_path, previous_data, data, error),
+                                  on_entry=blobs.migrate, journal=journal, perf=self.perf).start()
+    
+    def open_database(self, file_path):
+        # Only the top level is read here; folders, or the shards holding
+        # them, are fetched as they open.
+        timer = self.perf.start('load_tree')
+        try:
+            store = ShardStorage(file_path) if is_manifest(file_path) else SqliteStorage(file_path)
+            root = store.load()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            timer.stop()
+            messagebox.showerror("Error", f"Could not load {file_path}: {e}")
+            return
+        self.close_store()
+        self.clipboard = None
+        self.store = store
+        if is_manifest(file_path):
+            self.store_saver = SaveScheduler(self.root, file_path, store.snapshot, on_status=self.save_status_var.set, perf=self.perf,
+                                             on_saved=lambda mark: store.saved(), write=store.write)
+        self.model.subscribe(store.apply)
+        # A database is shared safely by SQLite itself, and shards are
+        # written as edits are made.
+        self.watcher.watch(None)
+        self.data_file = file_path
+        self.blobs = BlobStore(blob_dir(file_path))
+        self.previews.clear()
+        self.tree_view.load_state(view_state_file(file_path))
+        self.model.reset(root)
+        self.perf.record(timer.stop(nodes=len(self.model.index)))
+        self.root.title(f"DataTree - {os.path.basename(file_path)}")
+    
+    def close_store(self):
+        if self.store is not None:
+            if self.store_saver is not None:
+                self.store_saver.flush()
+                self.store_saver = None
+            self.model.unsubscribe(self.store.apply)
+            self.store.close()
+            self.store = None
+        elif self.model.source is not None:
+            # The tree was served from its snapshot.
+            self.model.source.close()
+    
+    def show_load_progress(self, bytes_read, total_bytes, nodes):
+        self.load_progress.config(maximum=max(total_bytes, 1), value=bytes_read)
+        self.load_status_var.set(f"{bytes_read // 1024} / {total_bytes // 1024} KB, {nodes} nodes")
+    
+    def cancel_load(self):
+        if self.loader is not None:
+            self.loader.cancel()
+    
+    def finish_load(self, file_path, previous_data, data, error):
+        index = self.loader.index if self.loader is not None else None
+        timer = self.loader.timer if self.loader is not None else None
+        self.loader = None
+        self.load_frame.grid_remove()
+        if error is not None:
+            self.tree_view.load_state(view_state_file(self.data_file))
+            self.model.reset(previous_data)
+            if not isinstance(error, LoadCancelled):
+                messagebox.showerror("Error", f"Could not load {file_path}: {error}")
+            return
+        self.close_store()
+        self.clipboard = None
+        self.data_file = file_path
+        self.saver.file_path = file_path
+        self.journal = Journal(journal_file(file_path))
+        self.saver.journal = self.journal
+        self.blobs = BlobStore(blob_dir(file_path))
+        self.previews.clear()
+        self.model.reset(data, index)
+        self.edits.reset(self.journal.paths())
+        self.watcher.watch(file_path)
+        if timer is not None:
+            self.perf.record(timer)
+        self.refresh_snapshot()
+        self.root.title(f"DataTree - {os.path.basename(file_path)}")
+    
+    def on_close(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.tree_view.load_state(view_state_file(self.data_file))
+        for saver in (self.saver, self.store_saver):
+            if saver is not None and not saver.flush():
+                if not messagebox.askyesno("Save Failed", f"Could not save {saver.file_path}: {saver.error}\nClose anyway?"):
+                    return
+        try:
+            self.tree_view.save_state(view_state_file(self.data_file))
+        except OSError:
+            pass
+        self.previews.shutdown()
+        self.close_store()
+        self.root.destroy()
+    
+    def save_timings(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        if file_path:
+            try:
+                self.perf.dump(file_path)
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not save {file_path}: {e}")
+    
+    def profile_next(self, operation):
+        file_path = filedialog.asksaveasfilename(defaultextension=".prof", initialfile=f"{operation}.prof",
+                                                 filetypes=[("Profile data", "*.prof")])
+        if file_path:
+            self.perf.profile(operation, file_path)
+            self.perf_var.set(f"The next {operation} will be profiled.")
     
     def search(self):
         term = self.search_var.get().strip()
         if not term:
             messagebox.showerror("Error", "Search term cannot be empty.")
             return
-        results = []
-        def search_recursive(node, term, path=''):
-            for name, value in sorted(node.items()):
-                full_path = f"{path}/{name}" if path else name
-                if term.lower() in name.lower():
-                    if isinstance(value, dict):
-                        if 'content' in value:
-                            results.append(f"Entry: {full_path} (content: {value['content']})")
-                        else:
-                            results.append(f"Folder: {full_path}/")
-                if isinstance(value, dict) and 'content' not in value:
-                    search_recursive(value, term, full_path)
-        
-        search_recursive(self.tree_data, term)
-        result_window = Toplevel(self.root)
-        result_window.title("Search Results")
-        result_text = tk.Text(result_window, height=10, width=50)
-        result_text.grid(row=0, column=0, padx=5, pady=5)
-        scrollbar = ttk.Scrollbar(result_window, orient=tk.VERTICAL, command=result_text.yview)
-        result_text.configure(yscrollcommand=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        if results:
-            for res in results:
-                result_text.insert(tk.END, res + '\n')
-        else:
-            result_text.insert(tk.END, "No matches found.")
-        result_text.config(state='disabled')
+        self.live_search.run()
 
 if __name__ == "__main__":
     root = tk.Tk()
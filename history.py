@@ -0,0 +1,97 @@
+from treemodel import ADDED, REMOVED, CHANGED, RESET, LOADED, is_entry, load_all
+
+
+class History:
+    # Unlimited undo and redo for a TreeModel. Each notify from the model is
+    # one step, kept as its changes; the nodes they removed or replaced are
+    # held by reference, not copied. Entries are immutable, and undoing and
+    # redoing strictly in order hands every folder back in the state its
+    # step left it in, so versions share everything unchanged and a step
+    # costs memory only for what it touched. Undo and redo go through the
+    # model like any edit, in one transaction, so views, indexes, journals
+    # and stores are patched once per step. Loading another tree clears the
+    # history. Changes made in an external transaction are not steps; the
+    # steps they overlap are dropped, along with every step further down the
+    # same stack.
+    #
+    # Subscribe before a storage backend that writes back: folders removed
+    # before they were ever opened are fetched here, while their rows still
+    # exist, or before a rewritten snapshot drops them.
+    def __init__(self, model):
+        self.model = model
+        self.undo_steps = []
+        self.redo_steps = []
+        self.replaying = False
+        self.model.subscribe(self.apply)
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def apply(self, changes):
+        if self.replaying:
+            return
+        if any(change.kind in (RESET, LOADED) for change in changes):
+            self.clear()
+            return
+        if self.model.external:
+            paths = [change.path for change in changes]
+            self.undo_steps = self.independent(self.undo_steps, paths)
+            self.redo_steps = self.independent(self.redo_steps, paths)
+            return
+        step = [change for change in changes if change.kind in (ADDED, REMOVED, CHANGED)]
+        if not step:
+            return
+        source = self.model.source
+        if source is not None:
+            for change in step:
+                if change.kind == REMOVED and not is_entry(change.old):
+                    load_all(change.old)
+        self.undo_steps.append(step)
+        self.redo_steps.clear()
+
+    def independent(self, steps, paths):
+        # The steps replayed before any of steps that overlaps paths; the
+        # last of steps is replayed first.
+        for i in range(len(steps) - 1, -1, -1):
+            for change in steps[i]:
+                if any(change.path[:len(path)] == path or path[:len(change.path)] == change.path for path in paths):
+                    return steps[i + 1:]
+        return steps
+
+    def undo(self):
+        # Returns the paths the step touched, or None if there was nothing
+        # to undo.
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.replay([(change.path, None if change.kind == ADDED else change.old) for change in reversed(step)])
+        self.redo_steps.append(step)
+        return [change.path for change in step]
+
+    def redo(self):
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.replay([(change.path, change.node) for change in step])
+        self.undo_steps.append(step)
+        return [change.path for change in step]
+
+    def replay(self, moves):
+        # moves are (path, node) pairs; node None removes path.
+        self.replaying = True
+        try:
+            with self.model.transaction():
+                for path, node in moves:
+                    if node is None:
+                        self.model.delete(path)
+                    else:
+                        self.model.put(path, node)
+        finally:
+            self.replaying = False
@@ -0,0 +1,114 @@
+import json
+import os
+
+from treemodel import ADDED, REMOVED, CHANGED, Folder, coalesce, from_json, is_entry, json_default
+
+# Journals larger than this are folded back into the JSON snapshot.
+COMPACT_THRESHOLD = 1024 * 1024
+
+
+def journal_file(data_file):
+    return f"{data_file}.journal"
+
+
+def apply_record(root, record):
+    # Every record carries the full value now stored at its path, so replaying
+    # records that the snapshot already contains is harmless.
+    *parts, name = record['path']
+    current = root
+    for part in parts:
+        child = current.get(part)
+        if child is None or is_entry(child):
+            child = Folder(part)
+            current.set(child)
+        current = child
+    if record['op'] == REMOVED:
+        if name in current:
+            current.remove(name)
+    else:
+        current.set(from_json(record['node'], name))
+
+
+class Journal:
+    # Append-only log of model changes, one JSON record per line, kept next to
+    # the data file and replayed over it on load.
+    def __init__(self, file_path, threshold=COMPACT_THRESHOLD):
+        self.file_path = file_path
+        self.threshold = threshold
+
+    def size(self):
+        try:
+            return os.path.getsize(self.file_path)
+        except OSError:
+            return 0
+
+    def needs_compaction(self):
+        return self.size() > self.threshold
+
+    def append(self, changes):
+        lines = []
+        for change in coalesce(changes):
+            if change.kind not in (ADDED, REMOVED, CHANGED):
+                continue
+            record = {"op": change.kind, "path": list(change.path)}
+            if change.kind != REMOVED:
+                record["node"] = change.node
+            lines.append(json.dumps(record, separators=(',', ':'), default=json_default) + '\n')
+        if not lines:
+            return
+        with open(self.file_path, 'a') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def records(self):
+        if not os.path.exists(self.file_path):
+            return []
+        records = []
+        with open(self.file_path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break  # Torn write at the end of the log
+        return records
+
+    def replay(self, root):
+        records = self.records()
+        for record in records:
+            apply_record(root, record)
+        return len(records)
+
+    def paths(self):
+        # Paths of the records in the log: edits the data file does not hold.
+        if not os.path.exists(self.file_path):
+            return []
+        paths = []
+        with open(self.file_path, 'r') as f:
+            for line in f:
+                try:
+                    paths.append(tuple(json.loads(line)['path']))
+                except ValueError:
+                    break
+        return paths
+
+    def mark(self):
+        return self.size()
+
+    def compact(self, mark):
+        # Drops the records that were written before mark, which the snapshot
+        # that has just been saved already contains.
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'rb') as f:
+            f.seek(mark)
+            rest = f.read()
+        if not rest:
+            os.remove(self.file_path)
+            return
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(rest)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
@@ -0,0 +1,232 @@
+import json
+import os
+from bisect import bisect_left
+from collections import OrderedDict
+
+from treemodel import ADDED, REMOVED, CHANGED, RESET, LOADED, is_entry
+
+PLACEHOLDER_TEXT = "..."
+
+
+def view_state_file(data_file):
+    return f"{data_file}.view"
+
+
+class LazyTreeview:
+    # Drives a ttk.Treeview from a TreeModel, inserting a folder's rows only
+    # when it is expanded and dropping them again once more than max_collapsed
+    # folders have been collapsed since. Model changes are applied as patches.
+    # rows_touched counts rows inserted and rows cleared by refresh.
+    # row_tags, if set, maps a path to the tags its row is drawn with.
+    def __init__(self, treeview, model, max_collapsed=50):
+        self.treeview = treeview
+        self.model = model
+        self.max_collapsed = max_collapsed
+        self.item_paths = {}
+        self.items = {}
+        self.sorted_names = {}
+        self.placeholders = {}
+        self.collapsed = OrderedDict()
+        self.open_folders = set()
+        self.rows_touched = 0
+        self.row_tags = None
+        self.treeview.bind("<<TreeviewOpen>>", self.on_open, add="+")
+        self.treeview.bind("<<TreeviewClose>>", self.on_close, add="+")
+        self.model.subscribe(self.apply)
+
+    def node(self, path):
+        return self.model.node(path)
+
+    def is_folder_item(self, item):
+        return item in self.item_paths and not is_entry(self.node(self.item_paths[item]))
+
+    def refresh(self, open_paths=None):
+        if open_paths is not None:
+            self.open_folders = set(open_paths)
+        self.rows_touched += len(self.item_paths) + len(self.placeholders)
+        self.treeview.delete(*self.treeview.get_children(''))
+        self.item_paths.clear()
+        self.items.clear()
+        self.sorted_names.clear()
+        self.placeholders.clear()
+        self.collapsed.clear()
+        self.populate('', ())
+
+    def get_open_paths(self):
+        return set(self.open_folders)
+
+    def load_state(self, file_path):
+        # Only sets the folders to reopen; the next refresh applies them.
+        if not os.path.exists(file_path):
+            return
+        try:
+            with open(file_path, 'r') as f:
+                self.open_folders = {tuple(path) for path in json.load(f)}
+        except (OSError, ValueError):
+            self.open_folders = set()
+
+    def save_state(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(sorted(self.open_folders), f)
+
+    def insert_row(self, parent, index, path, value):
+        name = path[-1]
+        self.rows_touched += 1
+        tags = self.row_tags(path) if self.row_tags else ()
+        if is_entry(value):
+            item = self.treeview.insert(parent, index, text=name, values=(value.content,), tags=tags)
+        else:
+            item = self.treeview.insert(parent, index, text=f"{name}/", values=("",), tags=tags)
+        self.item_paths[item] = path
+        self.items[path] = item
+        if is_entry(value):
+            return item
+        if path in self.open_folders:
+            self.populate(item, path)
+            self.treeview.item(item, open=True)
+        elif value:
+            self.placeholders[item] = self.treeview.insert(item, 'end', text=PLACEHOLDER_TEXT, values=("",))
+            self.rows_touched += 1
+        return item
+
+    def populate(self, parent, path):
+        folder = self.node(path)
+        self.sorted_names[path] = list(folder.names)
+        for node in folder.sorted_children():
+            self.insert_row(parent, 'end', path + (node.name,), node)
+
+    def expand(self, item):
+        placeholder = self.placeholders.pop(item, None)
+        if placeholder is not None:
+            self.treeview.delete(placeholder)
+            self.populate(item, self.item_paths[item])
+        self.collapsed.pop(item, None)
+
+    def on_open(self, event=None):
+        item = self.treeview.focus()
+        if self.is_folder_item(item):
+            self.expand(item)
+            self.open_folders.add(self.item_paths[item])
+
+    def on_close(self, event=None):
+        item = self.treeview.focus()
+        if not self.is_folder_item(item):
+            return
+        self.open_folders.discard(self.item_paths[item])
+        self.collapsed[item] = True
+        self.collapsed.move_to_end(item)
+        while len(self.collapsed) > self.max_collapsed:
+            oldest, _ = self.collapsed.popitem(last=False)
+            self.evict(oldest)
+
+    def evict(self, item):
+        if item not in self.item_paths or item in self.placeholders:
+            return
+        if self.treeview.item(item, 'open'):
+            return
+        self.forget_descendants(item)
+        self.sorted_names.pop(self.item_paths[item], None)
+        children = self.treeview.get_children(item)
+        if children:
+            self.treeview.delete(*children)
+            self.placeholders[item] = self.treeview.insert(item, 'end', text=PLACEHOLDER_TEXT, values=("",))
+
+    def forget(self, item):
+        path = self.item_paths.pop(item, None)
+        if path is not None:
+            self.items.pop(path, None)
+            self.sorted_names.pop(path, None)
+        self.placeholders.pop(item, None)
+        self.collapsed.pop(item, None)
+
+    def forget_descendants(self, item):
+        stack = list(self.treeview.get_children(item))
+        while stack:
+            child = stack.pop()
+            if child in self.item_paths:
+                self.forget(child)
+                stack.extend(self.treeview.get_children(child))
+
+    def retag(self):
+        # Redraws the tags of the rows that exist; others get theirs when
+        # they are inserted.
+        for path, item in self.items.items():
+            self.treeview.item(item, tags=self.row_tags(path) if self.row_tags else ())
+
+    def set_all_open(self, state):
+        if not state:
+            self.refresh(open_paths=set())
+            return
+        stack = list(self.treeview.get_children(''))
+        while stack:
+            item = stack.pop()
+            if self.is_folder_item(item):
+                self.expand(item)
+                self.treeview.item(item, open=True)
+                self.open_folders.add(self.item_paths[item])
+                stack.extend(self.treeview.get_children(item))
+
+    def reveal(self, path):
+        # Opens only the ancestors of path, then scrolls to and selects it.
+        for i in range(1, len(path)):
+            item = self.items[path[:i]]
+            self.expand(item)
+            self.treeview.item(item, open=True)
+            self.open_folders.add(path[:i])
+        item = self.items[path]
+        self.treeview.see(item)
+        self.treeview.selection_set(item)
+        self.treeview.focus(item)
+        return item
+
+    def parent_item(self, path):
+        # Returns the row the children of path hang from, or None when that
+        # folder's rows are not materialized.
+        if not path:
+            return ''
+        item = self.items.get(path)
+        if item is None or item in self.placeholders:
+            return None
+        return item
+
+    def apply(self, changes):
+        for change in changes:
+            if change.kind == RESET:
+                self.refresh()
+            elif change.kind in (ADDED, LOADED):
+                self.apply_added(change.path, change.node)
+            elif change.kind == REMOVED:
+                self.apply_removed(change.path)
+            elif change.kind == CHANGED:
+                self.apply_changed(change.path, change.node)
+
+    def apply_added(self, path, value):
+        parent = self.parent_item(path[:-1])
+        if parent is None:
+            return
+        if path in self.items:
+            self.apply_removed(path)
+        names = self.sorted_names.setdefault(path[:-1], [])
+        index = bisect_left(names, path[-1])
+        names.insert(index, path[-1])
+        self.insert_row(parent, index, path, value)
+
+    def apply_removed(self, path):
+        self.open_folders = {p for p in self.open_folders if p[:len(path)] != path}
+        item = self.items.get(path)
+        if item is None:
+            return
+        self.forget_descendants(item)
+        self.forget(item)
+        self.treeview.delete(item)
+        names = self.sorted_names.get(path[:-1])
+        if names:
+            index = bisect_left(names, path[-1])
+            if index < len(names) and names[index] == path[-1]:
+                del names[index]
+
+    def apply_changed(self, path, value):
+        item = self.items.get(path)
+        if item is None:
+            return
+        self.treeview.item(item, values=(value.content,))
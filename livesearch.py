@@ -0,0 +1,148 @@
+import tkinter as tk
+from tkinter import ttk
+
+from treemodel import is_entry
+
+DELAY_MS = 200
+LIMIT = 1000
+# Above this many previous matches, asking the index again is faster than
+# rechecking each one.
+NARROW_MAX = 5000
+
+
+class VirtualList:
+    # A Listbox that only ever holds the rows in view. The scrollbar is
+    # driven by hand over count rows and format_row(i) is called for the
+    # visible ones only.
+    def __init__(self, parent, format_row, on_select, height=8):
+        self.format_row = format_row
+        self.on_select = on_select
+        self.height = height
+        self.count = 0
+        self.top = 0
+        self.frame = ttk.Frame(parent)
+        self.listbox = tk.Listbox(self.frame, height=height, activestyle='none', exportselection=False)
+        self.listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.frame.columnconfigure(0, weight=1)
+        self.listbox.bind("<<ListboxSelect>>", self.on_listbox_select)
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll_by(-1 if e.delta > 0 else 1))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll_by(-1))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll_by(1))
+
+    def set_count(self, count):
+        self.count = count
+        self.top = 0
+        self.render()
+
+    def render(self):
+        end = min(self.count, self.top + self.height)
+        self.listbox.delete(0, tk.END)
+        rows = [self.format_row(i) for i in range(self.top, end)]
+        if rows:
+            self.listbox.insert(tk.END, *rows)
+        if self.count:
+            self.scrollbar.set(self.top / self.count, end / self.count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll_to(self, top):
+        top = max(0, min(top, self.count - self.height))
+        if top != self.top:
+            self.top = top
+            self.render()
+        return "break"
+
+    def scroll_by(self, rows):
+        return self.scroll_to(self.top + rows)
+
+    def on_scroll(self, action, value, units=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * self.count))
+        elif action == 'scroll':
+            self.scroll_by(int(value) * (self.height if units == 'pages' else 1))
+
+    def on_listbox_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            self.on_select(self.top + selection[0])
+
+
+class LiveSearch:
+    # Searches as search_var changes, delay ms after the last keystroke. When
+    # the term only grew, the previous match set is narrowed instead of asking
+    # the index again. Results go to a VirtualList; picking one calls
+    # on_pick with its path. Each search is timed into perf if given.
+    def __init__(self, root, parent, search_var, index, on_pick, delay=DELAY_MS, limit=LIMIT, perf=None):
+        self.root = root
+        self.search_var = search_var
+        self.index = index
+        self.on_pick = on_pick
+        self.delay = delay
+        self.limit = limit
+        self.perf = perf
+        self.after_id = None
+        self.term = ''
+        self.matches = None
+        self.generation = None
+        self.paths = []
+        self.results = VirtualList(parent, self.format_row, self.pick)
+        self.frame = self.results.frame
+        self.status_var = tk.StringVar()
+        ttk.Label(self.frame, textvariable=self.status_var).grid(row=1, column=0, columnspan=2, sticky=tk.W)
+        self.search_var.trace_add('write', self.schedule)
+        self.index.model.subscribe(self.on_changes)
+
+    def on_changes(self, changes):
+        # Keep the list current while the tree changes under it.
+        if self.term:
+            self.schedule()
+
+    def schedule(self, *args):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+        self.after_id = self.root.after(self.delay, self.run)
+
+    def run(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        term = self.search_var.get().strip().lower()
+        if not term:
+            self.term = ''
+            self.matches = None
+            self.paths = []
+            self.frame.grid_remove()
+            return
+        timer = self.perf.start('search') if self.perf else None
+        if (self.matches is not None and len(self.matches) <= NARROW_MAX and self.term
+                and term.startswith(self.term) and self.generation == self.index.generation):
+            self.matches = self.index.narrow(self.matches, term)
+        else:
+            self.matches = self.index.match_all(term)
+        self.term = term
+        self.generation = self.index.generation
+        self.paths = self.index.rank(term, self.matches, self.limit)
+        if len(self.matches) > len(self.paths):
+            self.status_var.set(f"Showing the best {len(self.paths)} of {len(self.matches)} matches.")
+        else:
+            self.status_var.set(f"{len(self.paths)} matches." if self.paths else "No matches found.")
+        self.frame.grid()
+        self.results.set_count(len(self.paths))
+        if timer is not None:
+            self.perf.record(timer.stop(nodes=len(self.matches), rows=min(len(self.paths), self.results.height)))
+
+    def format_row(self, i):
+        path = self.paths[i]
+        value = self.index.lookup(path)
+        if value is None:
+            return f"{'/'.join(path)} (removed)"
+        if is_entry(value):
+            return f"Entry: {'/'.join(path)} (content: {value.content})"
+        return f"Folder: {'/'.join(path)}/"
+
+    def pick(self, i):
+        path = self.paths[i]
+        if self.index.lookup(path) is not None:
+            self.on_pick(path)
@@ -0,0 +1,140 @@
+import cProfile
+import json
+import statistics
+import time
+from collections import deque, namedtuple
+
+RING_SIZE = 2000
+# What the apps time, and so what can be profiled.
+OPERATIONS = ('load_tree', 'save_tree', 'update_treeview', 'search', 'view_entry')
+# Upper bounds of the histogram buckets, in milliseconds; slower operations
+# land in a last, open-ended bucket.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# One timed operation. nodes, bytes_written and rows (Treeview rows touched)
+# are None where they do not apply; profile is the file a cProfile run of
+# this operation was written to.
+Record = namedtuple('Record', ['operation', 'started', 'seconds', 'nodes', 'bytes_written', 'rows', 'profile'])
+
+
+class Timer:
+    # Returned by PerfLog.start. Timing, and profiling if it was asked for,
+    # run until stop, which must be called on the thread that started it.
+    def __init__(self, operation, profile=None):
+        self.operation = operation
+        self.started = time.time()
+        self.counts = {}
+        self.profile = profile
+        self.profiler = None
+        if profile is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def stop(self, nodes=None, bytes_written=None, rows=None):
+        self.seconds = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            self.profiler = None
+        self.counts = {"nodes": nodes, "bytes_written": bytes_written, "rows": rows}
+        return self
+
+
+class PerfLog:
+    # Ring buffer of the last size timed operations. Timers may run on any
+    # thread, but record them on the Tk thread: on_record is called from
+    # record so it can update widgets.
+    def __init__(self, size=RING_SIZE, on_record=None):
+        self.records = deque(maxlen=size)
+        self.on_record = on_record
+        self.profile_next = None
+
+    def start(self, operation):
+        profile = None
+        # Matches scoped names too, e.g. "good search" for "search".
+        if self.profile_next is not None and operation.split(' ')[-1] == self.profile_next[0]:
+            profile = self.profile_next[1]
+            self.profile_next = None
+        return Timer(operation, profile)
+
+    def profile(self, operation, file_path):
+        # The next run of operation is profiled into file_path.
+        self.profile_next = (operation, file_path)
+
+    def record(self, timer):
+        if timer.seconds is None:
+            timer.stop()
+        record = Record(timer.operation, timer.started, timer.seconds, profile=timer.profile, **timer.counts)
+        self.records.append(record)
+        if self.on_record:
+            self.on_record(record)
+        return record
+
+    def scope(self, prefix):
+        return PerfScope(self, prefix)
+
+    def histogram(self):
+        by_operation = {}
+        for record in self.records:
+            by_operation.setdefault(record.operation, []).append(record.seconds * 1000)
+        operations = {}
+        for operation, times in sorted(by_operation.items()):
+            times.sort()
+            buckets = {f"<{bound}ms": 0 for bound in BUCKETS_MS}
+            buckets[f">={BUCKETS_MS[-1]}ms"] = 0
+            for ms in times:
+                for bound in BUCKETS_MS:
+                    if ms < bound:
+                        buckets[f"<{bound}ms"] += 1
+                        break
+                else:
+                    buckets[f">={BUCKETS_MS[-1]}ms"] += 1
+            operations[operation] = {
+                "count": len(times),
+                "min_ms": times[0],
+                "median_ms": statistics.median(times),
+                "p90_ms": times[min(len(times) - 1, int(len(times) * 0.9))],
+                "max_ms": times[-1],
+                "buckets": buckets,
+            }
+        return operations
+
+    def dump(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump({"operations": self.histogram(),
+                       "records": [record._asdict() for record in self.records]}, f, indent=4)
+
+
+class PerfScope:
+    # A PerfLog whose operation names get a prefix, e.g. one per pane.
+    def __init__(self, log, prefix):
+        self.log = log
+        self.prefix = prefix
+
+    def start(self, operation):
+        return self.log.start(f"{self.prefix} {operation}")
+
+    def record(self, timer):
+        return self.log.record(timer)
+
+
+def format_record(record):
+    # One line for a status bar.
+    if record.seconds < 1:
+        text = f"{record.operation}: {record.seconds * 1000:.1f} ms"
+    else:
+        text = f"{record.operation}: {record.seconds:.2f} s"
+    details = []
+    if record.nodes is not None:
+        details.append(f"{record.nodes:,} nodes")
+    if record.rows is not None:
+        details.append(f"{record.rows:,} rows")
+    if record.bytes_written is not None:
+        details.append(f"{record.bytes_written:,} bytes written")
+    if details:
+        text += f" ({', '.join(details)})"
+    if record.profile:
+        text += f", profile saved to {record.profile}"
+    return text
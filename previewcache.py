@@ -0,0 +1,160 @@
+import hashlib
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tkinter import ttk, Toplevel
+try:
+    from PIL import Image, ImageTk
+except ImportError:
+    pass  # User needs to install Pillow
+
+from blobstore import is_ref
+
+# Bytes of decoded pixel data kept across all cached previews.
+MEMORY_BUDGET = 64 * 1024 * 1024
+DECODE_WORKERS = 2
+POLL_MS = 50
+
+
+def image_hash(image):
+    # Blob references already name their content; legacy inline images are
+    # hashed here.
+    if is_ref(image):
+        return image
+    return hashlib.sha256(image.encode()).hexdigest()
+
+
+def screen_fit(root, fraction=0.75):
+    return (int(root.winfo_screenwidth() * fraction), int(root.winfo_screenheight() * fraction))
+
+
+def decode_preview(data, max_size):
+    # Returns the image scaled down to fit max_size and its full size. draft
+    # lets JPEGs decode at a reduced scale instead of at full resolution.
+    img = Image.open(BytesIO(data))
+    full_size = img.size
+    img.draft('RGB', max_size)
+    img.thumbnail(max_size)
+    img.load()
+    return img, full_size
+
+
+class PreviewCache:
+    # LRU of decoded previews keyed by (entry path, image hash, size), bounded
+    # by the bytes of pixel data they hold. Misses are read and decoded on a
+    # small thread pool; results are collected on the Tk thread by polling
+    # with root.after, and a key already being decoded is never decoded twice.
+    def __init__(self, root, budget=MEMORY_BUDGET, workers=DECODE_WORKERS):
+        self.root = root
+        self.budget = budget
+        self.workers = workers
+        self.items = OrderedDict()
+        self.used = 0
+        self.pool = None
+        self.pending = {}
+        self.polling = False
+
+    def key(self, path, image, max_size):
+        return (tuple(path), image_hash(image), max_size)
+
+    def request(self, path, image, load, max_size, on_ready):
+        # Calls on_ready(preview, full_size, error) on the Tk thread, right
+        # away on a hit. Returns a handle for cancel.
+        key = self.key(path, image, max_size)
+        item = self.items.get(key)
+        if item is not None:
+            self.items.move_to_end(key)
+            on_ready(item[0], item[1], None)
+            return None
+        job = self.pending.get(key)
+        if job is None:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preview')
+            job = self.pending[key] = (self.pool.submit(lambda: decode_preview(load(), max_size)), [])
+            if not self.polling:
+                self.polling = True
+                self.root.after(POLL_MS, self.poll)
+        job[1].append(on_ready)
+        return (key, on_ready)
+
+    def cancel(self, handle):
+        # Drops the callback; the decode itself is cancelled only if nobody
+        # else waits for it and it has not started yet.
+        if handle is None:
+            return
+        key, on_ready = handle
+        job = self.pending.get(key)
+        if job is None:
+            return
+        future, callbacks = job
+        if on_ready in callbacks:
+            callbacks.remove(on_ready)
+        if not callbacks and future.cancel():
+            del self.pending[key]
+
+    def poll(self):
+        for key, (future, callbacks) in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[key]
+            preview = full_size = error = None
+            try:
+                preview, full_size = future.result()
+            except Exception as e:
+                error = e
+            else:
+                self.put(key, preview, full_size)
+            for on_ready in callbacks:
+                on_ready(preview, full_size, error)
+        if self.pending:
+            self.root.after(POLL_MS, self.poll)
+        else:
+            self.polling = False
+
+    def put(self, key, preview, full_size):
+        cost = preview.width * preview.height * len(preview.getbands())
+        if key in self.items:
+            self.used -= self.items.pop(key)[2]
+        self.items[key] = (preview, full_size, cost)
+        self.used += cost
+        # The newest preview stays even if it alone is over budget.
+        while self.used > self.budget and len(self.items) > 1:
+            _, (_, _, old_cost) = self.items.popitem(last=False)
+            self.used -= old_cost
+
+    def invalidate(self, path):
+        path = tuple(path)
+        for key in [key for key in self.items if key[0] == path]:
+            self.used -= self.items.pop(key)[2]
+
+    def clear(self):
+        self.items.clear()
+        self.used = 0
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.pending.clear()
+
+
+def show_full_image(root, title, data):
+    # Full resolution is only decoded when asked for, in a scrollable window.
+    photo = ImageTk.PhotoImage(Image.open(BytesIO(data)))
+    window = Toplevel(root)
+    window.title(title)
+    width, height = screen_fit(root)
+    canvas = tk.Canvas(window, width=min(photo.width(), width), height=min(photo.height(), height),
+                       scrollregion=(0, 0, photo.width(), photo.height()))
+    xscroll = ttk.Scrollbar(window, orient=tk.HORIZONTAL, command=canvas.xview)
+    yscroll = ttk.Scrollbar(window, orient=tk.VERTICAL, command=canvas.yview)
+    canvas.configure(xscrollcommand=xscroll.set, yscrollcommand=yscroll.set)
+    canvas.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+    yscroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
+    xscroll.grid(row=1, column=0, sticky=(tk.W, tk.E))
+    window.columnconfigure(0, weight=1)
+    window.rowconfigure(0, weight=1)
+    canvas.create_image(0, 0, image=photo, anchor=tk.NW)
+    canvas.image = photo
+    return window
@@ -0,0 +1,217 @@
+import io
+import json
+import os
+import stat
+import tempfile
+import threading
+
+from compression import DEFAULT_LEVEL, compressor
+from treemodel import json_default
+
+DIRTY = 'dirty'
+SAVING = 'saving'
+SAVED = 'saved'
+ERROR = 'error'
+
+# Files larger than this are written without indentation when compact=None.
+COMPACT_THRESHOLD = 10 * 1024 * 1024
+
+
+def copy_mode(tmp_path, file_path):
+    # mkstemp creates tmp_path readable by its owner only; give it the mode
+    # of the file it replaces, or the one a new file would get.
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(tmp_path, mode)
+
+
+def write_json_atomic(file_path, data, compact=False, level=DEFAULT_LEVEL):
+    # A .json.gz, .json.xz or .json.bz2 file is streamed through its
+    # compressor at level.
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            stream = compressor(raw, file_path, level)
+            f = io.TextIOWrapper(stream, encoding='utf-8')
+            if compact:
+                # dumps runs the C encoder, which dump never uses.
+                f.write(json.dumps(data, separators=(',', ':'), default=json_default))
+            else:
+                json.dump(data, f, indent=4, default=json_default)
+            f.detach()
+            if stream is not raw:
+                stream.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        copy_mode(tmp_path, file_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SaveScheduler:
+    # Coalesces save requests made within delay ms into one write of a model
+    # snapshot, done on a worker thread as temp file + fsync + rename. When a
+    # journal is given, the records the snapshot covers are dropped afterwards.
+    # on_written(file_path, data) runs on the same thread after each write.
+    # Writes are timed into perf, a PerfLog, when one is given. on_snapshot()
+    # runs on the Tk thread as each snapshot is taken, and on_saved(mark),
+    # with what on_snapshot returned, once that snapshot is written. level
+    # is the compression level for compressed file names. write(data), when
+    # given, writes the snapshot instead, e.g. a Storage's, and returns the
+    # bytes written.
+    def __init__(self, root, file_path, snapshot, delay=500, compact=None, on_status=None, journal=None, on_written=None, perf=None,
+                 on_snapshot=None, on_saved=None, level=DEFAULT_LEVEL, write=None):
+        self.root = root
+        self.file_path = file_path
+        self.snapshot = snapshot
+        self.delay = delay
+        self.compact = compact
+        self.on_status = on_status
+        self.journal = journal
+        self.on_written = on_written
+        self.perf = perf
+        self.timer = None
+        self.on_snapshot = on_snapshot
+        self.on_saved = on_saved
+        self.level = level
+        self.writer = write
+        self.snapshot_mark = None
+        self.journal_mark = None
+        self.status = SAVED
+        self.after_id = None
+        self.worker = None
+        self.error = None
+        self.pending = False
+
+    def set_status(self, status):
+        if status == self.status and status != ERROR:
+            return
+        self.status = status
+        if self.on_status:
+            self.on_status(status if status != ERROR else f"{ERROR}: {self.error}")
+
+    def is_compact(self):
+        if self.compact is not None:
+            return self.compact
+        try:
+            return os.path.getsize(self.file_path) > COMPACT_THRESHOLD
+        except OSError:
+            return False
+
+    def schedule(self):
+        self.set_status(DIRTY)
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+        self.after_id = self.root.after(self.delay, self.start)
+
+    def start(self):
+        self.after_id = None
+        if self.worker is not None:
+            self.pending = True
+            return
+        self.pending = False
+        self.error = None
+        data = self.snapshot()
+        self.journal_mark = self.journal.mark() if self.journal else None
+        self.snapshot_mark = self.on_snapshot() if self.on_snapshot else None
+        self.set_status(SAVING)
+        self.worker = threading.Thread(target=self.run, args=(self.file_path, data, self.is_compact()), daemon=True)
+        self.worker.start()
+        self.root.after(50, self.poll)
+
+    def run(self, file_path, data, compact):
+        try:
+            self.write(file_path, data, compact)
+        except Exception as e:
+            self.error = e
+
+    def write(self, file_path, data, compact):
+        timer = self.perf.start('save_tree') if self.perf else None
+        try:
+            if self.writer is not None:
+                size = self.writer(data)
+            else:
+                write_json_atomic(file_path, data, compact, self.level)
+                size = os.path.getsize(file_path)
+            if self.on_written:
+                self.on_written(file_path, data)
+        except Exception:
+            if timer is not None:
+                timer.stop()
+            raise
+        if timer is not None:
+            # Recorded by poll or flush, on the Tk thread.
+            self.timer = timer.stop(bytes_written=size)
+
+    def record_timer(self):
+        if self.timer is not None:
+            self.perf.record(self.timer)
+            self.timer = None
+
+    def poll(self):
+        if self.worker is None:
+            return
+        if self.worker.is_alive():
+            self.root.after(50, self.poll)
+            return
+        self.worker = None
+        self.record_timer()
+        self.compact_journal()
+        self.report_saved()
+        if self.pending:
+            self.start()
+        else:
+            self.set_status(ERROR if self.error else SAVED)
+
+    def compact_journal(self):
+        if self.journal is None or self.journal_mark is None or self.error:
+            return
+        try:
+            self.journal.compact(self.journal_mark)
+        except OSError as e:
+            self.error = e
+        self.journal_mark = None
+
+    def report_saved(self):
+        if self.on_saved and not self.error:
+            self.on_saved(self.snapshot_mark)
+        self.snapshot_mark = None
+
+    def flush(self):
+        # Finishes any pending or running save on the calling thread.
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+            self.pending = True
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+            self.record_timer()
+            self.compact_journal()
+            self.report_saved()
+            self.pending = self.pending or self.error is not None
+        if self.pending or self.status in (DIRTY, ERROR):
+            self.pending = False
+            self.error = None
+            try:
+                data = self.snapshot()
+                self.journal_mark = self.journal.mark() if self.journal else None
+                self.snapshot_mark = self.on_snapshot() if self.on_snapshot else None
+                self.write(self.file_path, data, self.is_compact())
+            except Exception as e:
+                self.error = e
+            self.record_timer()
+            self.compact_journal()
+            self.report_saved()
+            self.set_status(ERROR if self.error else SAVED)
+        return self.error is None
@@ -0,0 +1,265 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+
+from treemodel import ADDED, REMOVED, CHANGED, RESET, LOADED, index_tree, is_entry
+
+GRAM = 3
+WORD = re.compile(r'\w+')
+DEFAULT_LIMIT = 100
+
+
+def grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def words(text):
+    return set(WORD.findall(text.lower()))
+
+
+class SearchIndex:
+    # Inverted index over a TreeModel: lowercased names by value and by
+    # trigram, and entry content by word. It is built on RESET and patched
+    # from every other change the model reports. Results are ranked exact
+    # name, name prefix, name substring, then content word prefix. When the
+    # model is served lazily by a storage backend, matching is left to the
+    # backend's own search; only edits made since are indexed here.
+    def __init__(self, model, limit=DEFAULT_LIMIT):
+        self.model = model
+        self.limit = limit
+        self.nodes = {}
+        self.names = {}
+        self.name_list = []
+        self.short_names = set()
+        self.grams = {}
+        self.words = {}
+        self.word_list = []
+        self.source = None
+        # Bulk additions leave the sorted key lists stale; search re-sorts.
+        self.lists_stale = True
+        # Bumped on every change, so callers can tell if saved matches still
+        # hold.
+        self.generation = 0
+        self.model.subscribe(self.apply)
+        self.rebuild()
+
+    def post(self, table, keys, key, path):
+        paths = table.get(key)
+        if paths is None:
+            paths = table[key] = set()
+            if keys is not None and not self.lists_stale:
+                insort(keys, key)
+        paths.add(path)
+
+    def unpost(self, table, keys, key, path):
+        paths = table.get(key)
+        if paths is None:
+            return
+        paths.discard(path)
+        if not paths:
+            del table[key]
+            if keys is not None and not self.lists_stale:
+                del keys[bisect_left(keys, key)]
+
+    def sort_lists(self):
+        if self.lists_stale:
+            self.name_list = sorted(self.names)
+            self.word_list = sorted(self.words)
+            self.lists_stale = False
+
+    def rebuild(self):
+        self.nodes.clear()
+        self.names.clear()
+        self.short_names.clear()
+        self.grams.clear()
+        self.words.clear()
+        self.lists_stale = True
+        self.source = self.model.source
+        if self.source is not None:
+            return
+        for path, node in index_tree(self.model.root).items():
+            if path:
+                self.add_node(path, node)
+
+    def add_node(self, path, node):
+        self.nodes[path] = node
+        name = node.name.lower()
+        self.post(self.names, self.name_list, name, path)
+        if len(name) < GRAM:
+            self.short_names.add(name)
+        for gram in grams(name):
+            self.post(self.grams, None, gram, path)
+        if is_entry(node):
+            for word in words(node.content):
+                self.post(self.words, self.word_list, word, path)
+
+    def remove_node(self, path):
+        node = self.nodes.pop(path)
+        name = node.name.lower()
+        self.unpost(self.names, self.name_list, name, path)
+        if name not in self.names:
+            self.short_names.discard(name)
+        for gram in grams(name):
+            self.unpost(self.grams, None, gram, path)
+        if is_entry(node):
+            for word in words(node.content):
+                self.unpost(self.words, self.word_list, word, path)
+
+    def add(self, path, node):
+        if path in self.nodes:
+            self.remove(path)
+        for child_path, child in index_tree(node, path).items():
+            self.add_node(child_path, child)
+
+    def remove(self, path):
+        if self.source is not None:
+            # Only edits are indexed, which may lie below a folder that
+            # never was.
+            below = [p for p in self.nodes if p[:len(path)] == path]
+        else:
+            node = self.nodes.get(path)
+            if node is None:
+                return
+            below = [p for p in index_tree(node, path) if p in self.nodes]
+        for child_path in below:
+            self.remove_node(child_path)
+
+    def apply(self, changes):
+        self.generation += 1
+        for change in changes:
+            if change.kind == RESET:
+                self.rebuild()
+            elif change.kind == LOADED:
+                self.lists_stale = True
+                self.add(change.path, change.node)
+            elif change.kind in (ADDED, CHANGED):
+                self.add(change.path, change.node)
+            elif change.kind == REMOVED:
+                self.remove(change.path)
+
+    def lookup(self, path):
+        if self.source is not None:
+            return self.model.lookup(path)
+        return self.nodes.get(path)
+
+    def name_candidates(self, term):
+        if len(term) >= GRAM:
+            postings = sorted((self.grams.get(gram, ()) for gram in grams(term)), key=len)
+            candidates = set(postings[0])
+            for paths in postings[1:]:
+                if not candidates:
+                    break
+                candidates &= paths
+            return candidates
+        # Too short for a trigram lookup; scan the (far fewer) distinct keys.
+        candidates = set()
+        for gram, paths in self.grams.items():
+            if term in gram:
+                candidates |= paths
+        for name in self.short_names:
+            if term in name:
+                candidates |= self.names[name]
+        return candidates
+
+    def word_prefix_paths(self, prefix):
+        paths = set()
+        i = bisect_left(self.word_list, prefix)
+        while i < len(self.word_list) and self.word_list[i].startswith(prefix):
+            paths |= self.words[self.word_list[i]]
+            i += 1
+        return paths
+
+    def content_candidates(self, term):
+        candidates = None
+        for word in sorted(words(term), key=len, reverse=True):
+            paths = self.word_prefix_paths(word)
+            candidates = paths if candidates is None else candidates & paths
+            if not candidates:
+                break
+        return candidates or set()
+
+    def match_all(self, term):
+        # Every path matching term, unranked.
+        term = term.strip().lower()
+        if not term:
+            return set()
+        self.sort_lists()
+        matches = {p for p in self.name_candidates(term) if term in p[-1].lower()}
+        if self.source is not None:
+            # The source finds term anywhere in content, not only at the
+            # start of a word; so must the edits made since, which are few.
+            matches |= {p for p, node in self.nodes.items() if is_entry(node) and term in node.content.lower()}
+            return {p for p in matches | self.source.search(term) if self.still_matches(term, p)}
+        return matches | self.content_candidates(term)
+
+    def still_matches(self, term, path):
+        # Checks a hit against the model, which may have been edited since
+        # the source was written or the path was indexed.
+        exists, node = self.model.peek(path)
+        if node is None:
+            return exists
+        return term in path[-1].lower() or (is_entry(node) and term in node.content.lower())
+
+    def narrow(self, paths, term):
+        # Filters the matches of a shorter term down to those of term, which
+        # must extend it: names are rechecked within paths only, content
+        # words come from the word index.
+        term = term.strip().lower()
+        if self.source is not None:
+            return self.match_all(term) & paths
+        self.sort_lists()
+        matches = {p for p in paths if term in p[-1].lower()}
+        matches |= self.content_candidates(term) & paths
+        return matches
+
+    def rank(self, term, paths, limit=None):
+        # Orders a match set the way search does and keeps the first limit.
+        term = term.strip().lower()
+        limit = limit or self.limit
+        exact, prefix, substring, content = [], [], [], []
+        for path in paths:
+            name = path[-1].lower()
+            if name == term:
+                exact.append(path)
+            elif name.startswith(term):
+                prefix.append((name, path))
+            elif term in name:
+                substring.append(path)
+            else:
+                content.append(path)
+        results = heapq.nsmallest(limit, exact)
+        results += [path for _, path in heapq.nsmallest(limit - len(results), prefix)]
+        results += heapq.nsmallest(limit - len(results), substring)
+        results += heapq.nsmallest(limit - len(results), content)
+        return results
+
+    def search(self, term, limit=None):
+        # Returns up to limit paths, best matches first and by path within
+        # each rank.
+        term = term.strip().lower()
+        limit = limit or self.limit
+        results = []
+        seen = set()
+        if not term:
+            return results
+        if self.source is not None:
+            return self.rank(term, self.match_all(term), limit)
+        self.sort_lists()
+
+        def take(paths):
+            for path in heapq.nsmallest(limit - len(results), (p for p in paths if p not in seen)):
+                seen.add(path)
+                results.append(path)
+            return len(results) >= limit
+
+        if take(self.names.get(term, ())):
+            return results
+        i = bisect_left(self.name_list, term)
+        while i < len(self.name_list) and self.name_list[i].startswith(term):
+            if take(self.names[self.name_list[i]]):
+                return results
+            i += 1
+        if take(p for p in self.name_candidates(term) if term in p[-1].lower()):
+            return results
+        take(self.content_candidates(term))
+        return results
@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+from collections import namedtuple
+
+from blobstore import BlobStore, blob_dir
+from saver import write_json_atomic
+from sqlitestore import SEARCH_LIMIT, Storage, copy_blob, read_json_tree
+from streamload import StreamLoader
+from treemodel import ADDED, REMOVED, CHANGED, Entry, LazyFolder, from_json, is_entry, json_default
+
+MANIFEST = 'manifest.json'
+SHARD_DIR = 'shards'
+FORMAT = 'datatree-shards'
+# Folders this many levels down get a file of their own.
+DEFAULT_DEPTH = 1
+
+# What ShardStorage.snapshot hands to write: (file name, data) of each shard
+# to write, the manifest, the shard files it lists by path, and the changes
+# it covers.
+ShardSave = namedtuple('ShardSave', ['shards', 'manifest', 'files', 'dirty', 'dirty_below'])
+
+
+def is_manifest(file_path):
+    return os.path.basename(file_path) == MANIFEST
+
+
+def manifest_file(path):
+    # Accepts the directory of a sharded tree as well as its manifest.
+    return path if is_manifest(path) else os.path.join(path, MANIFEST)
+
+
+def read_shard(file_path):
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except RecursionError:
+        return StreamLoader(file_path).load()
+
+
+def search_rows(folder, prefix=(), depth=None):
+    # (path, lowercased name, lowercased content or None for a folder) for
+    # everything below folder, down to depth levels from the root. Lazy
+    # folders that were never opened are listed but not entered.
+    rows = []
+    stack = [(folder, prefix)]
+    while stack:
+        folder, prefix = stack.pop()
+        for name, node in folder.children.items():
+            path = prefix + (name,)
+            if is_entry(node):
+                rows.append((path, name.lower(), node.content.lower()))
+                continue
+            rows.append((path, name.lower(), None))
+            if node.loaded and (depth is None or len(path) < depth):
+                stack.append((node, path))
+    return rows
+
+
+def copy_folder(folder):
+    # The folders below folder as plain dicts, entries shared, for a writer
+    # on another thread. Lazy folders are fetched on the way.
+    root = dict(folder.children)
+    stack = [root]
+    while stack:
+        data = stack.pop()
+        for name, node in data.items():
+            if not is_entry(node):
+                data[name] = dict(node.children)
+                stack.append(data[name])
+    return root
+
+
+class ShardStorage(Storage):
+    # Tree stored as a directory: each folder depth levels down is a shard,
+    # one JSON file under shards/, and manifest.json holds the levels above
+    # with the shards left empty. A shard is read when its folder is opened
+    # or when a search reaches it. apply only notes which shards changed;
+    # save rewrites those and the manifest, and nothing else. The apps save
+    # through a SaveScheduler, which writes on a worker. Until then search and
+    # folder_paths still read a moved shard at its old path, so it does not
+    # count as writing back.
+    def __init__(self, file_path, depth=DEFAULT_DEPTH):
+        # depth only applies to a new tree; an existing one keeps its own.
+        self.file_path = file_path
+        self.directory = os.path.dirname(os.path.abspath(file_path))
+        self.root = None
+        self.top = []
+        # Shard path -> file name, as of the last load or save.
+        self.files = {}
+        # File name -> search_rows of that shard, kept once searched.
+        self.rows = {}
+        self.skeleton_rows = []
+        self.dirty = set()
+        self.dirty_below = set()
+        # The ShardSave being written, until saved.
+        self.writing = None
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                self.manifest = json.load(f)
+            if not isinstance(self.manifest, dict) or self.manifest.get('format') != FORMAT:
+                raise ValueError(f"{file_path} is not the manifest of a sharded tree.")
+        else:
+            if depth < 1:
+                raise ValueError("Shard depth must be at least 1.")
+            self.manifest = {"format": FORMAT, "version": 1, "depth": depth, "next": 1, "tree": {}, "shards": []}
+        self.depth = self.manifest['depth']
+        self.next_id = self.manifest['next']
+
+    def load(self):
+        root = from_json(self.manifest['tree'])
+        for path, name, size in self.manifest['shards']:
+            path = tuple(path)
+            parent = root
+            for part in path[:-1]:
+                parent = parent.children[part]
+            parent.children[path[-1]] = LazyFolder(path[-1], self, name, size)
+            self.files[path] = name
+        self.skeleton_rows = search_rows(root, (), self.depth)
+        self.top = list(root.children.values())
+        self.root = LazyFolder('', self, None, len(self.top))
+        return self.root
+
+    def replace(self, root):
+        # Writes root as the whole tree, e.g. for a new directory.
+        self.root = root
+        self.dirty_below.add(())
+        return self.save()
+
+    def shard_path(self, name):
+        return os.path.join(self.directory, SHARD_DIR, name)
+
+    def fetch_children(self, key):
+        if key is None:
+            return self.top
+        return list(from_json(read_shard(self.shard_path(key))).children.values())
+
+    def shard_rows(self, path):
+        name = self.files[path]
+        rows = self.rows.get(name)
+        if rows is None:
+            rows = self.rows[name] = search_rows(from_json(read_shard(self.shard_path(name))), path)
+        return rows
+
+    def all_rows(self):
+        yield self.skeleton_rows
+        for path in self.files:
+            yield self.shard_rows(path)
+
+    def folder_paths(self):
+        return [path for rows in self.all_rows() for path, _, content in rows if content is None]
+
+    def search(self, term, limit=SEARCH_LIMIT):
+        # Paths of nodes whose name or content contains term, reading every
+        # shard not yet searched.
+        term = term.strip().lower()
+        hits = set()
+        if not term:
+            return hits
+        for rows in self.all_rows():
+            for path, name, content in rows:
+                if term in name or (content is not None and term in content):
+                    hits.add(path)
+                    if len(hits) >= limit:
+                        return hits
+        return hits
+
+    def apply(self, changes):
+        for change in changes:
+            if change.kind not in (ADDED, REMOVED, CHANGED):
+                continue
+            if len(change.path) > self.depth:
+                self.dirty.add(change.path[:self.depth])
+            else:
+                self.dirty_below.add(change.path)
+
+    def touched(self, path):
+        return path in self.dirty or any(path[:i] in self.dirty_below for i in range(len(path) + 1))
+
+    def snapshot(self):
+        # Copies the shards apply saw change and builds the manifest, for
+        # write to put on disk. Returns None when nothing changed.
+        if self.writing is not None:
+            # The last write failed; what it held is still to be written.
+            self.dirty |= self.writing.dirty
+            self.dirty_below |= self.writing.dirty_below
+            self.writing = None
+        if self.root is None or not (self.dirty or self.dirty_below):
+            return None
+        tree = {}
+        shards = {}
+        stack = [(self.root, tree, ())]
+        while stack:
+            folder, data, prefix = stack.pop()
+            for name, node in folder.children.items():
+                path = prefix + (name,)
+                if is_entry(node):
+                    data[name] = json_default(node)
+                    continue
+                data[name] = {}
+                if len(path) == self.depth:
+                    shards[path] = node
+                else:
+                    stack.append((node, data[name], path))
+        written = [path for path in shards if path not in self.files or self.touched(path)]
+        files = {path: self.files[path] for path in shards if path in self.files}
+        # Copying also fetches a moved folder still waiting to be read from
+        # a file that is about to be overwritten.
+        copies = []
+        for path in written:
+            name = files.get(path)
+            if name is None:
+                name = files[path] = f"{self.next_id:06d}.json"
+                self.next_id += 1
+            copies.append((name, copy_folder(shards[path])))
+        manifest = {"format": FORMAT, "version": 1, "depth": self.depth, "next": self.next_id, "tree": tree,
+                    "shards": [[list(path), name, len(shards[path])] for path, name in files.items()]}
+        self.writing = ShardSave(copies, manifest, files, set(self.dirty), set(self.dirty_below))
+        self.dirty.clear()
+        self.dirty_below.clear()
+        return self.writing
+
+    def write(self, data):
+        # Writes the shards of a snapshot, then the manifest. Returns the
+        # bytes written.
+        if data is None:
+            return 0
+        os.makedirs(os.path.join(self.directory, SHARD_DIR), exist_ok=True)
+        size = 0
+        for name, shard in data.shards:
+            write_json_atomic(self.shard_path(name), shard, compact=True)
+            size += os.path.getsize(self.shard_path(name))
+        write_json_atomic(self.file_path, data.manifest, compact=True)
+        return size + os.path.getsize(self.file_path)
+
+    def saved(self):
+        # Only once the manifest no longer lists them are the files of
+        # shards that are gone deleted.
+        data, self.writing = self.writing, None
+        if data is None:
+            return
+        for name, _ in data.shards:
+            self.rows.pop(name, None)
+        for name in set(self.files.values()) - set(data.files.values()):
+            self.rows.pop(name, None)
+            try:
+                os.remove(self.shard_path(name))
+            except FileNotFoundError:
+                pass
+        self.manifest = data.manifest
+        self.files = data.files
+        self.skeleton_rows = search_rows(self.root, (), self.depth)
+
+
+def copy_blobs(root, source, target):
+    # Points every image below root at target, copying what it needs from
+    # source. Returns the number of nodes below root.
+    count = 0
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        children = folder.children
+        for name, node in list(children.items()):
+            count += 1
+            if not is_entry(node):
+                stack.append(node)
+            elif node.image:
+                children[name] = Entry(name, node.content, copy_blob(node.image, source, target))
+    return count
+
+
+def split_json(json_path, directory, depth=DEFAULT_DEPTH):
+    # Writes the tree in json_path as a sharded tree in directory, copying
+    # its images along. Returns the number of shards.
+    manifest_path = manifest_file(directory)
+    if os.path.exists(manifest_path):
+        raise ValueError(f"{manifest_path} already exists.")
+    root = read_json_tree(json_path)
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    copy_blobs(root, BlobStore(blob_dir(json_path)), BlobStore(blob_dir(manifest_path)))
+    store = ShardStorage(manifest_path, depth)
+    store.replace(root)
+    return len(store.files)
+
+
+def join_shards(directory, json_path):
+    # Reads every shard and writes the whole tree as one JSON document.
+    # Returns the number of nodes.
+    manifest_path = manifest_file(directory)
+    root = ShardStorage(manifest_path).load()
+    count = copy_blobs(root, BlobStore(blob_dir(manifest_path)), BlobStore(blob_dir(json_path)))
+    write_json_atomic(json_path, root.children)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert DataTree files between one JSON file and a sharded directory.")
+    parser.add_argument('command', choices=['split', 'join'], help="split: JSON file to directory, join: directory to JSON file")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help="level of the folders that get a file each (split only)")
+    args = parser.parse_args()
+    if args.command == 'split':
+        print(f"Wrote {split_json(args.source, args.target, args.depth)} shards to {args.target}")
+    else:
+        print(f"Joined {join_shards(args.source, args.target)} nodes into {args.target}")
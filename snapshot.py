@@ -0,0 +1,351 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import weakref
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate, chain
+
+from saver import copy_mode
+from sqlitestore import Storage, SEARCH_LIMIT
+from treemodel import Entry, LazyFolder
+
+MAGIC = b'DTSNAP01'
+NONE = 0xFFFFFFFF
+FOLDER = 0
+ENTRY = 1
+# Node columns, each an array of uint32 indexed by node id. Node 0 is the
+# root and the children of every folder are consecutive and sorted by name,
+# so a folder only needs the id of its first child and a count.
+COLUMNS = ('name', 'kind', 'content', 'image', 'parent', 'first_child', 'child_count')
+# After the node columns: the string table as offsets into a UTF-8 blob, the
+# same strings lowercased and NUL-terminated for search, and for every string
+# the nodes whose name or content it is.
+SECTIONS = COLUMNS + ('string_offsets', 'strings', 'lower_offsets', 'lower', 'ref_offsets', 'refs')
+HEADER = struct.Struct('<8sII' + 'Q' * len(SECTIONS))
+# Serializes snapshot writes, so a slow write of older data cannot land after
+# a newer one.
+write_lock = threading.Lock()
+# Open SnapshotStorages, which let go of their file while write_snapshot
+# replaces it.
+mapped = weakref.WeakSet()
+mapped_lock = threading.Lock()
+
+
+def snapshot_file(data_file):
+    return f"{data_file}.snap"
+
+
+def mapping(file_path):
+    file_path = os.path.abspath(file_path)
+    with mapped_lock:
+        return [storage for storage in mapped if storage.file_path == file_path and storage.views]
+
+
+def replace_mapped(tmp_path, file_path, moved):
+    # Windows cannot replace a file that is mapped, so the storages mapping
+    # file_path unmap it first and then map the new file, where moved gives
+    # each the new node ids of its folders.
+    storages = mapping(file_path)
+    for storage in storages:
+        storage.lock.acquire()
+    try:
+        for storage in storages:
+            storage.unmap()
+        replaced = False
+        try:
+            os.replace(tmp_path, file_path)
+            replaced = True
+        finally:
+            for storage in storages:
+                if replaced:
+                    storage.remap(moved.get(storage, {}))
+                else:
+                    storage.map_file()
+    finally:
+        for storage in storages:
+            storage.lock.release()
+
+
+def children_of(node):
+    # Accepts model nodes as well as the dicts of TreeModel.snapshot.
+    return node if isinstance(node, dict) else node.children
+
+
+def write_snapshot(root, file_path):
+    # Builds each column as a list and converts it once, working a folder at
+    # a time with comprehensions; strings are numbered in one pass at the end.
+    name_strings, contents, images = [''], [None], [None]
+    kinds, parents = [FOLDER], [NONE]
+    ranges = []
+    folders = [(0, children_of(root))]
+    # Storage -> {key: node id} of the folders that storages mapping
+    # file_path handed out, which they are fetched by until it is replaced.
+    moved = {storage: {} for storage in mapping(file_path)}
+    for node_id, children in folders:
+        order = sorted(children)
+        first = len(kinds)
+        ranges.append((node_id, first, len(order)))
+        nodes = list(map(children.__getitem__, order))
+        name_strings += order
+        parents += [node_id] * len(order)
+        kinds += [ENTRY if type(node) is Entry else FOLDER for node in nodes]
+        contents += [node.content if type(node) is Entry else None for node in nodes]
+        images += [node.image if type(node) is Entry else None for node in nodes]
+        folders += [(first + i, children_of(node)) for i, node in enumerate(nodes) if type(node) is not Entry]
+        if moved:
+            for i, node in enumerate(nodes):
+                if type(node) is LazyFolder and node.source in moved:
+                    moved[node.source][node.key] = first + i
+    strings = dict.fromkeys(chain(name_strings, contents, images))
+    strings.pop(None)
+    string_ids = dict(zip(strings, range(len(strings))))
+    string_ids[None] = NONE
+    names = list(map(string_ids.__getitem__, name_strings))
+    contents = list(map(string_ids.__getitem__, contents))
+    images = list(map(string_ids.__getitem__, images))
+    node_count = len(names)
+    first_child = [0] * node_count
+    child_count = [0] * node_count
+    for node_id, first, count in ranges:
+        first_child[node_id] = first
+        child_count[node_id] = count
+
+    # For each string, the nodes that use it as a name or as content: the
+    # (string, node) pairs sorted by string, and where each string's run
+    # starts.
+    entry_ids = [node_id for node_id in range(1, node_count) if kinds[node_id] == ENTRY]
+    keys = names[1:] + [contents[node_id] for node_id in entry_ids]
+    values = list(range(1, node_count)) + entry_ids
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    counts = Counter(keys)
+    ref_offsets = array('I', [0])
+    ref_offsets.extend(accumulate(map(counts.__getitem__, range(len(strings)))))
+
+    string_list = list(strings)
+    encoded = list(map(str.encode, string_list))
+    lowered = list(map(str.encode, map(str.lower, string_list)))
+    sections = {
+        'name': array('I', names),
+        'kind': array('I', kinds),
+        'content': array('I', contents),
+        'image': array('I', images),
+        'parent': array('I', parents),
+        'first_child': array('I', first_child),
+        'child_count': array('I', child_count),
+        'string_offsets': offsets_of(map(len, encoded)),
+        'strings': b''.join(encoded),
+        'lower_offsets': offsets_of(map((1).__add__, map(len, lowered))),
+        'lower': b'\0'.join(lowered) + b'\0',
+        'ref_offsets': ref_offsets,
+        'refs': array('I', map(values.__getitem__, order)),
+    }
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix='.tmp')
+    try:
+        write_sections(fd, node_count, len(strings), sections)
+        copy_mode(tmp_path, file_path)
+        replace_mapped(tmp_path, file_path, moved)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_sections(fd, node_count, string_count, sections):
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        positions = []
+        for name in SECTIONS:
+            # Sections start 8-byte aligned so they can be cast in place.
+            f.write(b'\0' * (-f.tell() % 8))
+            positions.append(f.tell())
+            data = sections[name]
+            f.write(data.tobytes() if isinstance(data, array) else data)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, node_count, string_count, *positions))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def offsets_of(lengths):
+    offsets = array('Q', [0])
+    offsets.extend(accumulate(lengths))
+    return offsets
+
+
+def save_snapshot(file_path, root, mtime=None):
+    # root must match file_path as of mtime (its current mtime by default);
+    # if the file has been rewritten since, the snapshot of the newer write
+    # supersedes this one. The snapshot is only a cache of the JSON file, so
+    # failing to write it is not an error worth reporting.
+    try:
+        if mtime is None:
+            mtime = os.path.getmtime(file_path)
+        with write_lock:
+            if os.path.getmtime(file_path) == mtime:
+                write_snapshot(root, snapshot_file(file_path))
+    except (OSError, ValueError):
+        pass
+
+
+def save_snapshot_async(file_path, root):
+    mtime = os.path.getmtime(file_path)
+    threading.Thread(target=save_snapshot, args=(file_path, root, mtime), name='snapshot', daemon=True).start()
+
+
+def open_snapshot(data_file):
+    # Returns a SnapshotStorage if a snapshot at least as new as data_file
+    # exists, else None.
+    path = snapshot_file(data_file)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(data_file):
+            return None
+        return SnapshotStorage(path)
+    except (OSError, ValueError):
+        return None
+
+
+class SnapshotStorage(Storage):
+    # Read-only tree served from a memory-mapped snapshot; folders are turned
+    # into nodes only when they are opened, and search scans the mapped
+    # string table without building nodes.
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        self.lock = threading.Lock()
+        # Keys handed out are node ids plus base. Keys from before the file
+        # was last replaced are below base and found in moved instead.
+        self.base = 0
+        self.moved = {}
+        self.views = []
+        self.map_file()
+        with mapped_lock:
+            mapped.add(self)
+
+    def map_file(self):
+        with open(self.file_path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.map) < HEADER.size:
+                raise ValueError(f"{self.file_path} is not a snapshot")
+            magic, self.node_count, self.string_count, *positions = HEADER.unpack_from(self.map)
+            if magic != MAGIC:
+                raise ValueError(f"{self.file_path} is not a snapshot")
+        except ValueError:
+            self.map.close()
+            raise
+        self.positions = dict(zip(SECTIONS, positions))
+        self.strings_start = self.positions['strings']
+        self.lower_start = self.positions['lower']
+        self.views = self.cast_sections()
+
+    def cast_sections(self):
+        # Typed views of the sections in self.map; returns every view made,
+        # all of which must be released before the map can be closed.
+        view = memoryview(self.map)
+        views = [view]
+        for name in COLUMNS:
+            start = self.positions[name]
+            views.append(view[start:start + 4 * self.node_count].cast('I'))
+            setattr(self, name, views[-1])
+        self.string_offsets = self.section(views, 'string_offsets', 8 * (self.string_count + 1), 'Q')
+        self.lower_offsets = self.section(views, 'lower_offsets', 8 * (self.string_count + 1), 'Q')
+        self.ref_offsets = self.section(views, 'ref_offsets', 4 * (self.string_count + 1), 'I')
+        self.refs = self.section(views, 'refs', 4 * self.ref_offsets[-1], 'I')
+        return views
+
+    def section(self, views, name, size, fmt):
+        start = self.positions[name]
+        views.append(views[0][start:start + size].cast(fmt))
+        return views[-1]
+
+    def unmap(self):
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.map.close()
+
+    def remap(self, moved):
+        # Maps the file write_snapshot has just put in place of the one
+        # mapped before. moved gives the new node id of each folder by the
+        # key it was handed out with.
+        self.base += self.node_count
+        self.moved = moved
+        self.map_file()
+
+    def close(self):
+        # Releases the mapping; nothing can be fetched afterwards.
+        with self.lock:
+            if self.views:
+                self.unmap()
+        with mapped_lock:
+            mapped.discard(self)
+
+    def string(self, sid):
+        if sid == NONE:
+            return None
+        start = self.strings_start + self.string_offsets[sid]
+        return self.map[start:self.strings_start + self.string_offsets[sid + 1]].decode('utf-8')
+
+    def load(self):
+        with self.lock:
+            return LazyFolder('', self, self.base, self.child_count[0])
+
+    def fetch_children(self, key):
+        with self.lock:
+            return self.nodes(key - self.base if key >= self.base else self.moved[key])
+
+    def nodes(self, folder_id):
+        nodes = []
+        first = self.first_child[folder_id]
+        for node_id in range(first, first + self.child_count[folder_id]):
+            name = self.string(self.name[node_id])
+            if self.kind[node_id] == ENTRY:
+                nodes.append(Entry(name, self.string(self.content[node_id]), self.string(self.image[node_id])))
+            else:
+                nodes.append(LazyFolder(name, self, self.base + node_id, self.child_count[node_id]))
+        return nodes
+
+    def path_of(self, node_id, names):
+        path = []
+        while node_id != 0:
+            if node_id not in names:
+                names[node_id] = (self.parent[node_id], self.string(self.name[node_id]))
+            node_id, name = names[node_id]
+            path.append(name)
+        return tuple(reversed(path))
+
+    def folder_paths(self):
+        names = {}
+        with self.lock:
+            return [self.path_of(node_id, names) for node_id in range(1, self.node_count) if self.kind[node_id] == FOLDER]
+
+    def search(self, term, limit=SEARCH_LIMIT):
+        with self.lock:
+            return self.find(term, limit)
+
+    def find(self, term, limit):
+        # Finds term in the lowercased string blob, then maps each matching
+        # string to the nodes that use it.
+        needle = term.strip().lower().encode('utf-8')
+        if not needle:
+            return set()
+        end = self.lower_start + self.lower_offsets[self.string_count]
+        pos = self.lower_start
+        node_ids = set()
+        while len(node_ids) < limit:
+            pos = self.map.find(needle, pos, end)
+            if pos == -1:
+                break
+            sid = bisect_right(self.lower_offsets, pos - self.lower_start) - 1
+            start = self.ref_offsets[sid]
+            node_ids.update(self.refs[start:min(self.ref_offsets[sid + 1], start + limit - len(node_ids))])
+            pos = self.lower_start + self.lower_offsets[sid + 1]
+        names = {}
+        return {self.path_of(node_id, names) for node_id in node_ids}
@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import sqlite3
+
+from blobstore import BlobStore, blob_dir, is_ref
+from compression import open_text
+from journal import Journal, journal_file
+from saver import write_json_atomic
+from streamload import StreamLoader, convert_tree
+from treemodel import ADDED, REMOVED, CHANGED, Entry, Folder, LazyFolder, coalesce, from_json, is_entry
+
+ROOT_ID = 1
+FOLDER = 'folder'
+ENTRY = 'entry'
+# Most hits a storage search returns.
+SEARCH_LIMIT = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER REFERENCES nodes(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    content TEXT,
+    image TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS nodes_parent ON nodes(parent_id, name);
+INSERT OR IGNORE INTO nodes (id, parent_id, name, kind) VALUES (1, NULL, '', 'folder');
+"""
+
+# Full-text index kept in step with nodes by triggers. The trigram tokenizer
+# makes MATCH a substring search, like the in-memory SearchIndex.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(
+    name, content, content='nodes', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS nodes_fts_insert AFTER INSERT ON nodes BEGIN
+    INSERT INTO nodes_fts (rowid, name, content) VALUES (new.id, new.name, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_fts_delete AFTER DELETE ON nodes BEGIN
+    INSERT INTO nodes_fts (nodes_fts, rowid, name, content) VALUES ('delete', old.id, old.name, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_fts_update AFTER UPDATE ON nodes BEGIN
+    INSERT INTO nodes_fts (nodes_fts, rowid, name, content) VALUES ('delete', old.id, old.name, old.content);
+    INSERT INTO nodes_fts (rowid, name, content) VALUES (new.id, new.name, new.content);
+END;
+"""
+
+
+class Storage:
+    # What a TreeModel needs from a backend that serves the tree lazily:
+    # load returns the root folder, whose LazyFolders call fetch_children as
+    # they are opened; apply writes model changes as they happen, or collects
+    # them for save to write. save is snapshot, taken on the Tk thread, then
+    # write, which may run on a worker, then saved back on the Tk thread.
+    # writes_back is True when apply writes them at once, so that search and
+    # folder_paths find what lies below a moved folder at its new path
+    # without the model fetching it.
+    writes_back = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def fetch_children(self, key):
+        raise NotImplementedError
+
+    def folder_paths(self):
+        raise NotImplementedError
+
+    def search(self, term, limit=SEARCH_LIMIT):
+        raise NotImplementedError
+
+    def apply(self, changes):
+        pass
+
+    def save(self):
+        # Returns the bytes written.
+        size = self.write(self.snapshot())
+        self.saved()
+        return size
+
+    def snapshot(self):
+        return None
+
+    def write(self, data):
+        # Returns the bytes written.
+        return 0
+
+    def saved(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteStorage(Storage):
+    # Tree stored one row per node in a SQLite file. Folders are fetched a
+    # level at a time and every model change is committed as its own
+    # transaction, so nothing is ever read or written whole.
+    writes_back = True
+
+    def __init__(self, file_path, fts=True):
+        self.file_path = file_path
+        self.conn = sqlite3.connect(file_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+        self.fts = False
+        if fts:
+            self.enable_fts()
+        self.conn.commit()
+
+    def enable_fts(self):
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'nodes_fts'").fetchone()
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            return  # SQLite built without FTS5 or the trigram tokenizer
+        if not exists:
+            self.conn.execute("INSERT INTO nodes_fts (nodes_fts) VALUES ('rebuild')")
+        self.fts = True
+
+    def load(self):
+        size = self.conn.execute("SELECT count(*) FROM nodes WHERE parent_id = ?", (ROOT_ID,)).fetchone()[0]
+        return LazyFolder('', self, ROOT_ID, size)
+
+    def fetch_children(self, key):
+        rows = self.conn.execute(
+            "SELECT id, name, kind, content, image,"
+            " (SELECT count(*) FROM nodes c WHERE c.parent_id = n.id)"
+            " FROM nodes n WHERE parent_id = ?", (key,))
+        nodes = []
+        for node_id, name, kind, content, image, size in rows:
+            if kind == ENTRY:
+                nodes.append(Entry(name, content, image))
+            else:
+                nodes.append(LazyFolder(name, self, node_id, size))
+        return nodes
+
+    def resolve(self, path):
+        node_id = ROOT_ID
+        for name in path:
+            row = self.conn.execute("SELECT id FROM nodes WHERE parent_id = ? AND name = ?", (node_id, name)).fetchone()
+            if row is None:
+                raise KeyError(path)
+            node_id = row[0]
+        return node_id
+
+    def path_of(self, node_id, names):
+        path = []
+        while node_id != ROOT_ID:
+            if node_id not in names:
+                names[node_id] = self.conn.execute("SELECT parent_id, name FROM nodes WHERE id = ?", (node_id,)).fetchone()
+            node_id, name = names[node_id]
+            path.append(name)
+        return tuple(reversed(path))
+
+    def folder_paths(self):
+        names = {}
+        rows = self.conn.execute("SELECT id FROM nodes WHERE kind = ? AND id != ?", (FOLDER, ROOT_ID)).fetchall()
+        return [self.path_of(node_id, names) for node_id, in rows]
+
+    def search(self, term, limit=SEARCH_LIMIT):
+        # Paths of nodes whose name or content contains term.
+        term = term.strip()
+        if not term:
+            return set()
+        if self.fts and len(term) >= 3:
+            query = '"' + term.replace('"', '""') + '"'
+            rows = self.conn.execute("SELECT rowid FROM nodes_fts WHERE nodes_fts MATCH ? LIMIT ?", (query, limit))
+        else:
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = self.conn.execute(
+                "SELECT id FROM nodes WHERE id != ? AND (name LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\') LIMIT ?",
+                (ROOT_ID, pattern, pattern, limit))
+        names = {}
+        return {self.path_of(node_id, names) for node_id, in rows.fetchall()}
+
+    def insert(self, parent_id, node):
+        # Inserts node and everything below it; returns the new row id.
+        stack = [(parent_id, node)]
+        top = None
+        while stack:
+            parent_id, node = stack.pop()
+            if is_entry(node):
+                cursor = self.conn.execute(
+                    "INSERT INTO nodes (parent_id, name, kind, content, image) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (parent_id, name) DO UPDATE SET content = excluded.content, image = excluded.image",
+                    (parent_id, node.name, ENTRY, node.content, node.image))
+            else:
+                cursor = self.conn.execute(
+                    "INSERT INTO nodes (parent_id, name, kind) VALUES (?, ?, ?)", (parent_id, node.name, FOLDER))
+                stack.extend((cursor.lastrowid, child) for child in node.children.values())
+            if top is None:
+                top = cursor.lastrowid
+        return top
+
+    def apply(self, changes):
+        # RESET and LOADED come from switching trees, not from edits.
+        with self.conn:
+            for change in coalesce(changes):
+                if change.kind in (ADDED, CHANGED):
+                    self.insert(self.resolve(change.path[:-1]), change.node)
+                elif change.kind == REMOVED:
+                    self.conn.execute("DELETE FROM nodes WHERE id = ?", (self.resolve(change.path),))
+
+    def close(self):
+        self.conn.close()
+
+
+def read_json_tree(file_path):
+    blobs = BlobStore(blob_dir(file_path))
+    try:
+        with open_text(file_path) as f:
+            data = json.load(f)
+        convert_tree(data, blobs.migrate)
+    except RecursionError:
+        data = StreamLoader(file_path, on_entry=blobs.migrate).load()
+    root = from_json(data)
+    Journal(journal_file(file_path)).replay(root)
+    return root
+
+
+def copy_blob(image, source, target):
+    if image and is_ref(image):
+        return target.put(source.get(image))
+    return image
+
+
+def import_json(json_path, db_path):
+    # Writes the tree in json_path into a new database in one transaction,
+    # copying its images into the database's blob directory.
+    if os.path.exists(db_path):
+        raise ValueError(f"{db_path} already exists.")
+    root = read_json_tree(json_path)
+    source = BlobStore(blob_dir(json_path))
+    target = BlobStore(blob_dir(db_path))
+    # The full-text index is built in one pass after the rows are in.
+    store = SqliteStorage(db_path, fts=False)
+    count = 0
+    try:
+        with store.conn:
+            next_id = ROOT_ID + 1
+            stack = [(ROOT_ID, root)]
+            rows = []
+            while stack:
+                parent_id, folder = stack.pop()
+                for node in folder.children.values():
+                    node_id = next_id
+                    next_id += 1
+                    if is_entry(node):
+                        rows.append((node_id, parent_id, node.name, ENTRY, node.content, copy_blob(node.image, source, target)))
+                    else:
+                        rows.append((node_id, parent_id, node.name, FOLDER, None, None))
+                        stack.append((node_id, node))
+                    if len(rows) >= 10000:
+                        store.conn.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", rows)
+                        count += len(rows)
+                        rows = []
+            store.conn.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            count += len(rows)
+        with store.conn:
+            store.enable_fts()
+    finally:
+        store.close()
+    return count
+
+
+def export_json(db_path, json_path):
+    # Reads every row once and writes the tree as a JSON document.
+    store = SqliteStorage(db_path)
+    source = BlobStore(blob_dir(db_path))
+    target = BlobStore(blob_dir(json_path))
+    try:
+        folders = {ROOT_ID: Folder()}
+        rows = store.conn.execute("SELECT id, parent_id, name, kind, content, image FROM nodes WHERE id != ? ORDER BY id", (ROOT_ID,))
+        pending = []
+        for node_id, parent_id, name, kind, content, image in rows:
+            node = Entry(name, content, copy_blob(image, source, target)) if kind == ENTRY else Folder(name)
+            if kind != ENTRY:
+                folders[node_id] = node
+            pending.append((parent_id, node))
+        for parent_id, node in pending:
+            folders[parent_id].children[node.name] = node
+        for folder in folders.values():
+            folder.names = sorted(folder.children)
+    finally:
+        store.close()
+    write_json_atomic(json_path, folders[ROOT_ID].children)
+    return len(pending)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert DataTree files between JSON and SQLite.")
+    parser.add_argument('command', choices=['import', 'export'], help="import: JSON to SQLite, export: SQLite to JSON")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+    if args.command == 'import':
+        print(f"Imported {import_json(args.source, args.target)} nodes into {args.target}")
+    else:
+        print(f"Exported {export_json(args.source, args.target)} nodes to {args.target}")
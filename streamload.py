@@ -0,0 +1,330 @@
+import codecs
+import json
+import os
+import queue
+import re
+import threading
+from json.decoder import scanstring
+
+from compression import decompressor
+from journal import apply_record
+from treemodel import Folder, from_json, index_tree
+
+CHUNK_SIZE = 64 * 1024
+POLL_MS = 50
+# Top-level items handed to the Tk thread per poll.
+BATCH_SIZE = 1000
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+SCALAR = re.compile(r'true|false|null|-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?')
+SCALARS = {'true': True, 'false': False, 'null': None}
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+decoder = json.JSONDecoder()
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def convert_tree(node, on_entry=None):
+    # Iterative convert_entries: plain string values inside folders become
+    # entry dicts, so arbitrarily deep trees do not hit the recursion limit.
+    count = 0
+    stack = [node]
+    while stack:
+        folder = stack.pop()
+        for key, val in list(folder.items()):
+            count += 1
+            if isinstance(val, str):
+                folder[key] = {"content": val, "image": None}
+            elif isinstance(val, dict) and 'content' in val:
+                if on_entry:
+                    on_entry(val)
+            elif isinstance(val, dict):
+                stack.append(val)
+    return count
+
+
+class StreamLoader:
+    # Incremental, non-recursive JSON parser for tree files. It reads the file
+    # in chunks, converts entries as each object closes and reports every
+    # completed top-level item through on_top_level. With keep_top_level off,
+    # items handed to on_top_level are not also kept in the returned dict.
+    # Compressed files are decompressed as they are read; bytes_read counts
+    # the compressed bytes, to go with total_bytes.
+    def __init__(self, file_path, on_entry=None, on_top_level=None, cancel=None, chunk_size=CHUNK_SIZE, keep_top_level=True):
+        self.file_path = file_path
+        self.on_entry = on_entry
+        self.on_top_level = on_top_level
+        self.keep_top_level = keep_top_level
+        self.cancel = cancel
+        self.chunk_size = chunk_size
+        self.total_bytes = os.path.getsize(file_path)
+        self.bytes_read = 0
+        self.offset = 0
+        self.nodes = 0
+
+    def load(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        with open(self.file_path, 'rb') as self.raw:
+            with decompressor(self.raw, self.file_path) as self.file:
+                return self.parse()
+
+    def fill(self, size=None):
+        if self.cancel is not None and self.cancel.is_set():
+            raise LoadCancelled()
+        chunk = self.file.read(max(size or 0, self.chunk_size))
+        self.offset += len(chunk)
+        self.bytes_read = self.raw.tell()
+        if chunk:
+            text = self.decoder.decode(chunk)
+        else:
+            self.eof = True
+            text = self.decoder.decode(b'', final=True)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+    def error(self, message):
+        return ValueError(f"{message} near byte {self.offset - len(self.buf) + self.pos} of {self.file_path}")
+
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise self.error("Unexpected end of JSON data")
+            self.fill()
+
+    def read_string(self):
+        while True:
+            try:
+                value, self.pos = scanstring(self.buf, self.pos + 1)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Grow geometrically so that huge strings are not rescanned
+                # once per chunk.
+                self.fill(len(self.buf))
+
+    def read_key(self):
+        if self.peek() != '"':
+            raise self.error("Expecting property name")
+        key = self.read_string()
+        if self.peek() != ':':
+            raise self.error("Expecting ':' delimiter")
+        self.pos += 1
+        return key
+
+    def read_scalar(self):
+        while True:
+            match = SCALAR.match(self.buf, self.pos)
+            # A match that touches the end of the buffer, or is followed by
+            # more number characters, may continue in the next chunk.
+            end = match.end() if match else len(self.buf)
+            if match and (self.eof or (end < len(self.buf) and self.buf[end] not in NUMBER_CHARS)):
+                break
+            if self.eof:
+                raise self.error("Expecting value")
+            self.fill()
+        self.pos = match.end()
+        text = match.group()
+        return SCALARS[text] if text in SCALARS else json.loads(text)
+
+    def read_flat_object(self):
+        # Entries are small objects with no nested objects; hand those to the
+        # C decoder in one call instead of tokenizing them here. The brace scan
+        # does not skip strings, so a '}' inside one can let a whole folder
+        # through; that is walked normally instead, so its entries are seen.
+        close = self.buf.find('}', self.pos)
+        if close == -1:
+            return None
+        nested = self.buf.find('{', self.pos + 1, close)
+        if nested != -1:
+            return None
+        try:
+            value, end = decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            return None
+        if any(isinstance(val, dict) for val in value.values()):
+            return None
+        self.pos = end
+        self.close_object(value)
+        return value
+
+    def close_object(self, obj):
+        self.nodes += 1
+        if 'content' in obj:
+            if self.on_entry:
+                self.on_entry(obj)
+            return
+        for key, val in obj.items():
+            if isinstance(val, str):
+                obj[key] = {"content": val, "image": None}
+                self.nodes += 1
+
+    def parse(self):
+        stack = []
+        keys = []
+        while True:
+            ch = self.peek()
+            if ch == '{':
+                in_folder = bool(stack) and isinstance(stack[-1], dict)
+                value = self.read_flat_object() if in_folder else None
+                if value is None:
+                    self.pos += 1
+                    if self.peek() == '}':
+                        self.pos += 1
+                        value = {}
+                    else:
+                        stack.append({})
+                        keys.append(self.read_key())
+                        continue
+            elif ch == '[':
+                self.pos += 1
+                if self.peek() == ']':
+                    self.pos += 1
+                    value = []
+                else:
+                    stack.append([])
+                    keys.append(None)
+                    continue
+            elif ch == '"':
+                value = self.read_string()
+            else:
+                value = self.read_scalar()
+            # Attach the finished value, then close every container that ends
+            # right after it.
+            while True:
+                if not stack:
+                    if not isinstance(value, dict):
+                        raise self.error("Tree file must contain a JSON object")
+                    self.pos = WHITESPACE.match(self.buf, self.pos).end()
+                    if self.pos < len(self.buf) or self.file.read(1).strip():
+                        raise self.error("Extra data")
+                    return value
+                container = stack[-1]
+                if isinstance(container, dict):
+                    if len(stack) == 1:
+                        if isinstance(value, str):
+                            value = {"content": value, "image": None}
+                            self.nodes += 1
+                        if self.on_top_level:
+                            self.on_top_level(keys[-1], value)
+                        if self.keep_top_level:
+                            container[keys[-1]] = value
+                    else:
+                        container[keys[-1]] = value
+                else:
+                    container.append(value)
+                ch = self.peek()
+                self.pos += 1
+                if ch == ',':
+                    if isinstance(container, dict):
+                        keys[-1] = self.read_key()
+                    break
+                if ch != ('}' if isinstance(container, dict) else ']'):
+                    raise self.error("Expecting ',' delimiter")
+                stack.pop()
+                keys.pop()
+                if isinstance(container, dict) and stack and isinstance(stack[-1], dict):
+                    self.close_object(container)
+                value = container
+
+
+class LoadJob:
+    # Runs a StreamLoader on a worker thread, turning each top-level item into
+    # model nodes there, and feeds progress and those nodes to the Tk thread by
+    # polling with root.after. The records of journal are replayed on the
+    # worker too, onto each top-level item before it is handed over, so no
+    # node changes once the Tk thread can see it. The path index for the
+    # result is built there as well. With perf, the work on the worker is
+    # timed as load_tree into timer, for on_done to record on the Tk thread.
+    def __init__(self, root, file_path, on_items, on_progress, on_done, on_entry=None, journal=None, perf=None):
+        self.root = root
+        self.on_items = on_items
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.journal = journal
+        self.perf = perf
+        self.timer = None
+        # Top-level name -> the journal records below it, in order.
+        self.records = {}
+        self.replayed = set()
+        self.cancel_event = threading.Event()
+        self.items = queue.Queue()
+        self.loader = StreamLoader(file_path, on_entry=on_entry, on_top_level=self.add_top_level, cancel=self.cancel_event, keep_top_level=False)
+        self.root_folder = Folder()
+        self.result = None
+        self.index = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.root.after(POLL_MS, self.poll)
+        return self
+
+    def add_top_level(self, name, value):
+        self.publish(name, from_json(value, name))
+
+    def publish(self, name, node):
+        # Records for different top-level names touch different nodes, so
+        # each name's can be replayed on its own.
+        records = self.records.get(name)
+        if records:
+            self.replayed.add(name)
+            folder = Folder()
+            if node is not None:
+                folder.set(node)
+            for record in records:
+                apply_record(folder, record)
+            node = folder.get(name)
+        if node is not None:
+            self.root_folder.set(node)
+            self.items.put(node)
+
+    def run(self):
+        if self.perf is not None:
+            self.timer = self.perf.start('load_tree')
+        try:
+            if self.journal is not None:
+                for record in self.journal.records():
+                    self.records.setdefault(record['path'][0], []).append(record)
+            self.loader.load()
+            # Items the file does not have that the journal adds.
+            for name in self.records:
+                if name not in self.replayed:
+                    self.publish(name, None)
+            self.index = index_tree(self.root_folder)
+            self.result = self.root_folder
+        except Exception as e:
+            self.error = e
+        if self.timer is not None:
+            self.timer.stop(nodes=len(self.index) if self.index is not None else None)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def poll(self):
+        done = not self.thread.is_alive()
+        batch = []
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self.items.get_nowait())
+            except queue.Empty:
+                break
+        if batch and not done and not self.cancel_event.is_set():
+            self.on_items(batch)
+        self.on_progress(self.loader.bytes_read, self.loader.total_bytes, self.loader.nodes)
+        if not done:
+            self.root.after(POLL_MS, self.poll)
+            return
+        if self.cancel_event.is_set() and self.error is None:
+            self.error = LoadCancelled()
+        self.on_done(self.result, self.error)
@@ -0,0 +1,93 @@
+import os
+
+from batch import delete_paths, move_paths
+from saver import write_json_atomic
+from shardstore import ShardStorage, manifest_file, split_json
+from snapshot import SnapshotStorage, snapshot_file, write_snapshot
+from sqlitestore import SqliteStorage, import_json
+from treemodel import from_json, is_entry
+
+# The backends that serve a tree lazily.
+KINDS = ('sqlite', 'shard', 'snapshot')
+# Words edits bring in, for searches to find.
+WORDS = ('needle', 'haystack', 'Mixed Case', 'ünïcode')
+
+
+class LazyStore:
+    # A copy of tree in one kind of backend, opened the way the apps open it.
+    def __init__(self, kind, directory, tree):
+        self.kind = kind
+        json_path = os.path.join(directory, 'tree.json')
+        write_json_atomic(json_path, tree)
+        if kind == 'sqlite':
+            self.path = os.path.join(directory, 'tree.db')
+            import_json(json_path, self.path)
+        elif kind == 'shard':
+            shards = os.path.join(directory, 'shards')
+            split_json(json_path, shards, depth=1)
+            self.path = manifest_file(shards)
+        else:
+            self.path = snapshot_file(json_path)
+            write_snapshot(from_json(tree), self.path)
+        self.storage = self.open()
+
+    def open(self):
+        if self.kind == 'sqlite':
+            return SqliteStorage(self.path)
+        if self.kind == 'shard':
+            return ShardStorage(self.path)
+        return SnapshotStorage(self.path)
+
+    def attach(self, model):
+        # A snapshot is read-only; the apps rewrite it from the model.
+        if self.kind != 'snapshot':
+            model.subscribe(self.storage.apply)
+
+    def save(self, model):
+        # Writes what model holds, as the apps would, and returns a second
+        # storage opened on the result.
+        if self.kind == 'shard':
+            self.storage.save()
+        elif self.kind == 'snapshot':
+            write_snapshot(model.snapshot(), self.path)
+        return self.open()
+
+
+def random_step(rng, models, histories, i):
+    # Makes one random edit, move, delete, undo or redo, the same in every
+    # model. Paths are picked from the first model, which must be fully
+    # indexed. Returns whether the models agreed on the outcome.
+    oracle = models[0]
+    paths = sorted(path for path in oracle.index if path)
+    # Folders are picked as often as entries, though there are far fewer.
+    path = rng.choice([p for p in paths if not is_entry(oracle.index[p])] if rng.random() < 0.5 else paths)
+    node = oracle.index[path]
+    action = rng.random()
+    # Folders the move could go to, though it may still be refused; its own
+    # folder, where it stays put, keeps the choice from being empty.
+    folders = [p for p in [()] + paths if not is_entry(oracle.index[p]) and path[-1] not in oracle.index[p]]
+    folders += [path[:-1]]
+    target = rng.choice(folders)
+    word = rng.choice(WORDS)
+    outcomes = []
+    for model, history in zip(models, histories):
+        try:
+            if action < 0.15:
+                history.undo()
+            elif action < 0.25:
+                history.redo()
+            elif action < 0.4:
+                delete_paths(model, [path])
+            elif action < 0.6:
+                move_paths(model, [path], target)
+            elif action < 0.75 and is_entry(node):
+                model.edit_entry(path, f"edit {i} {word}")
+            elif is_entry(node):
+                model.add_entry(path[:-1] + (f"new{i}",), f"e{i}", f"added {i} {word}")
+            else:
+                model.add_entry(path, f"e{i}", f"added {i} {word}")
+            outcomes.append(None)
+        except ValueError as e:
+            outcomes.append(str(e))
+    return len(set(outcomes)) == 1
+
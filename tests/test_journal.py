@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from benchmark import generate_tree
+from history import History
+from journal import Journal
+from lazystores import random_step
+from treemodel import TreeModel, from_json, to_json
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_replay_matches_model(tmp_path, seed):
+    rng = random.Random(seed)
+    tree, _ = generate_tree(300, seed=seed)
+    model = TreeModel(from_json(tree))
+    history = History(model)
+    journal = Journal(str(tmp_path / 'tree.json.journal'))
+    model.subscribe(journal.append)
+    for i in range(60):
+        random_step(rng, [model], [history], i)
+    root = from_json(tree)
+    journal.replay(root)
+    assert to_json(root) == to_json(model.root)
+
+
+def test_torn_write(tmp_path):
+    journal = Journal(str(tmp_path / 'tree.json.journal'))
+    model = TreeModel(from_json({}))
+    model.subscribe(journal.append)
+    model.add_entry(('a',), 'b', 'kept')
+    with open(journal.file_path, 'a') as f:
+        f.write('{"op": "added", "pa')
+    root = from_json({})
+    assert journal.replay(root) == 1
+    assert to_json(root) == {"a": {"b": {"content": "kept"}}}
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from benchmark import generate_tree
+from history import History
+from lazystores import KINDS, WORDS, LazyStore, random_step
+from searchindex import SearchIndex
+from treemodel import TreeModel, from_json, is_entry
+
+
+def brute_force(model, term):
+    term = term.strip().lower()
+    if not term:
+        return set()
+    return {path for path, node in model.index.items()
+            if path and (term in path[-1].lower() or (is_entry(node) and term in node.content.lower()))}
+
+
+def terms(rng, model):
+    # Whole words, parts of words and of names, and other cases.
+    found = list(WORDS) + [word.upper() for word in WORDS] + ['e1', 'f2', 'new', 'edit']
+    entries = [node.content for node in model.index.values() if is_entry(node) and node.content]
+    for content in rng.sample(entries, 10):
+        start = rng.randrange(len(content))
+        found.append(content[start:start + rng.randint(1, 8)])
+    return found
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('kind', KINDS)
+def test_matches_brute_force(tmp_path, kind, seed):
+    rng = random.Random(seed)
+    tree, _ = generate_tree(200, seed=seed)
+    store = LazyStore(kind, str(tmp_path), tree)
+    oracle = TreeModel(from_json(tree))
+    model = TreeModel(store.storage.load())
+    histories = [History(oracle), History(model)]
+    store.attach(model)
+    index = SearchIndex(model)
+    for i in range(60):
+        assert random_step(rng, [oracle, model], histories, i)
+        if i % 10 == 9:
+            for term in terms(rng, oracle):
+                expected = brute_force(oracle, term)
+                assert index.match_all(term) == expected, term
+                assert index.search(term, 20) == index.rank(term, expected, 20), term
+    store.storage.close()
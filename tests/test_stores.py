@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+from benchmark import generate_tree
+from history import History
+from lazystores import KINDS, LazyStore, random_step
+from treemodel import TreeModel, from_json, to_json
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('kind', KINDS)
+def test_matches_oracle(tmp_path, kind, seed):
+    # The same edits, moves, deletes, undos and redos on a plain model and
+    # on one served by the store leave the same tree, in the model and on
+    # disk.
+    rng = random.Random(seed)
+    tree, _ = generate_tree(200, seed=seed)
+    store = LazyStore(kind, str(tmp_path), tree)
+    oracle = TreeModel(from_json(tree))
+    model = TreeModel(store.storage.load())
+    histories = [History(oracle), History(model)]
+    store.attach(model)
+    for i in range(80):
+        assert random_step(rng, [oracle, model], histories, i)
+        assert sorted(model.folder_paths()) == sorted(oracle.folder_paths())
+        if i % 20 == 19:
+            saved = store.save(model)
+            assert to_json(saved.load()) == to_json(oracle.root)
+            saved.close()
+    assert to_json(model.root) == to_json(oracle.root)
+    store.storage.close()
@@ -0,0 +1,110 @@
+import gzip
+import json
+import random
+
+import pytest
+
+from journal import Journal
+from streamload import LoadJob, StreamLoader, convert_tree
+from treemodel import TreeModel, from_json, to_json
+
+
+def random_tree(rng, depth, fanout):
+    tree = {}
+    for i in range(rng.randint(0, fanout)):
+        kind = rng.random()
+        if kind < 0.3:
+            tree[f"s{i}"] = f"str {i} é \\ \" {{}} ☃"
+        elif kind < 0.6:
+            tree[f"e{i}"] = {"content": f"c{i} }} {{ \n\t", "image": None if i % 2 else "sha256:ab"}
+        elif depth > 0:
+            tree[f"f{i}"] = random_tree(rng, depth - 1, fanout)
+        else:
+            tree[f"n{i}"] = [1, 2.5, -3e2, True, False, None, {"a": "b"}]
+    return tree
+
+
+class PollingRoot:
+    # Just enough of Tk's after for LoadJob to poll from the test.
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, callback):
+        self.calls.append(callback)
+
+    def run(self, job):
+        job.thread.join()
+        while self.calls:
+            self.calls.pop(0)()
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('chunk_size', [1, 7, 64 * 1024])
+def test_matches_json_load(tmp_path, seed, chunk_size):
+    rng = random.Random(seed)
+    tree = random_tree(rng, 5, 7)
+    tree['empty'] = {}
+    text = json.dumps(tree, indent=rng.choice([None, 2]), ensure_ascii=rng.random() < 0.5)
+    path = tmp_path / 'tree.json'
+    path.write_text(text, encoding='utf-8')
+    expected = json.loads(text)
+    convert_tree(expected)
+    top = []
+    loader = StreamLoader(str(path), on_top_level=lambda name, value: top.append(name), chunk_size=chunk_size)
+    assert loader.load() == expected
+    assert top == list(expected)
+    assert loader.bytes_read == loader.total_bytes
+
+
+def test_compressed(tmp_path):
+    tree = random_tree(random.Random(7), 4, 6)
+    path = tmp_path / 'tree.json.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(tree, f)
+    expected = json.loads(json.dumps(tree))
+    convert_tree(expected)
+    assert StreamLoader(str(path), chunk_size=100).load() == expected
+
+
+@pytest.mark.parametrize('text', ['{"a":', '{"a" 1}', '{"a":1}x', '[1]', ''])
+def test_rejects_bad_json(tmp_path, text):
+    path = tmp_path / 'bad.json'
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        StreamLoader(str(path)).load()
+
+
+def test_deep_nesting(tmp_path):
+    path = tmp_path / 'deep.json'
+    path.write_text('{"a":' * 20000 + '{}' + '}' * 20000)
+    node = StreamLoader(str(path)).load()
+    for _ in range(20000):
+        node = node['a']
+    assert node == {}
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_load_job_replays_journal(tmp_path, seed):
+    rng = random.Random(seed)
+    tree = {f"t{i}": {f"e{j}": {"content": f"c{i}.{j}"} for j in range(3)} for i in range(5)}
+    path = tmp_path / 'tree.json'
+    path.write_text(json.dumps(tree))
+    journal = Journal(str(tmp_path / 'tree.json.journal'))
+    model = TreeModel(from_json(tree))
+    model.subscribe(journal.append)
+    for i in range(20):
+        top = rng.choice([f"t{n}" for n in range(7)])
+        action = rng.random()
+        if action < 0.2 and model.lookup((top,)) is not None:
+            model.delete((top,))
+        else:
+            model.add_entry((top, f"d{rng.randint(0, 2)}"), f"e{rng.randint(0, 3)}", f"edit {i}")
+    done = []
+    root = PollingRoot()
+    job = LoadJob(root, str(path), lambda items: None, lambda *progress: None, lambda data, error: done.append((data, error)),
+                  journal=journal).start()
+    root.run(job)
+    data, error = done[0]
+    assert error is None
+    assert to_json(data) == to_json(model.root)
+    assert set(job.index) == set(model.index)
@@ -0,0 +1,350 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from itertools import islice
+
+from blobstore import BlobStore, blob_dir, is_ref
+from compression import open_text
+from journal import Journal, journal_file
+from saver import COMPACT_THRESHOLD, write_json_atomic
+from searchindex import SearchIndex
+from shardstore import ShardStorage, is_manifest
+from snapshot import open_snapshot, save_snapshot
+from sqlitestore import SqliteStorage, copy_blob
+from streamload import StreamLoader, convert_tree
+from treemodel import ADDED, CHANGED, Change, Entry, Folder, TreeModel, from_json, is_entry
+
+# Same types the Select Image dialogs accept.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FORMATS = ('dir', 'csv', 'ndjson', 'json')
+NDJSON_CHUNK = 10000
+
+
+def read_tree(file_path, replay=True):
+    # Reads file_path as the apps do at startup: from its snapshot when that
+    # is at least as new, else by parsing the JSON, with the journal replayed
+    # on top unless replay is False. Folders of a snapshot are read as they
+    # are opened.
+    snapshot = open_snapshot(file_path)
+    if snapshot is not None:
+        root = snapshot.load()
+    else:
+        data = {}
+        if os.path.exists(file_path):
+            blobs = BlobStore(blob_dir(file_path))
+            try:
+                with open_text(file_path) as f:
+                    data = json.load(f)
+                convert_tree(data, blobs.migrate)
+            except RecursionError:
+                # Too deeply nested for json.load; parse without recursion.
+                data = StreamLoader(file_path, on_entry=blobs.migrate).load()
+        root = from_json(data)
+    if replay:
+        Journal(journal_file(file_path)).replay(root)
+    return root
+
+
+def split_path(path):
+    parts = path.strip('/').split('/')
+    if '' in parts:
+        parts = [part for part in parts if part]
+        if not parts:
+            raise ValueError(f"Invalid entry path: {path!r}")
+    return tuple(parts[:-1]), parts[-1]
+
+
+def bulk_add(root, records):
+    # Adds (parts, name, content, image) records to root in one pass. Folder
+    # name lists are sorted once at the end rather than on every insert.
+    # Returns the entry count and the changes a TreeModel would have
+    # reported, for backends that are written change by change.
+    folders = {(): root}
+    created = set()
+    touched = {}
+    changes = []
+    count = 0
+    for parts, name, content, image in records:
+        parts = tuple(parts)
+        folder = folders.get(parts)
+        if folder is None:
+            i = len(parts) - 1
+            while parts[:i] not in folders:
+                i -= 1
+            folder = folders[parts[:i]]
+            for j in range(i, len(parts)):
+                child = folder.children.get(parts[j])
+                if child is None:
+                    child = Folder(parts[j])
+                    folder.children[child.name] = child
+                    touched[id(folder)] = folder
+                    if id(folder) not in created:
+                        changes.append(Change(ADDED, parts[:j + 1], child))
+                    created.add(id(child))
+                elif is_entry(child):
+                    raise ValueError(f"'{parts[j]}' is an entry, cannot traverse into it.")
+                folder = folders[parts[:j + 1]] = child
+        existing = folder.children.get(name)
+        if existing is not None and not is_entry(existing):
+            raise ValueError(f"'{name}' is a folder, cannot overwrite with entry.")
+        entry = Entry(name, content, image)
+        folder.children[entry.name] = entry
+        touched[id(folder)] = folder
+        if id(folder) not in created:
+            changes.append(Change(CHANGED if existing is not None else ADDED, parts + (entry.name,), entry))
+        count += 1
+    for folder in touched.values():
+        folder.names = sorted(folder.children)
+    return count, changes
+
+
+def import_image(value, source_file, blobs):
+    # An image column holds a blob reference from the source file's own blob
+    # directory, or the path of an image file relative to the source file.
+    if not value:
+        return None
+    if is_ref(value):
+        return copy_blob(value, BlobStore(blob_dir(source_file)), blobs)
+    return blobs.put_file(os.path.join(os.path.dirname(os.path.abspath(source_file)), value))
+
+
+def read_directory(directory, blobs):
+    # Every file below directory becomes an entry at its relative path.
+    # Images become the entry's image with the file name as content; other
+    # files are read as text.
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        relative = os.path.relpath(dirpath, directory)
+        parts = () if relative == os.curdir else tuple(relative.split(os.sep))
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield parts, filename, filename, blobs.put_file(file_path)
+            else:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    yield parts, filename, f.read(), None
+
+
+def read_csv(file_path, blobs):
+    # Columns path, content and optionally image; path is '/'-separated and
+    # ends with the entry name.
+    with open(file_path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or 'path' not in reader.fieldnames or 'content' not in reader.fieldnames:
+            raise ValueError(f"{file_path} needs 'path' and 'content' columns.")
+        for row in reader:
+            parts, name = split_path(row['path'])
+            yield parts, name, row['content'], import_image(row.get('image'), file_path, blobs)
+
+
+def read_ndjson(file_path, blobs):
+    # One {"path": ..., "content": ..., "image": ...} object per line. Lines
+    # are parsed NDJSON_CHUNK at a time as one JSON array, which is several
+    # times faster than a json.loads call per line.
+    with open(file_path, 'r', encoding='utf-8') as f:
+        line_number = 0
+        while True:
+            lines = list(islice(f, NDJSON_CHUNK))
+            if not lines:
+                break
+            first_line = line_number + 1
+            line_number += len(lines)
+            numbered = [(i, line) for i, line in enumerate(lines, first_line) if line.strip()]
+            try:
+                records = json.loads('[' + ','.join(line for _, line in numbered) + ']')
+            except ValueError:
+                records = None
+            if records is None or len(records) != len(numbered):
+                records = []
+                for i, line in numbered:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError as e:
+                        raise ValueError(f"{file_path}:{i}: {e}")
+            for (i, _), record in zip(numbered, records):
+                try:
+                    parts, name = split_path(record['path'])
+                    content = record['content']
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{file_path}:{i}: {e}")
+                yield parts, name, content, import_image(record.get('image'), file_path, blobs)
+
+
+def iter_entries(root):
+    # (path, entry) for every entry below root, in path order.
+    stack = [((), iter(root.sorted_children()))]
+    while stack:
+        prefix, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        path = prefix + (child.name,)
+        if is_entry(child):
+            yield path, child
+        else:
+            stack.append((path, iter(child.sorted_children())))
+
+
+def guess_format(file_path):
+    if os.path.isdir(file_path):
+        return 'dir'
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return 'json'
+
+
+class TreeFile:
+    # A tree opened without the GUI: a JSON file, read through its snapshot
+    # and journal, a SQLite database or a sharded tree's manifest. Bulk
+    # changes are written with one save: one file write, one transaction, or
+    # one write of each shard touched.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.blobs = BlobStore(blob_dir(file_path))
+        self.store = None
+        self.journal = None
+        if file_path.endswith('.db'):
+            self.store = SqliteStorage(file_path)
+            self.root = self.store.load()
+        elif is_manifest(file_path):
+            self.store = ShardStorage(file_path)
+            self.root = self.store.load()
+        else:
+            self.journal = Journal(journal_file(file_path))
+            self.journal_mark = self.journal.mark()
+            self.root = read_tree(file_path)
+
+    def save(self, changes, compact=None):
+        if self.store is not None:
+            self.store.apply(changes)
+            self.store.save()
+            return
+        if compact is None:
+            compact = os.path.exists(self.file_path) and os.path.getsize(self.file_path) > COMPACT_THRESHOLD
+        write_json_atomic(self.file_path, self.root.children, compact)
+        save_snapshot(self.file_path, self.root)
+        # The file now holds everything the journal had.
+        self.journal.compact(self.journal_mark)
+
+    def import_records(self, records, compact=True):
+        count, changes = bulk_add(self.root, records)
+        self.save(changes, compact)
+        return count
+
+    def export(self, out_path, fmt, compact=True):
+        target = BlobStore(blob_dir(out_path))
+        count = 0
+        if fmt == 'json':
+            for _, entry in iter_entries(self.root):
+                copy_blob(entry.image, self.blobs, target)
+                count += 1
+            write_json_atomic(out_path, self.root.children, compact)
+            return count
+        with open(out_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f) if fmt == 'csv' else None
+            if writer is not None:
+                writer.writerow(['path', 'content', 'image'])
+            for path, entry in iter_entries(self.root):
+                image = copy_blob(entry.image, self.blobs, target)
+                if writer is not None:
+                    writer.writerow(['/'.join(path), entry.content, image or ''])
+                else:
+                    record = {"path": '/'.join(path), "content": entry.content}
+                    if image:
+                        record["image"] = image
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def query(self, path):
+        # Lines describing the node at path: an entry's content, or a
+        # folder's children with folders marked by a trailing '/'.
+        parts = tuple(part for part in path.strip('/').split('/') if part)
+        try:
+            node = TreeModel(self.root).node(parts)
+        except KeyError:
+            raise ValueError(f"No such path: {'/'.join(parts)}")
+        if is_entry(node):
+            lines = [node.content]
+            if node.image:
+                lines.append(f"image: {node.image}")
+            return lines
+        return [child.name if is_entry(child) else f"{child.name}/" for child in node.sorted_children()]
+
+    def search(self, term, limit):
+        model = TreeModel(self.root)
+        lines = []
+        for path in SearchIndex(model).search(term, limit):
+            node = model.node(path)
+            if is_entry(node):
+                lines.append(f"{'/'.join(path)}\t{node.content}")
+            else:
+                lines.append(f"{'/'.join(path)}/")
+        return lines
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m treecore', description="Work with DataTree files without the GUI, which this never imports.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('import', help="add the entries of a directory, CSV or NDJSON file to a tree")
+    command.add_argument('tree', help="JSON file, .db database or sharded tree's manifest.json to add to; created if missing")
+    command.add_argument('source')
+    command.add_argument('--format', choices=FORMATS[:3], help="default: from the source's extension")
+    command.add_argument('--into', default='', help="folder path to import under")
+    command.add_argument('--indent', dest='compact', action='store_false', help="write JSON with indentation, which is several times slower")
+    command = commands.add_parser('export', help="write every entry of a tree as JSON, CSV or NDJSON")
+    command.add_argument('tree')
+    command.add_argument('target')
+    command.add_argument('--format', choices=FORMATS[1:], help="default: from the target's extension")
+    command.add_argument('--indent', dest='compact', action='store_false', help="write JSON with indentation, which is several times slower")
+    command = commands.add_parser('query', help="print an entry, or list a folder")
+    command.add_argument('tree')
+    command.add_argument('path', nargs='?', default='')
+    command = commands.add_parser('search', help="print the best matches for a term")
+    command.add_argument('tree')
+    command.add_argument('term')
+    command.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    try:
+        tree = TreeFile(args.tree)
+        try:
+            if args.command == 'import':
+                fmt = args.format or guess_format(args.source)
+                into = tuple(part for part in args.into.strip('/').split('/') if part)
+                if fmt == 'dir':
+                    records = read_directory(args.source, tree.blobs)
+                elif fmt == 'csv':
+                    records = read_csv(args.source, tree.blobs)
+                else:
+                    records = read_ndjson(args.source, tree.blobs)
+                records = ((into + parts, name, content, image) for parts, name, content, image in records)
+                print(f"Imported {tree.import_records(records, args.compact)} entries into {args.tree}")
+            elif args.command == 'export':
+                fmt = args.format or guess_format(args.target)
+                print(f"Exported {tree.export(args.target, fmt, args.compact)} entries to {args.target}")
+            elif args.command == 'query':
+                print('\n'.join(tree.query(args.path)))
+            else:
+                print('\n'.join(tree.search(args.term, args.limit)))
+        finally:
+            tree.close()
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
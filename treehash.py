@@ -0,0 +1,165 @@
+import hashlib
+import threading
+
+from treecore import read_tree
+from treemodel import RESET, TreeModel, is_entry
+
+DIGEST_SIZE = 16
+POLL_MS = 50
+
+# Statuses diff reports for a path.
+LEFT_ONLY = 'left_only'
+RIGHT_ONLY = 'right_only'
+DIFFERENT = 'different'
+
+
+def entry_digest(entry):
+    # Names are hashed by the folder holding the entry, so renaming touches
+    # only that folder's digest.
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE, person=b'entry')
+    h.update(str(entry.content).encode('utf-8', 'surrogatepass'))
+    if entry.image is not None:
+        h.update(b'\0' + entry.image.encode('utf-8', 'surrogatepass'))
+    return h.digest()
+
+
+class TreeHash:
+    # Merkle digests of a TreeModel's folders. The cache mirrors the folder
+    # structure: a folder is [digest, {name: child}] where child is an
+    # entry's digest or the child folder's own list. Nothing is hashed until
+    # digest is asked for; after that a model change clears the digests of
+    # its ancestors and drops what was cached below it, so the next digest
+    # rehashes only the folders on changed paths.
+    def __init__(self, model):
+        self.model = model
+        self.cache = [None, {}]
+        self.model.subscribe(self.apply)
+
+    def apply(self, changes):
+        for change in changes:
+            if change.kind == RESET:
+                self.cache = [None, {}]
+                continue
+            cache = self.cache
+            cache[0] = None
+            for name in change.path[:-1]:
+                cache = cache[1].get(name)
+                if type(cache) is not list:
+                    break
+                cache[0] = None
+            else:
+                cache[1].pop(change.path[-1], None)
+
+    def digest(self):
+        # Post-order without recursion, since trees can be deeper than the
+        # recursion limit. Lazy folders are fetched as they are reached.
+        stack = [(self.model.root, self.cache, False)]
+        while stack:
+            folder, cache, ready = stack.pop()
+            if cache[0] is not None:
+                continue
+            cached = cache[1]
+            if not ready:
+                stack.append((folder, cache, True))
+                for name, child in folder.children.items():
+                    if is_entry(child):
+                        continue
+                    sub = cached.get(name)
+                    if type(sub) is not list:
+                        sub = cached[name] = [None, {}]
+                    if sub[0] is None:
+                        stack.append((child, sub, False))
+                continue
+            h = hashlib.blake2b(digest_size=DIGEST_SIZE, person=b'folder')
+            children = folder.children
+            for name in folder.names:
+                child = cached.get(name)
+                if type(child) is list:
+                    child = child[0]
+                elif child is None:
+                    child = cached[name] = entry_digest(children[name])
+                name = name.encode('utf-8', 'surrogatepass')
+                h.update(len(name).to_bytes(4, 'little') + name + child)
+            cache[0] = h.digest()
+        return self.cache[0]
+
+
+def diff(left, right):
+    # Compares two TreeHashes from the root down, descending only into
+    # folders whose digests differ. Returns {path: status}: LEFT_ONLY or
+    # RIGHT_ONLY for the topmost path that exists on one side only, and
+    # DIFFERENT for every path on both sides whose content differs, folders
+    # included. Where a folder faces an entry, the folder's children count
+    # as only on its side.
+    differences = {}
+    left.digest()
+    right.digest()
+    stack = [((), left.model.root, left.cache, right.model.root, right.cache)]
+    while stack:
+        path, a, a_cache, b, b_cache = stack.pop()
+        if a_cache[0] == b_cache[0]:
+            continue
+        if path:
+            differences[path] = DIFFERENT
+        a_children = a.children
+        b_children = b.children
+        for name, node in a_children.items():
+            other = b_children.get(name)
+            child_path = path + (name,)
+            if other is None:
+                differences[child_path] = LEFT_ONLY
+                continue
+            x = a_cache[1][name]
+            y = b_cache[1][name]
+            if is_entry(node) and is_entry(other):
+                if x != y:
+                    differences[child_path] = DIFFERENT
+            elif is_entry(node) or is_entry(other):
+                differences[child_path] = DIFFERENT
+                folder, status = (other, RIGHT_ONLY) if is_entry(node) else (node, LEFT_ONLY)
+                for child in folder.names:
+                    differences[child_path + (child,)] = status
+            elif x[0] != y[0]:
+                stack.append((child_path, node, x, other, y))
+        for name in b_children:
+            if name not in a_children:
+                differences[path + (name,)] = RIGHT_ONLY
+    return differences
+
+
+def file_hashes(file_path, replay=True):
+    # Digests of the tree as it is on disk, for comparing against the copy
+    # in memory; see read_tree for replay.
+    hashes = TreeHash(TreeModel(read_tree(file_path, replay)))
+    hashes.digest()
+    return hashes
+
+
+class FileHashJob:
+    # Runs file_hashes on a worker thread and calls on_done(hashes, error)
+    # on the Tk thread, polling with root.after like LoadJob.
+    def __init__(self, root, file_path, on_done, replay=True):
+        self.root = root
+        self.file_path = file_path
+        self.on_done = on_done
+        self.replay = replay
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.root.after(POLL_MS, self.poll)
+        return self
+
+    def run(self):
+        try:
+            self.result = file_hashes(self.file_path, self.replay)
+        except Exception as e:
+            self.error = e
+
+    def poll(self):
+        if self.thread.is_alive():
+            self.root.after(POLL_MS, self.poll)
+            return
+        self.on_done(self.result, self.error)
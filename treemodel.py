@@ -0,0 +1,458 @@
+import sys
+from bisect import bisect_left, insort
+from collections import namedtuple
+from contextlib import contextmanager
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+RESET = 'reset'
+# Top-level items arriving from a background load; shown like ADDED but not
+# journaled.
+LOADED = 'loaded'
+
+# path is a tuple of names from the root; node is the Folder or Entry now
+# stored there (None for REMOVED and RESET), and old the one it replaced or
+# removed, if any.
+Change = namedtuple('Change', ['kind', 'path', 'node', 'old'], defaults=(None,))
+
+
+def coalesce(changes):
+    # Drops the changes below a path ADDED earlier in the same notify. The
+    # node an ADDED change carries is the one in the tree, so by the time
+    # listeners see it, it already shows them; a backend writing it whole
+    # must not write them again.
+    added = set()
+    kept = []
+    for change in changes:
+        path = change.path
+        if any(path[:i] in added for i in range(1, len(path))):
+            continue
+        if change.kind == ADDED:
+            added.add(path)
+        kept.append(change)
+    return kept
+
+
+class Entry:
+    # Entries are never modified in place; edits replace the whole Entry, so
+    # snapshots and history can share them.
+    __slots__ = ('name', 'content', 'image')
+
+    def __init__(self, name, content, image=None):
+        self.name = sys.intern(name)
+        self.content = content
+        self.image = image
+
+
+class Folder:
+    # children maps name -> node; names holds the same names in sorted order.
+    __slots__ = ('name', 'children', 'names')
+    loaded = True
+
+    def __init__(self, name=''):
+        self.name = sys.intern(name)
+        self.children = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.children)
+
+    def __contains__(self, name):
+        return name in self.children
+
+    def get(self, name):
+        return self.children.get(name)
+
+    def set(self, node):
+        if node.name not in self.children:
+            insort(self.names, node.name)
+        self.children[node.name] = node
+
+    def remove(self, name):
+        node = self.children.pop(name)
+        del self.names[bisect_left(self.names, name)]
+        return node
+
+    def sorted_children(self):
+        children = self.children
+        return [children[name] for name in self.names]
+
+
+_children = Folder.children
+_names = Folder.names
+
+
+class LazyFolder(Folder):
+    # A folder whose children come from source.fetch_children(key) the first
+    # time children or names are touched. size is the child count reported
+    # by the source, so an unopened folder can tell whether it is empty.
+    __slots__ = ('source', 'key', 'size', 'loaded')
+
+    def __init__(self, name, source, key, size=0):
+        Folder.__init__(self, name)
+        self.source = source
+        self.key = key
+        self.size = size
+        self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        nodes = self.source.fetch_children(self.key)
+        _children.__set__(self, {node.name: node for node in nodes})
+        _names.__set__(self, sorted(node.name for node in nodes))
+
+    @property
+    def children(self):
+        self.load()
+        return _children.__get__(self)
+
+    @children.setter
+    def children(self, value):
+        _children.__set__(self, value)
+
+    @property
+    def names(self):
+        self.load()
+        return _names.__get__(self)
+
+    @names.setter
+    def names(self, value):
+        _names.__set__(self, value)
+
+    def __len__(self):
+        return len(self.children) if self.loaded else self.size
+
+
+def is_entry(node):
+    return type(node) is Entry
+
+
+def from_json(value, name=''):
+    # Builds nodes from the JSON shape ({"content": ..., "image": ...} for an
+    # entry, any other object for a folder) without recursion.
+    if isinstance(value, str):
+        return Entry(name, value)
+    if 'content' in value:
+        return Entry(name, value['content'], value.get('image'))
+    root = Folder(name)
+    stack = [(root, value)]
+    while stack:
+        folder, data = stack.pop()
+        children = folder.children
+        for key, val in data.items():
+            key = sys.intern(key)
+            if isinstance(val, str):
+                children[key] = Entry(key, val)
+            elif not isinstance(val, dict):
+                continue
+            elif 'content' in val:
+                children[key] = Entry(key, val['content'], val.get('image'))
+            else:
+                child = Folder(key)
+                children[key] = child
+                stack.append((child, val))
+        folder.names = sorted(children)
+    return root
+
+
+def index_tree(node, path=(), index=None):
+    # Maps the path of node and of everything below it to its node.
+    if index is None:
+        index = {}
+    index[path] = node
+    if is_entry(node):
+        return index
+    if not node.loaded:
+        return index
+    stack = [(node, path)]
+    while stack:
+        folder, prefix = stack.pop()
+        for name, child in folder.children.items():
+            child_path = prefix + (name,)
+            index[child_path] = child
+            # Lazy folders that were never opened add nothing below them.
+            if type(child) is not Entry and child.loaded:
+                stack.append((child, child_path))
+    return index
+
+
+def load_all(folder):
+    # Fetches every lazy folder below folder.
+    stack = [folder]
+    while stack:
+        stack.extend(node for node in stack.pop().children.values() if type(node) is not Entry)
+
+
+def json_default(node):
+    # default= hook for json.dump, so nodes serialize without first being
+    # copied into dicts.
+    if type(node) is Entry:
+        if node.image is None:
+            return {"content": node.content}
+        return {"content": node.content, "image": node.image}
+    if isinstance(node, Folder):
+        return node.children
+    raise TypeError(f"Object of type {type(node).__name__} is not JSON serializable")
+
+
+def to_json(node):
+    if is_entry(node):
+        return json_default(node)
+    root = {}
+    stack = [(node, root)]
+    while stack:
+        folder, data = stack.pop()
+        for name, child in folder.children.items():
+            if is_entry(child):
+                data[name] = json_default(child)
+            else:
+                data[name] = {}
+                stack.append((child, data[name]))
+    return root
+
+
+class TreeModel:
+    # index maps every path tuple to its node, so lookups never walk down from
+    # the root; the parent of path is index[path[:-1]]. Below lazy folders
+    # only what has been fetched is indexed; node() fetches the rest.
+    def __init__(self, root=None):
+        self.root = Folder() if root is None else root
+        self.index = index_tree(self.root)
+        self.listeners = []
+        self.pending = None
+        # True while listeners are told of changes that came from outside,
+        # e.g. merged in from the file on disk, which are neither undone nor
+        # journaled.
+        self.external = False
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        self.listeners.remove(callback)
+
+    @property
+    def source(self):
+        # The storage lazy folders are fetched from, if the tree has one.
+        return self.root.source if type(self.root) is LazyFolder else None
+
+    def notify(self, changes):
+        if self.pending is not None:
+            self.pending.extend(changes)
+            return changes
+        for callback in self.listeners:
+            callback(changes)
+        return changes
+
+    @contextmanager
+    def transaction(self, external=False):
+        # Changes made inside `with model.transaction():` reach subscribers as
+        # one notify when the block ends, so History keeps them as one step.
+        # external sets self.external for that notify; a nested transaction
+        # takes the flag of the outermost.
+        if self.pending is not None:
+            yield
+            return
+        self.pending = []
+        try:
+            yield
+        finally:
+            changes, self.pending = self.pending, None
+            if changes:
+                self.external = external
+                try:
+                    self.notify(changes)
+                finally:
+                    self.external = False
+
+    def reset(self, root, index=None):
+        # index may be built ahead of time, e.g. on a loader thread.
+        self.root = root
+        self.index = index_tree(root) if index is None else index
+        return self.notify([Change(RESET, (), None)])
+
+    def add_loaded(self, nodes):
+        changes = []
+        for node in nodes:
+            path = (node.name,)
+            self.unindex(path)
+            self.root.set(node)
+            index_tree(node, path, self.index)
+            changes.append(Change(LOADED, path, node))
+        return self.notify(changes)
+
+    def unindex(self, path):
+        node = self.index.pop(path, None)
+        if node is None or is_entry(node):
+            return
+        for child_path in index_tree(node, path):
+            self.index.pop(child_path, None)
+
+    def snapshot(self):
+        # Copies the folder structure into plain dicts for a background
+        # writer; entries are shared since they are never mutated. Lazy
+        # folders that were never opened cannot have changed, so they are
+        # handed over as fresh copies for the writer to fetch itself.
+        root = dict(self.root.children)
+        stack = [root]
+        while stack:
+            folder = stack.pop()
+            for name, node in folder.items():
+                if is_entry(node):
+                    continue
+                if not node.loaded:
+                    folder[name] = LazyFolder(node.name, node.source, node.key, node.size)
+                else:
+                    folder[name] = dict(node.children)
+                    stack.append(folder[name])
+        return root
+
+    def node(self, path):
+        path = tuple(path)
+        node = self.index.get(path)
+        if node is None:
+            node = self.materialize(path)
+        return node
+
+    def lookup(self, path):
+        try:
+            return self.node(path)
+        except KeyError:
+            return None
+
+    def materialize(self, path):
+        # Walks down from the deepest indexed ancestor, fetching lazy folders
+        # on the way and indexing each node it passes.
+        i = len(path) - 1
+        while path[:i] not in self.index:
+            i -= 1
+        node = self.index[path[:i]]
+        for j in range(i, len(path)):
+            if is_entry(node):
+                raise KeyError(path)
+            node = node.children[path[j]]
+            self.index[path[:j + 1]] = node
+        return node
+
+    def peek(self, path):
+        # Looks path up without fetching anything. Returns (exists, node);
+        # node is None when path lies below a folder that was never opened,
+        # where the source is still right since nothing there has changed.
+        node = self.root
+        for name in path:
+            if is_entry(node):
+                return False, None
+            if not node.loaded:
+                return True, None
+            node = node.children.get(name)
+            if node is None:
+                return False, None
+        return True, node
+
+    def parent(self, path):
+        return self.node(tuple(path)[:-1])
+
+    def folder_paths(self):
+        if self.source is not None:
+            # The source may predate edits made since it was opened.
+            paths = set(self.source.folder_paths())
+            paths.update(path for path, node in self.index.items() if path and not is_entry(node))
+            return [path for path in paths if self.peek(path)[0]]
+        return [path for path, node in self.index.items() if path and not is_entry(node)]
+
+    def find_parent(self, parts, message):
+        # Returns the deepest existing folder along parts and the names still
+        # missing below it, without creating anything.
+        parts = tuple(parts)
+        current = self.lookup(parts)
+        if current is not None and not is_entry(current):
+            return current, parts, []
+        current = self.root
+        for i, part in enumerate(parts):
+            child = self.lookup(parts[:i + 1])
+            if child is None:
+                return current, parts[:i], list(parts[i:])
+            if is_entry(child):
+                raise ValueError(message.format(part))
+            current = child
+        return current, parts, []
+
+    def make_folders(self, parts, message):
+        current, path, missing = self.find_parent(parts, message)
+        changes = []
+        if missing:
+            subtree = Folder(missing[0])
+            current.set(subtree)
+            path += (subtree.name,)
+            self.index[path] = subtree
+            changes.append(Change(ADDED, path, subtree))
+            for part in missing[1:]:
+                child = Folder(part)
+                subtree.set(child)
+                path += (child.name,)
+                self.index[path] = child
+                subtree = child
+            current = subtree
+        return current, changes
+
+    def add_folder(self, parts):
+        _, changes = self.make_folders(parts, "'{}' is an entry, cannot add folder inside it.")
+        return self.notify(changes)
+
+    def add_entry(self, parts, name, content, image=None):
+        message = "'{}' is an entry, cannot traverse into it."
+        current, _, missing = self.find_parent(parts, message)
+        if not missing and name in current and not is_entry(current.get(name)):
+            raise ValueError(f"'{name}' is a folder, cannot overwrite with entry.")
+        current, changes = self.make_folders(parts, message)
+        old = current.get(name)
+        entry = Entry(name, content, image)
+        current.set(entry)
+        path = tuple(parts) + (entry.name,)
+        self.index[path] = entry
+        if not changes:
+            changes.append(Change(ADDED if old is None else CHANGED, path, entry, old))
+        return self.notify(changes)
+
+    def edit_entry(self, path, content, image=None):
+        path = tuple(path)
+        parent = self.parent(path)
+        old = parent.get(path[-1])
+        entry = Entry(path[-1], content, image)
+        parent.set(entry)
+        self.index[path] = entry
+        return self.notify([Change(CHANGED, path, entry, old)])
+
+    def delete(self, path):
+        path = tuple(path)
+        old = self.parent(path).remove(path[-1])
+        self.unindex(path)
+        return self.notify([Change(REMOVED, path, None, old)])
+
+    def put(self, path, node):
+        # Stores node, with everything below it, at path in place of whatever
+        # is there. Undo and redo use it to hand back nodes taken out earlier.
+        # A source that does not write back still has unopened folders
+        # under their old paths, so a folder it serves is fetched whole and
+        # indexed here instead.
+        path = tuple(path)
+        source = self.source
+        if source is not None and not source.writes_back and not is_entry(node):
+            load_all(node)
+        parent = self.parent(path)
+        old = parent.get(path[-1])
+        changes = []
+        if old is not None and is_entry(old) and is_entry(node):
+            changes.append(Change(CHANGED, path, node, old))
+        else:
+            if old is not None:
+                parent.remove(path[-1])
+                changes.append(Change(REMOVED, path, None, old))
+            changes.append(Change(ADDED, path, node))
+        self.unindex(path)
+        parent.set(node)
+        index_tree(node, path, self.index)
+        return self.notify(changes)
@@ -0,0 +1,204 @@
+import os
+
+from snapshot import children_of
+from treehash import diff
+from treemodel import RESET, LOADED, is_entry, to_json
+
+WATCH_MS = 1000
+# Base of an edit whose original value is not known, e.g. one replayed from
+# the journal; any change on disk there is a conflict.
+UNKNOWN = object()
+# Base of a path that has not been edited.
+UNEDITED = object()
+
+
+def file_signature(file_path):
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class FileWatcher:
+    # Polls the stat of file_path every interval ms on the Tk thread and
+    # calls on_change(signature) when it differs from the last one seen.
+    # Nothing is looked at while paused() is true, e.g. while the app's own
+    # save is being written; call expect once it is.
+    def __init__(self, root, file_path, on_change, interval=WATCH_MS, paused=None):
+        self.root = root
+        self.file_path = file_path
+        self.on_change = on_change
+        self.interval = interval
+        self.paused = paused
+        self.signature = None
+        self.after_id = None
+        self.expect()
+
+    def start(self):
+        self.after_id = self.root.after(self.interval, self.poll)
+        return self
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def watch(self, file_path):
+        # Follows another file, e.g. after Load File; None watches nothing.
+        self.file_path = file_path
+        self.expect()
+
+    def expect(self):
+        # The file as it is now is known; only later changes are reported.
+        self.signature = file_signature(self.file_path) if self.file_path else None
+
+    def poll(self):
+        self.after_id = self.root.after(self.interval, self.poll)
+        if self.file_path is None or (self.paused and self.paused()):
+            return
+        signature = file_signature(self.file_path)
+        # A missing file is most likely mid-rename; wait for it to return.
+        if signature is not None and signature != self.signature:
+            self.signature = signature
+            self.on_change(signature)
+
+
+class LocalEdits:
+    # The paths of a TreeModel changed since its file was last read or
+    # written, each with its base: what the file held there (None for
+    # nothing), and the number of the change that last touched it. Changes
+    # below a listed path are covered by it. mark and saved bracket a save,
+    # so edits made while it is being written stay listed.
+    def __init__(self, model):
+        self.model = model
+        self.paths = {}
+        self.count = 0
+        self.model.subscribe(self.apply)
+
+    def reset(self, paths=()):
+        # The model was just read from its file, with paths replayed on top.
+        self.paths = {}
+        for path in paths:
+            self.touch(tuple(path), UNKNOWN)
+
+    def apply(self, changes):
+        if self.model.external:
+            return
+        for change in changes:
+            if change.kind == RESET:
+                self.paths = {}
+            elif change.kind != LOADED:
+                self.touch(change.path, change.old)
+
+    def touch(self, path, base):
+        self.count += 1
+        for i in range(1, len(path) + 1):
+            edit = self.paths.get(path[:i])
+            if edit is not None:
+                self.paths[path[:i]] = (edit[0], self.count)
+                return
+        below = [p for p in self.paths if p[:len(path)] == path]
+        for p in below:
+            del self.paths[p]
+        # What was under path has been edited, so old no longer shows the file.
+        self.paths[path] = (UNKNOWN if below else base, self.count)
+
+    def mark(self):
+        # Taken with the snapshot a save writes.
+        return self.count, {path: self.model.peek(path)[1] for path in self.paths}
+
+    def saved(self, mark):
+        # The file now holds what it held at mark; edits made since keep
+        # their paths, now based on what was written.
+        count, written = mark
+        self.paths = {path: (written.get(path, edit[0]), edit[1])
+                      for path, edit in self.paths.items() if edit[1] > count}
+
+    def base(self, path):
+        # What the file holds at path as far as the edits know: UNEDITED,
+        # UNKNOWN, None or a node.
+        for i in range(1, len(path) + 1):
+            edit = self.paths.get(path[:i])
+            if edit is None:
+                continue
+            node = edit[0]
+            for name in path[i:]:
+                if node is UNKNOWN or node is None or is_entry(node):
+                    return None if node is not UNKNOWN else UNKNOWN
+                node = children_of(node).get(name)
+            return node
+        if any(p[:len(path)] == path for p in self.paths):
+            return UNKNOWN
+        return UNEDITED
+
+    def rebase(self, path, node):
+        # The file now holds node at path, and the model keeps its own.
+        for i in range(1, len(path)):
+            if path[:i] in self.paths:
+                return
+        below = [p for p in self.paths if p[:len(path)] == path]
+        for p in below:
+            del self.paths[p]
+        self.paths[path] = (node, self.count)
+
+    def forget(self, path):
+        # The model now matches the file at and below path.
+        for p in [p for p in self.paths if p[:len(path)] == path]:
+            del self.paths[p]
+
+
+def same(a, b):
+    if a is None or b is None:
+        return a is b
+    if is_entry(a) or is_entry(b):
+        return is_entry(a) and is_entry(b) and a.content == b.content and a.image == b.image
+    return to_json(a) == to_json(b)
+
+
+def merge(hashes, disk_hashes, edits):
+    # Three-way merge of a tree read from disk into the model behind hashes,
+    # with edits holding the bases. Walks only the subtrees whose digests
+    # differ. Returns (moves, conflicts), lists of (path, node from disk or
+    # None where the disk has nothing): moves were changed on disk only,
+    # conflicts on disk and in the model alike.
+    model = hashes.model
+    disk = disk_hashes.model
+    moves = []
+    conflicts = []
+    handled = set()
+    for path in sorted(diff(hashes, disk_hashes)):
+        if any(path[:i] in handled for i in range(1, len(path))):
+            continue
+        mine = model.lookup(path)
+        theirs = disk.lookup(path)
+        if mine is not None and theirs is not None and not is_entry(mine) and not is_entry(theirs):
+            continue  # Both folders; what differs is further down.
+        handled.add(path)
+        base = edits.base(path)
+        if base is UNEDITED:
+            moves.append((path, theirs))
+        elif base is UNKNOWN or not same(base, theirs):
+            conflicts.append((path, theirs))
+    return moves, conflicts
+
+
+def apply_merge(model, edits, moves, conflicts, use_disk):
+    # Applies moves, and conflicts too if use_disk, as one external
+    # transaction: the edits do not count it as local, nor is it undone or
+    # journaled. Conflicts kept as they are in the model are rebased on the
+    # disk's version.
+    if use_disk:
+        moves = moves + conflicts
+    else:
+        for path, node in conflicts:
+            edits.rebase(path, node)
+    with model.transaction(external=True):
+        for path, node in moves:
+            if node is None:
+                model.delete(path)
+            else:
+                model.put(path, node)
+    if use_disk:
+        for path, _ in conflicts:
+            edits.forget(path)